@@ -0,0 +1,173 @@
+# Title: Startup benchmark
+# Author: Vinay Vitta | Qlik - QDI PS
+# Date: August 2025
+# Description: Measures run.py start-up (--help and time to the first QEM API call) and fails on regressions
+
+"""
+Startup benchmark for QEM Task Handler.
+
+Every scenario runs in fresh interpreters (median of --runs), minus the
+start-up of a bare interpreter, so the numbers are what the project adds:
+
+  help            python run.py --help
+  first_api_call  python run.py --action stop --mode A, until the login request
+                  would be sent (intercepted, nothing reaches QEM)
+
+The benchmark fails (exit code 1) when
+  - a scenario loads a module it must not need (e.g. requests for --help,
+    smtplib or http.server before the first API call), or
+  - a scenario is slower than its baseline by more than --tolerance
+    (plus --slack-ms for noise).
+
+Timings depend on the machine, so the baseline is recorded locally: on the
+first run, or with --update, if every scenario passed (default file:
+startup_baseline.json in the result path).
+
+Usage:
+    python benchmark_startup.py
+    python benchmark_startup.py --runs 20 --tolerance 0.1
+    python benchmark_startup.py --update
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+import tempfile
+import statistics
+import subprocess
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# scenario -> (run.py arguments, intercept the first API call, modules the scenario must not load)
+SCENARIOS = {
+    'help': (['--help'], False,
+             ('requests', 'urllib3', 'smtplib', 'sqlite3', 'http.server', 'multiprocessing')),
+    'first_api_call': (['--action', 'stop', '--mode', 'A', '--processes', '1'], True,
+                       ('smtplib', 'http.server', 'multiprocessing')),
+}
+
+# Runs run.py in a fresh interpreter and writes the loaded modules to MODULES_FILE
+# when argparse exits or, with INTERCEPT, when the first QEM API call would be sent
+_CHILD = r"""
+import os, sys, json
+sys.path.insert(0, {root!r})
+sys.argv = [os.path.join({root!r}, 'run.py')] + {argv!r}
+
+def dump_modules():
+    with open({modules_file!r}, 'w') as modules_file:
+        json.dump(sorted(sys.modules), modules_file)
+
+if {intercept!r}:
+    from restAPI import httpClient  # the run imports it before its first call anyway
+
+    def first_call(method, url, **kwargs):
+        dump_modules()
+        os._exit(0)
+
+    httpClient.set_transport(first_call)
+
+import run
+try:
+    run.main_launcher()
+except SystemExit:
+    pass
+dump_modules()
+os._exit(0 if not {intercept!r} else 3)
+"""
+
+
+def _timed(command, cwd):
+    started = time.perf_counter()
+    completed = subprocess.run(command, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    return time.perf_counter() - started, completed
+
+
+def measure(runs):
+    """
+    Returns {scenario: {'median_ms', 'overhead_ms', 'forbidden'}} and the bare interpreter start-up in ms.
+    """
+    # Relative log/result paths in config.yaml land in a scratch directory, not in the project
+    scratch = tempfile.mkdtemp(prefix="qem_startup_")
+    modules_file = os.path.join(scratch, "modules.json")
+    bare = statistics.median(_timed([sys.executable, "-c", "pass"], scratch)[0] for _ in range(runs)) * 1000
+
+    report = {}
+    for name, (argv, intercept, forbidden) in SCENARIOS.items():
+        command = [sys.executable, "-c", _CHILD.format(root=PROJECT_ROOT, argv=argv, intercept=intercept,
+                                                       modules_file=modules_file)]
+        _timed(command, scratch)  # warm-up: bytecode caches, file system caches
+        timings = []
+        for _ in range(runs):
+            seconds, completed = _timed(command, scratch)
+            if completed.returncode != 0:
+                raise RuntimeError(f"Scenario '{name}' exited with {completed.returncode}: "
+                                   f"{completed.stderr.decode(errors='replace')[-2000:]}")
+            timings.append(seconds * 1000)
+        with open(modules_file, encoding='utf-8') as loaded:
+            modules = set(json.load(loaded))
+        median_ms = statistics.median(timings)
+        report[name] = {'median_ms': round(median_ms, 1), 'overhead_ms': round(median_ms - bare, 1),
+                        'modules': len(modules), 'forbidden': sorted(set(forbidden) & modules)}
+    return report, round(bare, 1)
+
+
+def get_baseline_path():
+    from qemTasksHandler import configParser
+    config = configParser.load_config()
+    return os.path.join(config['logging']['result_path'], "startup_baseline.json")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark run.py start-up and fail on regressions")
+    parser.add_argument("--runs", type=int, default=10, help="Interpreter starts per scenario (default: 10)")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed slowdown against the baseline, as a fraction (default: 0.2)")
+    parser.add_argument("--slack-ms", type=float, default=15.0,
+                        help="Allowed slowdown in ms on top of --tolerance, for noise (default: 15)")
+    parser.add_argument("--baseline", type=str, help="Baseline file (default: startup_baseline.json in result_path)")
+    parser.add_argument("--update", action="store_true", help="Record the measured timings as the new baseline")
+    args = parser.parse_args(argv)
+
+    baseline_path = args.baseline or get_baseline_path()
+    baseline = {}
+    if os.path.exists(baseline_path) and not args.update:
+        with open(baseline_path, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file).get('overhead_ms', {})
+
+    report, bare_ms = measure(max(1, args.runs))
+    print(f"Bare interpreter start-up: {bare_ms} ms (subtracted below)")
+    failed = False
+    for name, row in report.items():
+        limit = baseline[name] * (1 + args.tolerance) + args.slack_ms if name in baseline else None
+        status = "ok"
+        if row['forbidden']:
+            status = f"FAIL - loads {', '.join(row['forbidden'])}"
+        elif limit is not None and row['overhead_ms'] > limit:
+            status = f"FAIL - slower than baseline {baseline[name]} ms (limit {limit:.1f} ms)"
+        elif limit is None:
+            status = "no baseline"
+        failed = failed or status.startswith("FAIL")
+        print(f"  {name:<15} {row['overhead_ms']:>7.1f} ms  ({row['modules']} modules)  {status}")
+
+    if (args.update or not baseline) and failed:
+        print("Baseline not written: a scenario failed.")
+    elif args.update or not baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(baseline_path)), exist_ok=True)
+        with open(baseline_path, 'w', encoding='utf-8') as baseline_file:
+            json.dump({'recorded_at': datetime.datetime.now().isoformat(timespec='seconds'),
+                       'python': sys.version.split()[0], 'runs': args.runs,
+                       'overhead_ms': {name: row['overhead_ms'] for name, row in report.items()}},
+                      baseline_file, indent=2)
+        print(f"Baseline written to {baseline_path}")
+
+    if failed:
+        print("\n❌ Start-up regressed.")
+        sys.exit(1)
+    print("\n✅ Start-up within budget.")
+
+
+if __name__ == "__main__":
+    main()
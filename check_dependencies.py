@@ -16,6 +16,7 @@ Usage:
 """
 
 import sys
+import importlib.util
 
 # External packages (install via pip)
 external_packages = [
@@ -46,10 +47,15 @@ missing = []
 
 
 def check_import(module_name):
+    # Locates the module without running it: importing the project modules would load
+    # the config, open the log file and pull in every dependency just to check presence
     try:
-        __import__(module_name)
+        found = importlib.util.find_spec(module_name) is not None
+    except ImportError:  # parent package missing
+        found = False
+    if found:
         print(f"✔ Module '{module_name}' is present.")
-    except ImportError:
+    else:
         print(f"✘ Module '{module_name}' is MISSING.")
         missing.append(module_name)
 
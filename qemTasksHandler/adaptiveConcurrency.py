@@ -0,0 +1,127 @@
+# Title: Adaptive concurrency
+# Author: Vinay Vitta | Qlik - QDI PS
+# Date: August 2025
+# Description: AIMD limit for in-flight tasks driven by QEM API latency and error rate
+
+import threading
+from qemTasksHandler import configParser, runControl
+from qemTasksHandler.myLogger import get_logger
+
+config = configParser.load_config()
+logger = get_logger(config)
+
+
+def is_enabled(settings):
+    return bool(settings.get('adaptive_concurrency', False))
+
+
+def bounds(settings, parallel_threads, ceiling=None):
+    """
+    Returns (initial, minimum, maximum) in-flight tasks. parallel_threads is
+    the starting point; adaptive_max_threads defaults to 4x parallel_threads
+    and is capped by ceiling (e.g. restart_max_down).
+    """
+    minimum = max(1, int(settings.get('adaptive_min_threads', 1)))
+    maximum = int(settings.get('adaptive_max_threads') or 4 * parallel_threads)
+    if ceiling:
+        minimum, maximum = min(minimum, ceiling), min(maximum, ceiling)
+    maximum = max(minimum, maximum)
+    return max(minimum, min(parallel_threads, maximum)), minimum, maximum
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class AdaptiveConcurrency:
+    """
+    Additive-increase / multiplicative-decrease limit on in-flight tasks.
+
+    httpClient reports the latency and outcome of every call sent to the QEM
+    host (record()). Once per window (adaptive_window_seconds, at least
+    adaptive_min_samples calls) the p90 latency is compared with the lowest
+    p90 seen so far:
+    - error rate above adaptive_max_error_rate, or p90 above baseline times
+      adaptive_latency_tolerance: limit *= adaptive_backoff (fast back-off);
+    - otherwise, if the limit was reached during the window: limit += 1.
+    Calls sent before the last decrease are ignored for latency, so one slow
+    spell is not punished twice. Every change is logged and kept in timeline.
+    """
+
+    def __init__(self, name, settings, parallel_threads, ceiling=None):
+        self.name = name
+        self.limit, self.minimum, self.maximum = bounds(settings, parallel_threads, ceiling)
+        self.window_seconds = float(settings.get('adaptive_window_seconds', 10))
+        self.min_samples = int(settings.get('adaptive_min_samples', 20))
+        self.latency_tolerance = float(settings.get('adaptive_latency_tolerance', 2.0))
+        self.max_error_rate = float(settings.get('adaptive_max_error_rate', 0.05))
+        self.backoff = float(settings.get('adaptive_backoff', 0.5))
+        self.baseline = None
+        self.started_at = runControl.monotonic()
+        self.timeline = [(0.0, self.limit)]
+        self._window_started = self.started_at
+        self._decreased_at = None
+        self._latencies = []
+        self._calls = 0
+        self._errors = 0
+        self._peak_in_flight = 0
+        self._lock = threading.Lock()
+
+    def note_in_flight(self, in_flight):
+        """
+        Called by the scheduling loop whenever it submits work.
+        """
+        with self._lock:
+            self._peak_in_flight = max(self._peak_in_flight, in_flight)
+
+    def record(self, latency_seconds, failed):
+        """
+        Records one QEM API call: its latency and whether it failed (connection
+        error, timeout, HTTP 429 or 5xx).
+        """
+        with self._lock:
+            now = runControl.monotonic()
+            self._calls += 1
+            self._errors += bool(failed)
+            if not failed and (self._decreased_at is None or now - latency_seconds >= self._decreased_at):
+                self._latencies.append(latency_seconds)
+            if now - self._window_started >= self.window_seconds and self._calls >= self.min_samples:
+                self._adjust(now)
+
+    def _adjust(self, now):
+        error_rate = self._errors / self._calls
+        p90 = _percentile(self._latencies, 0.9) if self._latencies else None
+        if p90 is not None and (self.baseline is None or p90 < self.baseline):
+            self.baseline = p90
+        previous = self.limit
+        if error_rate > self.max_error_rate or (p90 is not None and p90 > self.baseline * self.latency_tolerance):
+            self.limit = max(self.minimum, int(self.limit * self.backoff))
+            self._decreased_at = now
+        elif self._peak_in_flight >= self.limit:
+            self.limit = min(self.maximum, self.limit + 1)
+
+        details = ("p90 latency %s, baseline %.2fs, errors %.0f%% of %d call(s)"
+                   % ("n/a" if p90 is None else f"{p90:.2f}s", self.baseline or 0, error_rate * 100, self._calls))
+        if self.limit != previous:
+            self.timeline.append((round(now - self.started_at, 1), self.limit))
+            logger.info("Adaptive concurrency for '%s': %d -> %d (%s).", self.name, previous, self.limit, details)
+        else:
+            logger.debug("Adaptive concurrency for '%s': %d (%s).", self.name, self.limit, details)
+        self._window_started = now
+        self._latencies = []
+        self._calls = self._errors = 0
+        self._peak_in_flight = 0
+
+    def summary(self):
+        """
+        Returns the limit over time as 'seconds=limit' steps plus its range and time-weighted mean.
+        """
+        with self._lock:
+            end = runControl.monotonic() - self.started_at
+            steps = self.timeline + [(end, self.timeline[-1][1])]
+        weighted = sum((later[0] - earlier[0]) * earlier[1] for earlier, later in zip(steps, steps[1:]))
+        mean = weighted / end if end > 0 else steps[0][1]
+        limits = [limit for _, limit in self.timeline]
+        return {'min': min(limits), 'max': max(limits), 'mean': round(mean, 1), 'changes': len(self.timeline) - 1,
+                'timeline': ", ".join(f"{seconds:g}s={limit}" for seconds, limit in self.timeline)}
@@ -14,9 +14,10 @@ logger = get_logger(config)
 logger.info("Initiating backup of task status...")
 
 
-def get_backup_filename(config):
+def get_backup_filename(config, server_name=None, qem_hostname=None):
     """
-    Constructs the logfile name based on the config and current timestamp.
+    Constructs the backup file name based on the config, QEM host, server name and current timestamp.
+    Host and server name keep backups taken within the same second apart.
     """
     try:
         backup_dir = config['backup']['backup_path']
@@ -26,7 +27,12 @@ def get_backup_filename(config):
         os.makedirs(backup_dir, exist_ok=True)
 
         date_str = datetime.datetime.now().strftime("%Y_%m_%dT%H_%M_%S")
-        backup_file_name = f"QEM_TaskList_backup_{date_str}.csv"
+        name_parts = [part for part in (qem_hostname, server_name) if part]
+        if name_parts:
+            safe_name = "".join(c if c.isalnum() or c in "-_." else "_" for c in "_".join(name_parts))
+            backup_file_name = f"QEM_TaskList_backup_{safe_name}_{date_str}.csv"
+        else:
+            backup_file_name = f"QEM_TaskList_backup_{date_str}.csv"
         backup_file_path = os.path.join(backup_dir, backup_file_name)
 
         return backup_file_path
@@ -44,7 +50,10 @@ def write_task_list_to_csv(task_data, filename="task_list.csv"):
     Writes the task list JSON to a CSV file.
     Expects JSON in the format:
     {"taskList": [ {task1}, {task2}, ... ]}
+    or a list of records.TaskRecord (written with the name/state columns that mode F reads).
     """
+    if isinstance(task_data, list):
+        task_data = {'taskList': [{'name': task.task_name, 'state': task.state} for task in task_data]}
     if not task_data or 'taskList' not in task_data:
         logger.error("No valid task list found in the data.")
         return
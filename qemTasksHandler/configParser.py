@@ -3,9 +3,12 @@
 # Date: August 2025
 # Description: Read YAML config - parse
 
-import os, yaml
+import os, copy, threading, yaml
 from qemTasksHandler.myLogger import get_logger
 
+_cache = {}  # config path -> (modification time, parsed config)
+_cache_lock = threading.Lock()
+
 
 def get_config_path(filename="config.yaml"):
     """
@@ -30,12 +33,21 @@ def load_config(filename="config.yaml"):
     """
     Loads and parses the YAML configuration file.
     Returns a dictionary or None on failure.
+
+    The parsed file is cached until its modification time changes (stop/resume
+    reload it for every task); every caller gets its own copy.
     """
     config_path = get_config_path(filename)
-    if not os.path.exists(config_path):
+    try:
+        modified = os.stat(config_path).st_mtime_ns
+    except FileNotFoundError:
         raise FileNotFoundError(f"Config file not found: {config_path}")
-    with open(config_path, 'r') as file:
-        return yaml.safe_load(file) or {}
+    with _cache_lock:
+        cached = _cache.get(config_path)
+        if cached is None or cached[0] != modified:
+            with open(config_path, 'r') as file:
+                cached = _cache[config_path] = (modified, yaml.safe_load(file) or {})
+        return copy.deepcopy(cached[1])
 
 
 config = load_config()
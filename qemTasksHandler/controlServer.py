@@ -0,0 +1,324 @@
+# Title: Control API
+# Author: Vinay Vitta | Qlik - QDI PS
+# Date: August 2025
+# Description: Local HTTP control API - trigger stop/resume/status without process start-up
+
+"""
+Endpoints (JSON):
+    POST /runs              {"action": "stop|resume|status", "server": "...", "tasks": [...],
+                             "mode": "S|A", "qem_host": "..."}  -> 202 {"run_id": "..."}
+    GET  /runs              -> summary of recent runs
+    GET  /runs/<id>         -> run status with the results so far
+    GET  /runs/<id>/events  -> progress streamed as newline-delimited JSON until the run ends
+    GET  /health            -> {"status": "ok"}
+
+If settings.control_api_token is set, every request must send it in the
+X-Control-Token header.
+"""
+
+import json
+import time
+import uuid
+import threading
+import collections
+import concurrent.futures
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from qemTasksHandler import configParser, utils, runControl, fleetStatus, records
+from qemTasksHandler.myLogger import get_logger
+from restAPI import login, httpClient
+
+config = configParser.load_config()
+logger = get_logger(config)
+
+MAX_RETAINED_RUNS = 200
+
+
+class Run:
+    """
+    One control API request: its tasks, results and progress events.
+    """
+
+    def __init__(self, run_id, request):
+        self.run_id = run_id
+        self.request = request
+        self.action = request['action']
+        self.state = 'queued'
+        self.total = 0
+        self.results = []
+        self.events = []
+        self.created = time.time()
+        self._condition = threading.Condition()
+
+    def add_event(self, event, **fields):
+        with self._condition:
+            self.events.append({'event': event, 'time': time.time(), **fields})
+            self._condition.notify_all()
+
+    def finish(self, state):
+        self.state = state
+        self.add_event('run_' + state, completed=len(self.results), total=self.total)
+
+    @property
+    def finished(self):
+        return self.state in ('done', 'failed')
+
+    def wait_for_events(self, seen, timeout=15):
+        """
+        Blocks until there are events after index `seen` (or timeout) and returns them.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: len(self.events) > seen or self.finished, timeout=timeout)
+            return self.events[seen:]
+
+    def summary(self, with_results=False):
+        data = {'run_id': self.run_id, 'action': self.action, 'state': self.state,
+                'total': self.total, 'completed': len(self.results), 'request': self.request}
+        if with_results:
+            data['results'] = self.results
+        return data
+
+
+class ControlService:
+    """
+    Holds the long-lived executor, login tokens and runs shared by all requests.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.host_configs = utils.get_qem_host_configs(config)
+        for host_config in self.host_configs:
+            httpClient.configure_host(host_config['qem_host'].get('qem_hostname'), host_config['settings'])
+        parallel_threads = int(config['settings'].get('parallel_threads', config.get('parallel_threads', 5)))
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=parallel_threads,
+                                                              thread_name_prefix="control-task")
+        self.runs = collections.OrderedDict()
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    def _host_config(self, qem_hostname=None):
+        if not qem_hostname:
+            return self.host_configs[0]
+        for host_config in self.host_configs:
+            if host_config['qem_host'].get('qem_hostname', '').lower() == qem_hostname.lower():
+                return host_config
+        raise ValueError(f"Unknown QEM host '{qem_hostname}'")
+
+    def login_token(self, host_config, stale=None):
+        """
+        Returns a cached session token for the host, logging in when needed.
+
+        Pass the token QEM rejected as `stale` to log in again; workers that
+        hit the same expired session share one new login.
+        """
+        qem_host = host_config['qem_host']
+        qem_hostname = qem_host.get('qem_hostname')
+        with self._lock:
+            if not self._tokens.get(qem_hostname) or (stale is not None and self._tokens[qem_hostname] == stale):
+                self._tokens[qem_hostname] = login.login_api(qem_hostname, qem_host.get('qem_user'),
+                                                             qem_host.get('qem_psw'))
+            return self._tokens[qem_hostname]
+
+    def start_run(self, request):
+        """
+        Validates a request, registers the run and starts it in the background.
+        """
+        action = (request.get('action') or '').lower()
+        if action not in ('stop', 'resume', 'status'):
+            raise ValueError("action must be one of: stop, resume, status")
+        if request.get('tasks') and not request.get('server'):
+            raise ValueError("'server' is required when 'tasks' are given")
+        mode = (request.get('mode') or self.config['settings'].get('mode', 'S')).upper()
+        if mode not in ('S', 'A'):
+            raise ValueError("mode must be S or A")
+        host_config = self._host_config(request.get('qem_host'))
+
+        run = Run(uuid.uuid4().hex[:12], {**request, 'action': action, 'mode': mode})
+        with self._lock:
+            self.runs[run.run_id] = run
+            while len(self.runs) > MAX_RETAINED_RUNS:
+                self.runs.popitem(last=False)
+        threading.Thread(target=self._drive_run, args=(run, host_config), name=f"control-run-{run.run_id}",
+                         daemon=True).start()
+        return run
+
+    def _with_session(self, host_config, login_token, call):
+        """
+        Runs call(login_token) and returns (result, login_token). When QEM
+        rejected the session during the call (HTTP 401), logs in again once
+        and repeats the call with the new token.
+        """
+        httpClient.reset_call_stats()
+        result = call(login_token)
+        if httpClient.get_call_stats()['unauthorized']:
+            logger.warning("QEM session for host '%s' rejected (HTTP 401). Logging in again.",
+                           host_config['qem_host'].get('qem_hostname'))
+            login_token = self.login_token(host_config, stale=login_token)
+            if login_token:
+                httpClient.reset_call_stats()
+                result = call(login_token)
+        return result, login_token
+
+    def _select(self, run, host_config, login_token):
+        from qemTasksHandler import main
+        request = run.request
+        qem_hostname = host_config['qem_host'].get('qem_hostname')
+        if request.get('tasks'):
+            return [records.TaskRecord(request['server'], name) for name in request['tasks']]
+        server_names = [request['server']] if request.get('server') else None
+        return main.select_tasks(host_config, 'stop' if run.action == 'stop' else 'resume', request['mode'],
+                                 qem_hostname, login_token, server_names=server_names)
+
+    def _task_status(self, qem_hostname, login_token, task):
+        row = records.as_row(fleetStatus.task_status(qem_hostname, login_token, task))
+        return {**row, 'action': 'status', 'result': row.pop('state', None)}
+
+    def _drive_run(self, run, host_config):
+        from qemTasksHandler import main
+        qem_hostname = host_config['qem_host'].get('qem_hostname')
+        try:
+            run.state = 'running'
+            login_token = self.login_token(host_config)
+            if not login_token:
+                raise RuntimeError(f"Login failed for QEM host '{qem_hostname}'")
+
+            tasks, login_token = self._with_session(
+                host_config, login_token, lambda token: self._select(run, host_config, token))
+            run.total = len(tasks)
+            run.add_event('run_started', total=run.total)
+
+            if run.action == 'status':
+                call = lambda token, task: self._task_status(qem_hostname, token, task)
+            else:
+                (tasks, rows, full_load_tasks), login_token = self._with_session(
+                    host_config, login_token,
+                    lambda token: main.precheck_tasks(run.action, tasks, qem_hostname, token, host_config))
+                rows += [records.ResultRecord(task.server_name, task.task_name, run.action, "Blocked_FullLoad")
+                         for task in full_load_tasks]
+                for row in map(records.as_row, rows):
+                    run.results.append(row)
+                    run.add_event('task_done', **row)
+                call = lambda token, task: main.perform_task_action(run.action, qem_hostname, token, task)
+            futures = [self.executor.submit(self._with_session, host_config, login_token,
+                                            lambda token, task=task: call(token, task))
+                       for task in tasks]
+
+            for future in concurrent.futures.as_completed(futures):
+                row, _ = future.result()
+                if isinstance(row, records.ResultRecord):
+                    row = records.as_row(row)
+                run.results.append(row)
+                run.add_event('task_done', **row)
+            run.finish('done')
+        except (Exception, SystemExit) as e:
+            # SystemExit too: a failed run must end its event stream, not leave the run 'running'
+            logger.exception("Control API run %s failed: %s", run.run_id, e)
+            run.add_event('error', message=str(e))
+            run.finish('failed')
+
+
+def _make_handler(service, token):
+    class ControlHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            logger.debug("Control API %s - %s", self.address_string(), format % args)
+
+        def _send_json(self, status, payload):
+            body = json.dumps(payload, default=str).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _authorised(self):
+            if token and self.headers.get('X-Control-Token') != token:
+                self._send_json(401, {'error': 'invalid or missing X-Control-Token'})
+                return False
+            return True
+
+        def _get_run(self, run_id):
+            run = service.runs.get(run_id)
+            if run is None:
+                self._send_json(404, {'error': f"unknown run '{run_id}'"})
+            return run
+
+        def _stream_events(self, run):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            seen = 0
+            while True:
+                events = run.wait_for_events(seen)
+                seen += len(events)
+                for event in events:
+                    line = (json.dumps(event, default=str) + "\n").encode('utf-8')
+                    self.wfile.write(f"{len(line):X}\r\n".encode('ascii') + line + b"\r\n")
+                self.wfile.flush()
+                if run.finished and seen >= len(run.events):
+                    break
+            self.wfile.write(b"0\r\n\r\n")
+
+        def do_GET(self):
+            if not self._authorised():
+                return
+            parts = [part for part in self.path.split('?')[0].split('/') if part]
+            if parts == ['health']:
+                return self._send_json(200, {'status': 'ok'})
+            if parts == ['runs']:
+                return self._send_json(200, [run.summary() for run in list(service.runs.values())])
+            if len(parts) in (2, 3) and parts[0] == 'runs':
+                run = self._get_run(parts[1])
+                if run is None:
+                    return
+                if len(parts) == 2:
+                    return self._send_json(200, run.summary(with_results=True))
+                if parts[2] == 'events':
+                    return self._stream_events(run)
+            self._send_json(404, {'error': 'not found'})
+
+        def do_POST(self):
+            if not self._authorised():
+                return
+            if self.path.split('?')[0].rstrip('/') != '/runs':
+                return self._send_json(404, {'error': 'not found'})
+            try:
+                length = int(self.headers.get('Content-Length') or 0)
+                request = json.loads(self.rfile.read(length) or b'{}')
+                run = service.start_run(request)
+            except (ValueError, TypeError) as e:
+                return self._send_json(400, {'error': str(e)})
+            self._send_json(202, {'run_id': run.run_id, 'events': f"/runs/{run.run_id}/events"})
+
+    return ControlHandler
+
+
+def serve(host=None, port=None):
+    """
+    Runs the control API until Ctrl-C/SIGTERM.
+    """
+    config = configParser.load_config()
+    settings = config['settings']
+    host = host or settings.get('control_api_host', '127.0.0.1')
+    port = int(port or settings.get('control_api_port', 8787))
+
+    runControl.reset()
+    service = ControlService(config)
+    server = ThreadingHTTPServer((host, port), _make_handler(service, settings.get('control_api_token')))
+    server.daemon_threads = True
+
+    def shutdown_on_cancel():
+        runControl.wait(float('inf'))
+        server.shutdown()
+
+    runControl.install_signal_handlers()
+    threading.Thread(target=shutdown_on_cancel, name="control-api-shutdown", daemon=True).start()
+    logger.info("=== QEM control API listening on http://%s:%d ===", host, port)
+    print(f" Control API listening on http://{host}:{port} (Ctrl-C to stop)")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        service.executor.shutdown(wait=True)
+        logger.info("=== QEM control API stopped: %s ===", runControl.cancel_reason())
@@ -0,0 +1,102 @@
+# Title: Deferred full load queue
+# Author: Vinay Vitta | Qlik - QDI PS
+# Date: August 2025
+# Description: Re-checks tasks in active full load on a backoff schedule while the rest of the run proceeds
+
+import heapq
+import queue
+import itertools
+import threading
+import requests
+from qemTasksHandler import configParser, runControl
+from qemTasksHandler.myLogger import get_logger
+from restAPI import getTaskDetails
+
+config = configParser.load_config()
+logger = get_logger(config)
+
+
+def is_enabled(settings):
+    return str(settings.get('full_load_policy', 'abort')).lower() == 'defer'
+
+
+class DeferredQueue:
+    """
+    Background re-check of tasks that were in active full load at pre-check.
+
+    Every task is re-checked after full_load_recheck_interval seconds, then
+    with the interval doubled up to full_load_recheck_max_interval, until its
+    full load completed ('ready') or full_load_defer_minutes (bounded by the
+    run deadline) passed ('expired'). Outcomes are collected with get().
+    """
+
+    def __init__(self, tasks, qem_hostname, login_token, settings):
+        self.qem_hostname = qem_hostname
+        self.login_token = login_token
+        self.initial_interval = float(settings.get('full_load_recheck_interval', 30))
+        self.max_interval = float(settings.get('full_load_recheck_max_interval', 300))
+        self.deadline = runControl.clamp_deadline(
+            runControl.monotonic() + float(settings.get('full_load_defer_minutes', 30)) * 60)
+        self.pending = len(tasks)
+        self._outcomes = queue.Queue()
+        self._seq = itertools.count()
+        self._schedule = []
+        for task in tasks:
+            self._push(task, self.initial_interval)
+        self._thread = threading.Thread(target=self._run, name="full-load-recheck", daemon=True)
+
+    def _push(self, task, interval):
+        # The last check happens at the deadline itself
+        due = min(runControl.monotonic() + interval, self.deadline)
+        heapq.heappush(self._schedule, (due, next(self._seq), interval, task))
+
+    def start(self):
+        if self._schedule:
+            logger.warning("%d task(s) in active full load deferred; re-checking for up to %.1f minutes.",
+                           len(self._schedule), (self.deadline - runControl.monotonic()) / 60)
+            self._thread.start()
+        return self
+
+    def _full_load_completed(self, task):
+        try:
+            details = getTaskDetails.get_task_details(self.qem_hostname, task.server_name, task.task_name,
+                                                      self.login_token, deadline=runControl.clamp_deadline(None))
+        except requests.exceptions.RequestException as e:
+            logger.warning("Re-check of deferred task '%s' on server '%s' failed: %s",
+                           task.task_name, task.server_name, e)
+            return False
+        return isinstance(details, dict) and bool(details.get('full_load_completed'))
+
+    def _run(self):
+        while self._schedule:
+            due, _, interval, task = self._schedule[0]
+            if runControl.wait(due - runControl.monotonic()):
+                return
+            heapq.heappop(self._schedule)
+
+            if self._full_load_completed(task):
+                logger.info("Deferred task '%s' on server '%s' completed its full load.",
+                            task.task_name, task.server_name)
+                self._outcomes.put((task, 'ready'))
+            elif runControl.monotonic() >= self.deadline:
+                self._outcomes.put((task, 'expired'))
+            else:
+                interval = min(interval * 2, self.max_interval)
+                logger.info("Task '%s' on server '%s' still in full load; next check in %.0f seconds.",
+                            task.task_name, task.server_name, interval)
+                self._push(task, interval)
+
+    def get(self, timeout=0):
+        """
+        Returns the (task, 'ready'|'expired') outcomes available now, waiting up
+        to `timeout` seconds for the first one.
+        """
+        outcomes = []
+        try:
+            outcomes.append(self._outcomes.get(timeout=timeout) if timeout else self._outcomes.get_nowait())
+            while True:
+                outcomes.append(self._outcomes.get_nowait())
+        except queue.Empty:
+            pass
+        self.pending -= len(outcomes)
+        return outcomes
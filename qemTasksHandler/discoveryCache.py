@@ -0,0 +1,176 @@
+# Title: Discovery cache
+# Author: Vinay Vitta | Qlik - QDI PS
+# Date: August 2025
+# Description: On-disk cache of server task lists and full load state shared by consecutive runs
+
+import os
+import json
+import time
+import sqlite3
+import threading
+import contextlib
+from qemTasksHandler import configParser, utils
+from qemTasksHandler.myLogger import get_logger
+from restAPI import getTaskList
+
+config = configParser.load_config()
+logger = get_logger(config)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS task_lists (
+    qem_host      TEXT NOT NULL,
+    server_name   TEXT NOT NULL,
+    fetched_at    REAL NOT NULL,
+    task_list     TEXT NOT NULL,
+    PRIMARY KEY (qem_host, server_name)
+);
+CREATE TABLE IF NOT EXISTS task_details (
+    qem_host             TEXT NOT NULL,
+    server_name          TEXT NOT NULL,
+    task_name            TEXT NOT NULL,
+    full_load_completed  INTEGER,
+    state                TEXT,
+    fetched_at           REAL NOT NULL,
+    PRIMARY KEY (qem_host, server_name, task_name)
+);
+"""
+
+_lock = threading.Lock()
+_refreshing = set()  # (qem_host, server_name) refreshed by a background thread right now
+_schema_ready = set()  # cache database paths whose schema this process already created
+
+
+def is_enabled(settings):
+    return bool(settings.get('discovery_cache', False))
+
+
+def get_cache_db_path(config):
+    """
+    Returns settings.discovery_cache_db, defaulting to qem_discovery_cache.sqlite in the result path.
+    """
+    path = config.get('settings', {}).get('discovery_cache_db')
+    if not path:
+        path = os.path.join(config['logging']['result_path'], "qem_discovery_cache.sqlite")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    return path
+
+
+def _connect(config):
+    """
+    Opens the cache database (callers hold _lock and close the connection).
+    The schema is created once per process and database.
+    """
+    path = get_cache_db_path(config)
+    connection = sqlite3.connect(path, timeout=30)
+    if path not in _schema_ready:
+        connection.executescript(_SCHEMA)
+        _schema_ready.add(path)
+    return connection
+
+
+def freshness_seconds(config, server_name):
+    """
+    Seconds a server's cached entries count as fresh: the server's own
+    discovery_cache_seconds in replicate_servers, else settings.discovery_cache_seconds.
+    """
+    for server in utils.get_replicate_servers(config):
+        if server.get('name') == server_name and server.get('discovery_cache_seconds') is not None:
+            return float(server['discovery_cache_seconds'])
+    return float(config['settings'].get('discovery_cache_seconds', 300))
+
+
+def load_task_list(config, qem_host, server_name):
+    """
+    Returns (task_list_response, age_seconds) from the cache, or (None, None)
+    when there is no entry younger than settings.discovery_cache_max_age.
+    """
+    max_age = float(config['settings'].get('discovery_cache_max_age', 3600))
+    try:
+        with _lock, contextlib.closing(_connect(config)) as connection:
+            row = connection.execute("SELECT fetched_at, task_list FROM task_lists WHERE qem_host = ? AND server_name = ?",
+                                     (qem_host, server_name)).fetchone()
+    except sqlite3.Error as e:
+        logger.error("Unable to read discovery cache: %s", e)
+        return None, None
+    if not row:
+        return None, None
+    age = max(0.0, time.time() - row[0])
+    if age > max_age:
+        return None, None
+    return json.loads(row[1]), age
+
+
+def store_task_list(config, qem_host, server_name, task_list_response):
+    try:
+        with _lock, contextlib.closing(_connect(config)) as connection:
+            with connection:
+                connection.execute("INSERT OR REPLACE INTO task_lists VALUES (?, ?, ?, ?)",
+                                   (qem_host, server_name, time.time(), json.dumps(task_list_response)))
+    except sqlite3.Error as e:
+        logger.error("Unable to update discovery cache for server '%s': %s", server_name, e)
+
+
+def full_load_completed_tasks(config, qem_host, tasks):
+    """
+    Returns the (server_name, task_name) keys of tasks whose full load was
+    seen completed within their server's freshness window.
+    """
+    wanted = {(task.server_name, task.task_name) for task in tasks}
+    if not wanted:
+        return set()
+    now = time.time()
+    freshness = {server_name: freshness_seconds(config, server_name) for server_name, _ in wanted}
+    try:
+        with _lock, contextlib.closing(_connect(config)) as connection:
+            cursor = connection.execute("SELECT server_name, task_name, fetched_at FROM task_details "
+                                        "WHERE qem_host = ? AND full_load_completed = 1", (qem_host,))
+            return {(server_name, task_name) for server_name, task_name, fetched_at in cursor
+                    if (server_name, task_name) in wanted and now - fetched_at <= freshness[server_name]}
+    except sqlite3.Error as e:
+        logger.error("Unable to read discovery cache: %s", e)
+        return set()
+
+
+def store_details(config, qem_host, rows):
+    """
+    Stores (server_name, task_name, full_load_completed, state) rows read live.
+    """
+    if not rows:
+        return
+    now = time.time()
+    try:
+        with _lock, contextlib.closing(_connect(config)) as connection:
+            with connection:
+                connection.executemany("INSERT OR REPLACE INTO task_details VALUES (?, ?, ?, ?, ?, ?)",
+                                       [(qem_host, server_name, task_name,
+                                         None if completed is None else int(bool(completed)), state, now)
+                                        for server_name, task_name, completed, state in rows])
+    except sqlite3.Error as e:
+        logger.error("Unable to update discovery cache: %s", e)
+
+
+def refresh_in_background(config, qem_host, server_name, login_token):
+    """
+    Re-reads one server's task list on a background thread and stores it for
+    the next run; the current run keeps planning from the cached list. At most
+    one refresh per server runs at a time. The thread is not a daemon, so the
+    process waits for it before exiting.
+    """
+    key = (qem_host, server_name)
+    with _lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+
+    def refresh():
+        try:
+            task_list_response = getTaskList.get_task_list(qem_host, server_name, login_token)
+            if task_list_response:
+                store_task_list(config, qem_host, server_name, task_list_response)
+                logger.info("Discovery cache refreshed for server '%s' (%d task(s)).",
+                            server_name, len(task_list_response.get('taskList', [])))
+        finally:
+            with _lock:
+                _refreshing.discard(key)
+
+    threading.Thread(target=refresh, name=f"discovery-refresh-{server_name}").start()
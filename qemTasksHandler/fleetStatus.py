@@ -0,0 +1,122 @@
+# Title: Fleet status
+# Author: Vinay Vitta | Qlik - QDI PS
+# Date: August 2025
+# Description: Read-only status snapshot of all configured tasks (no backup, no stop/resume)
+
+import concurrent.futures
+import requests
+from qemTasksHandler import configParser, utils, runControl, records
+from qemTasksHandler.myLogger import get_logger
+from restAPI import login, getTaskList, getTaskDetails, httpClient
+
+config = configParser.load_config()
+logger = get_logger(config)
+
+
+def task_status(qem_hostname, login_token, task):
+    """
+    Reads one task's detail payload into a status record. Never raises.
+
+    Returns:
+        records.StatusRecord
+    """
+    try:
+        details = getTaskDetails.get_task_details(qem_hostname, task.server_name, task.task_name, login_token)
+    except requests.exceptions.RequestException as e:
+        return records.StatusRecord(task.server_name, task.task_name, f"ERROR: {e}")
+    if not isinstance(details, dict):
+        return records.StatusRecord(task.server_name, task.task_name, "ERROR: task details not available")
+    return records.StatusRecord.from_details(task.server_name, task.task_name, details)
+
+
+def _list_tasks(host_config, tasks_selection_mode, qem_hostname, login_token, server_name):
+    """
+    Returns (tasks, error_row) for one server from a single task list call.
+    """
+    task_list_response = getTaskList.get_task_list(qem_hostname, server_name, login_token)
+    if not task_list_response:
+        return [], records.StatusRecord(server_name, None, "ERROR: task list not available")
+    tasks = records.tasks_from_api(server_name, task_list_response)
+    if tasks_selection_mode == 'S':
+        wanted = {name.lower() for name in utils.validate_tasks_yaml(
+            task_list_response, utils.get_tasks_for_server(host_config, server_name), server_name=server_name)}
+        tasks = [task for task in tasks if task.task_name.lower() in wanted]
+    return tasks, None
+
+
+def snapshot_host(host_config, tasks_selection_mode):
+    """
+    Logs in to one QEM host and reads the status of its tasks: one task list
+    call per server, then the task details, all on one bounded thread pool
+    (settings.status_parallel_threads) sharing the host's session and rate limit.
+
+    Returns:
+        list: records.StatusRecord rows; a login failure yields one error row.
+    """
+    qem_host = host_config['qem_host']
+    qem_hostname = qem_host.get('qem_hostname')
+    login_token = login.login_api(qem_hostname, qem_host.get('qem_user'), qem_host.get('qem_psw'))
+    if not login_token:
+        logger.error("Login failed for host '%s'.", qem_hostname)
+        return [records.StatusRecord(None, None, "ERROR: login failed")]
+
+    settings = host_config['settings']
+    status_threads = int(settings.get('status_parallel_threads', 20))
+    server_names = [server.get('name') for server in utils.get_replicate_servers(host_config)]
+    rows = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=status_threads, thread_name_prefix="status") as executor:
+        listings = executor.map(lambda server_name: _list_tasks(host_config, tasks_selection_mode, qem_hostname,
+                                                                login_token, server_name), server_names)
+        tasks = []
+        for server_tasks, error_row in listings:
+            tasks += server_tasks
+            if error_row:
+                rows.append(error_row)
+        logger.info("Reading status of %d task(s) on %d server(s) of host '%s' (max threads: %d).",
+                    len(tasks), len(server_names), qem_hostname, status_threads)
+        rows += executor.map(lambda task: task_status(qem_hostname, login_token, task), tasks)
+    return rows
+
+
+def run_status(mode=None, output_format='csv'):
+    """
+    Writes one CSV/JSON snapshot with the state, memory, full load and CDC
+    latency of every selected task on every configured QEM host.
+
+    Parameters:
+        mode (str): 'S' (selected from YAML) or 'A' (all)
+        output_format (str): 'csv' or 'json'
+
+    Returns:
+        str: path of the snapshot file
+    """
+    config = configParser.load_config()
+    tasks_selection_mode = (mode or config['settings'].get('mode', 'S')).upper()
+    logger.info("_________________________________________________________")
+    logger.info("=== Starting QEM fleet status snapshot (mode %s) ===", tasks_selection_mode)
+    runControl.reset()
+    runControl.install_signal_handlers()
+
+    host_configs = utils.get_qem_host_configs(config)
+    for host_config in host_configs:
+        httpClient.configure_host(host_config['qem_host'].get('qem_hostname'), host_config['settings'])
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(host_configs), thread_name_prefix="qem-host") as executor:
+        host_rows = list(executor.map(lambda host_config: snapshot_host(host_config, tasks_selection_mode),
+                                      host_configs))
+    rows = []
+    for host_config, host_result in zip(host_configs, host_rows):
+        if len(host_configs) > 1:
+            for row in host_result:
+                row.qem_host = host_config['qem_host'].get('qem_hostname')
+        rows += host_result
+
+    states = {}
+    for row in rows:
+        states[row.state] = states.get(row.state, 0) + 1
+    logger.info("Status snapshot of %d row(s): %s", len(rows),
+                ", ".join(f"{state}={count}" for state, count in sorted(states.items(), key=lambda s: str(s[0]))))
+
+    path = utils.save_qem_status_snapshot(config['logging']['result_path'], rows, output_format)
+    logger.info("=== QEM fleet status snapshot written: %s ===", path)
+    return path
@@ -0,0 +1,223 @@
+# Title: Run history
+# Author: Vinay Vitta | Qlik - QDI PS
+# Date: August 2025
+# Description: SQLite database of per-task outcomes used for timing-aware scheduling
+
+import os
+import sqlite3
+import argparse
+import contextlib
+import datetime
+import threading
+import statistics
+from qemTasksHandler import configParser
+from qemTasksHandler.myLogger import get_logger
+
+config = configParser.load_config()
+logger = get_logger(config)
+
+# Only the most recent successful runs of a task are used to predict its duration
+EXPECTATION_SAMPLE_SIZE = 20
+SUCCESS_RESULTS = ('ResumeSuccess', 'StopSuccess')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id        TEXT PRIMARY KEY,
+    action        TEXT NOT NULL,
+    mode          TEXT,
+    started_at    TEXT NOT NULL,
+    finished_at   TEXT NOT NULL,
+    task_count    INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS task_runs (
+    run_id            TEXT NOT NULL REFERENCES runs(run_id),
+    qem_host          TEXT,
+    server_name       TEXT NOT NULL,
+    task_name         TEXT NOT NULL,
+    action            TEXT NOT NULL,
+    result            TEXT,
+    success           INTEGER NOT NULL,
+    duration_seconds  REAL,
+    retries           INTEGER,
+    api_calls         INTEGER,
+    finished_at       TEXT NOT NULL
+);
+DROP INDEX IF EXISTS idx_task_runs_task;
+CREATE INDEX IF NOT EXISTS idx_task_runs_host_task ON task_runs(action, qem_host, server_name, task_name, finished_at);
+"""
+
+_lock = threading.Lock()
+_schema_ready = set()  # database paths whose schema this process already created
+
+
+def get_history_db_path(config):
+    """
+    Returns settings.history_db, defaulting to qem_task_history.sqlite in the result path.
+    """
+    path = config.get('settings', {}).get('history_db')
+    if not path:
+        path = os.path.join(config['logging']['result_path'], "qem_task_history.sqlite")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    return path
+
+
+def _connect(config):
+    """
+    Opens the history database (callers hold _lock and close the connection).
+    The schema is created once per process and database.
+    """
+    path = get_history_db_path(config)
+    connection = sqlite3.connect(path, timeout=30)
+    if path not in _schema_ready:
+        connection.executescript(_SCHEMA)
+        _schema_ready.add(path)
+    return connection
+
+
+def record_run(config, run_id, action, mode, started_at, results, qem_host=None):
+    """
+    Stores one run and the outcome of each of its tasks.
+    Rows without timing (e.g. skipped tasks) are stored with NULL duration;
+    rows without a qem_host are stored with `qem_host`.
+    """
+    finished_at = datetime.datetime.now().isoformat(timespec='seconds')
+    rows = [(
+        run_id, row.qem_host or qem_host, row.server_name, row.task_name, row.action or action,
+        None if row.result is None else str(row.result),
+        1 if row.result in SUCCESS_RESULTS else 0,
+        row.duration_seconds, row.retries, row.api_calls, finished_at,
+    ) for row in results]
+    try:
+        with _lock, contextlib.closing(_connect(config)) as connection:
+            with connection:  # one transaction: committed, or rolled back on error
+                connection.execute("INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?)",
+                                   (run_id, action, mode, started_at, finished_at, len(results)))
+                connection.executemany("INSERT INTO task_runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        logger.info("Run %s recorded in history (%d task rows).", run_id, len(rows))
+    except sqlite3.Error as e:
+        logger.error("Unable to record run %s in history database: %s", run_id, e)
+
+
+def expected_durations(config, action, tasks, qem_host):
+    """
+    Returns the median time-to-state of recent successful runs per task on
+    one QEM host (hosts may share server and task names).
+
+    Returns:
+        dict: {(qem_host, server_name, task_name): seconds} for tasks with history.
+    """
+    wanted = {(qem_host, task.server_name, task.task_name) for task in tasks}
+    if not wanted:
+        return {}
+    samples = {}
+    try:
+        with _lock, contextlib.closing(_connect(config)) as connection:
+            # One index range scan per task (idx_task_runs_host_task), newest first, so the
+            # cost depends on the tasks of this run, not on how much history accumulated
+            for key in wanted:
+                durations = [row[0] for row in connection.execute(
+                    "SELECT duration_seconds FROM task_runs "
+                    "WHERE action = ? AND qem_host = ? AND server_name = ? AND task_name = ? "
+                    "AND success = 1 AND duration_seconds IS NOT NULL "
+                    "ORDER BY finished_at DESC LIMIT ?", (action, *key, EXPECTATION_SAMPLE_SIZE))]
+                if durations:
+                    samples[key] = durations
+    except sqlite3.Error as e:
+        logger.error("Unable to read history database: %s", e)
+        return {}
+    return {key: statistics.median(values) for key, values in samples.items()}
+
+
+def predict_makespan(durations, workers):
+    """
+    Predicts the wall-clock duration of running `durations` longest-first on `workers` threads.
+    """
+    if not durations:
+        return 0.0
+    lanes = [0.0] * max(1, min(workers, len(durations)))
+    for duration in sorted(durations, reverse=True):
+        lanes[lanes.index(min(lanes))] += duration
+    return max(lanes)
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def time_to_state_stats(config, action, group_by='task', server=None, task=None, days=None):
+    """
+    Aggregates successful time-to-state per task or per server.
+
+    Returns:
+        list: [{'server_name', 'task_name' (per task only), 'runs', 'p50_seconds', 'p95_seconds',
+                'avg_retries', 'failures'}, ...]
+    """
+    query = ("SELECT server_name, task_name, success, duration_seconds, retries FROM task_runs "
+             "WHERE action = ?")
+    params = [action]
+    if server:
+        query += " AND server_name = ?"
+        params.append(server)
+    if task:
+        query += " AND task_name = ?"
+        params.append(task)
+    if days:
+        query += " AND finished_at >= ?"
+        params.append((datetime.datetime.now() - datetime.timedelta(days=days)).isoformat(timespec='seconds'))
+
+    groups = {}
+    with _lock, contextlib.closing(_connect(config)) as connection:
+        for server_name, task_name, success, duration, retries in connection.execute(query, params):
+            key = (server_name, task_name) if group_by == 'task' else (server_name,)
+            group = groups.setdefault(key, {'durations': [], 'retries': [], 'failures': 0})
+            if success and duration is not None:
+                group['durations'].append(duration)
+                group['retries'].append(retries or 0)
+            else:
+                group['failures'] += 1
+
+    stats = []
+    for key, group in sorted(groups.items()):
+        row = {'server_name': key[0]}
+        if group_by == 'task':
+            row['task_name'] = key[1]
+        durations = group['durations']
+        row.update({
+            'runs': len(durations),
+            'p50_seconds': round(_percentile(durations, 0.50), 1) if durations else None,
+            'p95_seconds': round(_percentile(durations, 0.95), 1) if durations else None,
+            'avg_retries': round(statistics.mean(group['retries']), 2) if group['retries'] else None,
+            'failures': group['failures'],
+        })
+        stats.append(row)
+    return stats
+
+
+def history_command(argv=None):
+    """
+    CLI: python run.py history [--action resume|stop|restart] [--by task|server] [--server S] [--task T] [--days N]
+    """
+    parser = argparse.ArgumentParser(prog="run.py history",
+                                     description="Query time-to-state history of QEM task runs")
+    parser.add_argument("--action", choices=["resume", "stop", "restart"], default="resume",
+                        help="Action to report on (default: resume)")
+    parser.add_argument("--by", choices=["task", "server"], default="task", help="Group per task or per server")
+    parser.add_argument("--server", type=str, help="Only this replicate server")
+    parser.add_argument("--task", type=str, help="Only this task")
+    parser.add_argument("--days", type=float, help="Only runs from the last N days")
+    args = parser.parse_args(argv)
+
+    config = configParser.load_config()
+    stats = time_to_state_stats(config, args.action, args.by, args.server, args.task, args.days)
+    if not stats:
+        print(f"No {args.action} history found in {get_history_db_path(config)}")
+        return
+
+    columns = list(stats[0].keys())
+    widths = {column: max(len(column), *(len(str(row[column])) for row in stats)) for column in columns}
+    print("  ".join(column.ljust(widths[column]) for column in columns))
+    print("  ".join("-" * widths[column] for column in columns))
+    for row in stats:
+        print("  ".join(str(row[column]).ljust(widths[column]) for column in columns))
@@ -5,101 +5,106 @@
 
 import sys
 import csv
+import uuid
+import datetime
+import statistics
 import concurrent.futures
-from qemTasksHandler import configParser, utils, backup
+import requests
+from qemTasksHandler import configParser, utils, backup, runControl, history, scheduler, deferral, records, \
+    notifier, discoveryCache, tracing
 from qemTasksHandler.myLogger import get_logger
-from restAPI import login, getTaskList, resumeTask, stopTask, getTaskDetails
+from restAPI import login, getTaskList, resumeTask, stopTask, getTaskDetails, httpClient
 
+config = configParser.load_config()
+logger = get_logger(config)
 
-def run_tasks(action, mode=None, file_path=None, override_server=None):
-    """
-    Executes QEM tasks based on provided action and mode.
 
-    Parameters:
-        action (str): 'resume' or 'stop'
-        mode (str): 'S' (selected from YAML), 'A' (all), 'F' (file-based list, resume only)
-        file_path (str): CSV file path if mode='F'
-        override_server (str): Server name override for mode='F'
+def apply_expected_durations(config, action, tasks_to_run, qem_hostname):
     """
-    # --- Load Config & Logger ---
-    config = configParser.load_config()
-    logger = get_logger(config)
-    logger.info("_________________________________________________________")
-    logger.info("=== Starting QEM Task Handler ===")
-    logger.info("Action: %s | Mode: %s", action, mode)
+    Annotates tasks with 'expected_seconds' from the run history of their QEM
+    host so the scheduler can start the slowest tasks first. Tasks without
+    history are left as-is.
+    """
+    if not config['settings'].get('history_enabled', True) or not tasks_to_run:
+        return
+    expected = history.expected_durations(config, action, tasks_to_run, qem_hostname)
+    for task in tasks_to_run:
+        seconds = expected.get((qem_hostname, task.server_name, task.task_name))
+        if seconds is not None:
+            task.expected_seconds = seconds
+    logger.info("Run history available for %d of %d task(s).", len(expected), len(tasks_to_run))
 
-    # --- Extract QEM Credentials ---
-    qem_hostname = config['qem_host'].get('qem_hostname')
-    qem_user = config['qem_host'].get('qem_user')
-    qem_psw = config['qem_host'].get('qem_psw')
-    parallel_threads = config.get('parallel_threads', 5)
 
-    # --- Validate Mode F requirements ---
-    yaml_selection_mode = config['settings'].get('mode', 'S').upper()
-    tasks_selection_mode = (mode or yaml_selection_mode).upper()
+def select_tasks(config, action, tasks_selection_mode, qem_hostname, login_token,
+                 server_names=None, file_path=None, override_server=None, write_backup=True):
+    """
+    Backs up the task list of each replicate server and builds the list of
+    tasks to process for the given selection mode.
 
-    if tasks_selection_mode == 'F':
-        if action != 'resume':
-            logger.error("Mode 'F' is only supported with action='resume'.")
-            sys.exit(1)
-        if not file_path or not override_server:
-            logger.error("Both file_path and override_server must be provided in mode='F'.")
-            sys.exit(1)
+    With settings.discovery_cache a server's list comes from the on-disk
+    cache while it is younger than discovery_cache_max_age; lists older than
+    the server's freshness window are re-read in the background for the next run.
 
-    # --- Authenticate ---
-    logger.info("[1/5] Authenticating with QEM server: %s", qem_hostname)
-    login_token = login.login_api(qem_hostname, qem_user, qem_psw)
-    if not login_token:
-        logger.error("Login failed for host '%s'. Aborting.", qem_hostname)
-        sys.exit(1)
-    logger.info("Authentication successful.")
+    Parameters:
+        server_names (list): Restrict discovery to these servers (None = all configured servers)
+        write_backup (bool): Write the task list backup (False for read-only dry runs)
 
-    # --- Get Server List ---
-    logger.info("[2/5] Retrieving replicate server list from config.")
+    Returns:
+        list: [records.TaskRecord, ...]
+    """
     replicate_servers_list = utils.get_replicate_servers(config)
+    use_cache = discoveryCache.is_enabled(config['settings'])
     tasks_to_run = []
 
-    # --- Task Selection Loop ---
-    logger.info("[3/5] Building task list based on mode: %s", tasks_selection_mode)
     for replicate_server in replicate_servers_list:
         server_name = replicate_server.get('name')
 
+        if server_names is not None and server_name not in server_names:
+            continue
         # Skip non-target servers in File mode
         if tasks_selection_mode == 'F' and server_name != override_server:
             continue
 
-        # Backup task list before processing
-        replicate_tasks_status_bk = getTaskList.get_task_list(qem_hostname, server_name, login_token)
-        backup_file_name = backup.get_backup_filename(config)
-        backup.write_task_list_to_csv(replicate_tasks_status_bk, backup_file_name)
-        logger.info("Backup created for server: %s -> %s", server_name, backup_file_name)
+        # Backup task list before processing; the same list is used for selection
+        api_task_list_response = None
+        if use_cache:
+            api_task_list_response, age = discoveryCache.load_task_list(config, qem_hostname, server_name)
+            if api_task_list_response is not None:
+                stale = age > discoveryCache.freshness_seconds(config, server_name)
+                logger.info("Task list for server '%s' from discovery cache (%.0f seconds old%s).",
+                            server_name, age, ", refreshing in background" if stale else "")
+                if stale:
+                    discoveryCache.refresh_in_background(config, qem_hostname, server_name, login_token)
+        if api_task_list_response is None:
+            api_task_list_response = getTaskList.get_task_list(qem_hostname, server_name, login_token)
+            if use_cache and api_task_list_response:
+                discoveryCache.store_task_list(config, qem_hostname, server_name, api_task_list_response)
+        if write_backup:
+            backup_file_name = backup.get_backup_filename(config, server_name, qem_hostname)
+            backup.write_task_list_to_csv(api_task_list_response, backup_file_name)
+            logger.info("Backup created for server: %s -> %s", server_name, backup_file_name)
+
+        # Keep only the fields we use; the full payload is dropped once it is in the backup
+        server_tasks = {task.task_name: task for task in records.tasks_from_api(server_name, api_task_list_response)}
 
         # --- Mode S: Selected from YAML ---
         if tasks_selection_mode == 'S':
             logger.info("Using SELECTED mode for server: %s", server_name)
             yaml_task_names = utils.get_tasks_for_server(config, server_name)
-            api_task_list_response = getTaskList.get_task_list(qem_hostname, server_name, login_token)
-            matching_tasks = utils.validate_tasks_yaml(api_task_list_response, yaml_task_names)
-            for task_name in matching_tasks:
-                tasks_to_run.append({'server_name': server_name, 'task_name': task_name})
+            matching_tasks = utils.validate_tasks_yaml(api_task_list_response, yaml_task_names, server_name=server_name)
+            tasks_to_run += [server_tasks[task_name] for task_name in matching_tasks]
 
         # --- Mode A: All tasks ---
         elif tasks_selection_mode == 'A':
             logger.info("Using ALL mode for server: %s", server_name)
-            api_task_list_response = getTaskList.get_task_list(qem_hostname, server_name, login_token)
             if not api_task_list_response:
                 logger.warning("No task list for server %s. Skipping.", server_name)
                 continue
-            if action == 'stop':
-                running_tasks = [
-                    task['name'] for task in api_task_list_response.get('taskList', [])
-                    if task['state'].upper() == 'RUNNING'
-                ]
-                for task_name in running_tasks:
-                    tasks_to_run.append({'server_name': server_name, 'task_name': task_name})
+            if action in ('stop', 'restart'):
+                # Only running tasks can be stopped (or restarted)
+                tasks_to_run += [task for task in server_tasks.values() if task.state == 'RUNNING']
             else:
-                for task in api_task_list_response.get('taskList', []):
-                    tasks_to_run.append({'server_name': server_name, 'task_name': task['name']})
+                tasks_to_run += server_tasks.values()
 
         # --- Mode F: File-based selection ---
         elif tasks_selection_mode == 'F':
@@ -109,89 +114,504 @@ def run_tasks(action, mode=None, file_path=None, override_server=None):
                     reader = csv.DictReader(csvfile)
                     for row in reader:
                         if row.get('state', '').upper() == 'RUNNING':
-                            tasks_to_run.append({
-                                'server_name': override_server,
-                                'task_name': row['name']
-                            })
+                            tasks_to_run.append(records.TaskRecord(override_server, row['name'], 'RUNNING'))
             except FileNotFoundError:
                 logger.error("File not found: %s", file_path)
                 sys.exit(1)
             except Exception as e:
                 logger.exception("Error reading file %s: %s", file_path, e)
                 sys.exit(1)
+        del api_task_list_response, server_tasks
 
-    logger.info("Total tasks queued for %s: %d", action, len(tasks_to_run))
+    # --- Optional priority / depends_on from YAML ---
+    utils.apply_task_options(config, tasks_to_run)
+    return tasks_to_run
 
-    # --- Pre-check: Stop if any task is still in full load (full_load_completed=False) ---
-    logger.info("Performing full load completion check...")
+
+def precheck_tasks(action, tasks_to_run, qem_hostname, login_token, host_config=None):
+    """
+    Checks every queued task for an active full load before anything is changed.
+
+    With settings.discovery_cache (host_config), tasks whose full load was seen
+    completed within their server's freshness window are not read again here;
+    they are flagged confirm_full_load and re-checked by the resume/stop call's
+    own live state read before anything is changed. Live reads update the cache.
+
+    Returns:
+        tuple: (reachable_tasks, results, full_load_tasks)
+            reachable_tasks - tasks that passed the check
+            results         - report rows for tasks that were skipped (unreachable server, no task
+                              details, cancelled run)
+            full_load_tasks - tasks still in active full load (full_load_completed=False)
+    """
+    results = []
+    reachable_tasks = []
+    full_load_tasks = []
+    use_cache = host_config is not None and discoveryCache.is_enabled(host_config['settings'])
+    cached = discoveryCache.full_load_completed_tasks(host_config, qem_hostname, tasks_to_run) if use_cache else set()
+    if cached:
+        logger.info("Full load completion of %d of %d task(s) taken from discovery cache.",
+                    len(cached), len(tasks_to_run))
+    live_details = []
     for task in tasks_to_run:
-        server = task['server_name']
-        task_name = task['task_name']
+        server = task.server_name
+        task_name = task.task_name
+        if runControl.is_cancelled():
+            results.append(records.ResultRecord(server, task_name, action, "Skipped"))
+            continue
+        if (server, task_name) in cached:
+            task.confirm_full_load = True
+            reachable_tasks.append(task)
+            continue
         try:
             details = getTaskDetails.get_task_details(qem_hostname, server, task_name, login_token)
+            if not isinstance(details, dict):
+                # Non-200 reply (e.g. task deleted or renamed): skip the task, the others still run
+                logger.error("No details for task '%s' on server '%s'. Skipping task.", task_name, server)
+                results.append(records.ResultRecord(server, task_name, action, f"ERROR: {details}"))
+                continue
             full_load_completed = details.get("full_load_completed", None)
+            live_details.append((server, task_name, full_load_completed, details.get("state")))
 
             if not full_load_completed:  # False = active full load
                 logger.error(
-                    "Task '%s' on server '%s' is still in active full load (full_load_completed=False). Aborting script.",
+                    "Task '%s' on server '%s' is still in active full load (full_load_completed=False).",
                     task_name, server
                 )
-                sys.exit(1)
+                full_load_tasks.append(task)
+                continue
+            reachable_tasks.append(task)
 
+        except requests.exceptions.ConnectionError as e:
+            # Unreachable server: nothing can be stopped/resumed there, so skip its tasks
+            logger.error("Server '%s' unreachable while checking task '%s'. Skipping task: %s", server, task_name, e)
+            results.append(records.ResultRecord(server, task_name, action, f"ERROR: server unavailable ({e})"))
         except Exception as e:
             logger.exception(
                 "Error retrieving details for task '%s' on server '%s': %s",
                 task_name, server, e
             )
-            sys.exit(1)
+            results.append(records.ResultRecord(server, task_name, action, f"ERROR: {e}"))
 
-    # --- Task Execution ---
-    logger.info("[4/5] Executing tasks in parallel (max threads: %d)", parallel_threads)
+    if use_cache:
+        discoveryCache.store_details(host_config, qem_hostname, live_details)
+    return reachable_tasks, results, full_load_tasks
 
-    def task_worker(task):
-        server = task['server_name']
-        task_name = task['task_name']
+
+def perform_task_action(action, qem_hostname, login_token, task):
+    """
+    Resumes or stops a single task and returns its report row. Never raises.
+
+    The row includes the time to reach the target state, the number of QEM
+    API calls and how often the action had to be re-issued (retries).
+
+    'restart' stops the task and resumes it as soon as it reached a stopped
+    state; the row's result is the resume outcome and 'stop_result' the stop outcome.
+    """
+    server = task.server_name
+    task_name = task.task_name
+    confirm_full_load = task.confirm_full_load
+    httpClient.reset_call_stats()
+    started = runControl.monotonic()
+    stop_result = None
+    with tracing.span(f"{action} {task_name}", server=server, task=task_name, action=action) as task_span:
         try:
             if action == 'resume':
                 logger.info("Resuming task: '%s' on server: '%s'", task_name, server)
-                result = resumeTask.resume_task(qem_hostname, server, task_name, login_token)
-            else:
+                result = resumeTask.resume_task(qem_hostname, server, task_name, login_token, confirm_full_load)
+            elif action == 'stop':
                 logger.info("Stopping task: '%s' on server: '%s'", task_name, server)
-                result = stopTask.stop_task(qem_hostname, server, task_name, login_token)
-            return {'server_name': server, 'task_name': task_name, 'action': action, 'result': result}
+                result = stopTask.stop_task(qem_hostname, server, task_name, login_token, confirm_full_load)
+            else:
+                logger.info("Restarting task: '%s' on server: '%s'", task_name, server)
+                with tracing.span("stop", server=server, task=task_name):
+                    result = stop_result = stopTask.stop_task(qem_hostname, server, task_name, login_token,
+                                                              confirm_full_load)
+                if stop_result in ('StopSuccess', 'Already_in_STOPPED_State'):
+                    with tracing.span("resume", server=server, task=task_name):
+                        result = resumeTask.resume_task(qem_hostname, server, task_name, login_token)
+                    if result == "Cancelled":
+                        logger.warning("Restart of task '%s' on server '%s' cancelled after its stop. Task left stopped.",
+                                       task_name, server)
         except Exception as e:
             logger.exception("Error executing task '%s' on server '%s': %s", task_name, server, e)
-            return {'server_name': server, 'task_name': task_name, 'action': action, 'result': f"ERROR: {e}"}
+            result = f"ERROR: {e}"
+        call_stats = httpClient.get_call_stats()
+        task_span.args.update(result=result, api_calls=call_stats['api_calls'])
+        tracing.instant("result", server=server, task=task_name, result=result)
+    return records.ResultRecord(server, task_name, action, result,
+                                duration_seconds=round(runControl.monotonic() - started, 3),
+                                retries=max(0, call_stats['action_requests'] - (2 if action == 'restart' else 1)),
+                                api_calls=call_stats['api_calls'], stop_result=stop_result)
+
+
+def execute_tasks(action, tasks_to_run, qem_hostname, login_token, parallel_threads, server_max_parallel=None,
+                  deferred_tasks=None, settings=None, executor_factory=concurrent.futures.ThreadPoolExecutor,
+                  wait_fn=concurrent.futures.wait):
+    """
+    Runs resume/stop for every task on a thread pool with per-server bulkheads,
+    in priority and dependency order (see scheduler.TaskScheduler).
+
+    deferred_tasks were in active full load at pre-check (settings.full_load_policy
+    'defer'). They are re-checked in the background and run once their full
+    load completed; the other tasks do not wait for them.
+
+    With settings.adaptive_concurrency the number of tasks in flight starts at
+    parallel_threads and follows QEM API latency and errors within
+    adaptive_min_threads..adaptive_max_threads (see adaptiveConcurrency).
+
+    With settings.execution_mode 'two_phase' all actions are sent first and
+    confirmed in bulk afterwards (see twoPhase); adaptive concurrency does not apply.
+
+    executor_factory and wait_fn replace the thread pool and
+    concurrent.futures.wait, e.g. to run on a virtual clock (see simulator).
+
+    Returns:
+        list: one result dict per task, including 'Skipped' rows for tasks not
+        started because the run was cancelled and 'Deferred_FullLoad' rows for
+        tasks still in full load when their deferral deadline passed.
+    """
+    def task_worker(task):
+        return perform_task_action(action, qem_hostname, login_token, task)
 
     results = []
+    deferred_tasks = deferred_tasks or []
+    settings = settings or config['settings']
+    # Optional execution features are imported here, not at start-up (see benchmark_startup.py)
+    from qemTasksHandler import adaptiveConcurrency, twoPhase
+    if twoPhase.is_enabled(settings):
+        return twoPhase.execute_tasks(action, tasks_to_run, qem_hostname, login_token, parallel_threads,
+                                      server_max_parallel, deferred_tasks, settings, executor_factory, wait_fn)
+    if action == 'restart' and settings.get('restart_max_down'):
+        # Each worker keeps one task down from its stop until it is running again
+        parallel_threads = min(parallel_threads, int(settings['restart_max_down']))
+        logger.info("Restart: at most %d task(s) down at once.", parallel_threads)
+
+    controller = None
+    if adaptiveConcurrency.is_enabled(settings):
+        ceiling = int(settings['restart_max_down']) if action == 'restart' and settings.get('restart_max_down') else None
+        controller = adaptiveConcurrency.AdaptiveConcurrency(qem_hostname, settings, parallel_threads, ceiling)
+        logger.info("Adaptive concurrency for '%s': starting at %d thread(s), bounds %d-%d.",
+                    qem_hostname, controller.limit, controller.minimum, controller.maximum)
+        parallel_threads = controller.maximum
+
+    # Dependency- and priority-aware queues with per-server bulkheads
+    task_scheduler = scheduler.TaskScheduler(tasks_to_run + deferred_tasks, action, parallel_threads,
+                                             server_max_parallel, held=deferred_tasks)
+    deferred = None
+    if deferred_tasks:
+        deferred = deferral.DeferredQueue(deferred_tasks, qem_hostname, login_token, settings).start()
+
+    # Pre-size the pool: never start more threads than there are tasks
+    parallel_threads = max(1, min(parallel_threads, len(tasks_to_run) + len(deferred_tasks)))
+    known = [task.expected_seconds for task in tasks_to_run if task.expected_seconds is not None]
+    if known:
+        default_seconds = statistics.median(known)
+        durations = [task.expected_seconds or default_seconds for task in tasks_to_run]
+        logger.info("Predicted duration for %d task(s) on %d thread(s): ~%.1f minutes (history for %d task(s)).",
+                    len(tasks_to_run), parallel_threads,
+                    history.predict_makespan(durations, parallel_threads) / 60, len(known))
+
+    if controller:
+        httpClient.set_latency_observer(qem_hostname, controller)
+
+    # Using a dynamic submission loop: dependents are submitted as soon as their prerequisites finish
+    with executor_factory(max_workers=parallel_threads) as executor:
+        futures = {}
 
-    # Using a dynamic submission loop
-    with concurrent.futures.ThreadPoolExecutor(max_workers=parallel_threads) as executor:
-        # Convert tasks list to an iterator so we can submit one at a time
-        task_iter = iter(tasks_to_run)
-        # Submit initial batch equal to max workers
-        futures = {executor.submit(task_worker, next(task_iter)): None for _ in range(min(parallel_threads, len(tasks_to_run)))}
+        def submit_ready():
+            limit = parallel_threads
+            if controller:
+                limit = task_scheduler.parallel_threads = controller.limit
+            while len(futures) < limit and not runControl.is_cancelled():
+                next_task = task_scheduler.next_task()
+                if next_task is None:
+                    break
+                tracing.queued(next_task, task_scheduler.ready_at.get(
+                    scheduler.task_key(next_task.server_name, next_task.task_name)), runControl.monotonic())
+                futures[executor.submit(task_worker, next_task)] = next_task
+            if controller:
+                controller.note_in_flight(len(futures))
 
-        while futures:
-            # Wait for any task to complete
-            done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+        submit_ready()
+        while futures or (deferred and deferred.pending and not runControl.is_cancelled()):
+            # Wait for any task to complete (wake every second to notice cancellation)
+            done = ()
+            if futures:
+                done, _ = wait_fn(futures, timeout=1, return_when=concurrent.futures.FIRST_COMPLETED)
             for future in done:
                 result = future.result()
-                results.append(result)  # Process result immediately
-                logger.info("Task completed: %s | Result: %s", result['task_name'], result['result'])
-                # Remove completed future
-                futures.pop(future)
-                # Submit next task if available
-                try:
-                    next_task = next(task_iter)
-                    futures[executor.submit(task_worker, next_task)] = None
-                except StopIteration:
-                    pass
+                logger.info("Task completed: %s | Result: %s", result.task_name, result.result)
+                # Release dependents (or skip them if this task did not reach the target state)
+                for row in [result] + task_scheduler.complete(futures.pop(future), result, action):
+                    results.append(row)  # Process result immediately
+                    notifier.task_result(row)
+            # Deferred tasks join the queue once their full load completed; expired ones are reported
+            for task, outcome in (deferred.get(timeout=0 if futures else 1) if deferred else []):
+                if outcome == 'ready':
+                    task_scheduler.release(task)
+                    continue
+                logger.warning("Task '%s' on server '%s' still in active full load at its deferral deadline. "
+                               "Not processed.", task.task_name, task.server_name)
+                expired = records.ResultRecord(task.server_name, task.task_name, action, "Deferred_FullLoad")
+                for row in [expired] + task_scheduler.abandon(task, expired, action):
+                    results.append(row)
+                    notifier.task_result(row)
+            # Submit next tasks if available
+            submit_ready()
+
+    if controller:
+        httpClient.set_latency_observer(qem_hostname, None)
+        summary = controller.summary()
+        logger.info("Adaptive concurrency for '%s': %d-%d thread(s), time-weighted mean %.1f, %d change(s).",
+                    qem_hostname, summary['min'], summary['max'], summary['mean'], summary['changes'])
+        logger.debug("Adaptive concurrency for '%s' over time: %s", qem_hostname, summary['timeline'])
+
+    # Tasks never started because the run was cancelled or hit its deadline
+    if task_scheduler.has_pending():
+        skipped = task_scheduler.drain(action)
+        logger.warning("Run cancelled (%s). %d task(s) were not started and are marked as skipped.",
+                       runControl.cancel_reason(), len(skipped))
+        results += skipped
+
+    return results
+
+
+def prepare_host(host_config, action, tasks_selection_mode, processes=1, file_path=None, override_server=None):
+    """
+    Steps 1-3 for one QEM host: login, discovery/backup and full load pre-check.
+    Nothing is stopped or resumed here.
+
+    Returns:
+        dict: {'qem_hostname', 'login_token', 'login_failed', 'shards'} where each
+              shard is {'tasks', 'results', 'full_load_tasks', 'login_token', 'login_failed'}.
+              login_failed is also set when any shard's own login failed.
+    """
+    qem_hostname = host_config['qem_host'].get('qem_hostname')
+    qem_user = host_config['qem_host'].get('qem_user')
+    qem_psw = host_config['qem_host'].get('qem_psw')
+
+    # --- Authenticate ---
+    logger.info("[1/5] Authenticating with QEM server: %s", qem_hostname)
+    login_token = login.login_api(qem_hostname, qem_user, qem_psw)
+    if not login_token:
+        logger.error("Login failed for host '%s'.", qem_hostname)
+        return {'qem_hostname': qem_hostname, 'login_token': None, 'login_failed': True, 'shards': []}
+    logger.info("Authentication successful for host '%s'.", qem_hostname)
+
+    # --- Get Server List ---
+    logger.info("[2/5] Retrieving replicate server list from config for host '%s'.", qem_hostname)
+    replicate_servers_list = utils.get_replicate_servers(host_config)
+
+    if processes > 1 and len(replicate_servers_list) > 1:
+        # --- Sharded: discovery and pre-check run in worker processes ---
+        from qemTasksHandler import sharding
+        shards = sharding.prepare_sharded(host_config, action, tasks_selection_mode, login_token, processes)
+    else:
+        # --- Task Selection Loop ---
+        logger.info("[3/5] Building task list based on mode: %s", tasks_selection_mode)
+        with tracing.span("discovery", cat='phase', host=qem_hostname):
+            tasks_to_run = select_tasks(host_config, action, tasks_selection_mode, qem_hostname, login_token,
+                                        file_path=file_path, override_server=override_server)
+        logger.info("Total tasks queued for %s on host '%s': %d", action, qem_hostname, len(tasks_to_run))
+
+        # --- Pre-check: Stop if any task is still in full load (full_load_completed=False) ---
+        logger.info("Performing full load completion check...")
+        with tracing.span("full load pre-check", cat='phase', host=qem_hostname, tasks=len(tasks_to_run)):
+            tasks_to_run, results, full_load_tasks = precheck_tasks(action, tasks_to_run, qem_hostname, login_token,
+                                                                    host_config)
+        shards = [{'tasks': tasks_to_run, 'results': results, 'full_load_tasks': full_load_tasks,
+                   'login_token': login_token, 'login_failed': False}]
+
+    # A shard that could not log in would silently leave its servers out of the run: fail the host instead
+    login_failed = any(shard['login_failed'] for shard in shards)
+    return {'qem_hostname': qem_hostname, 'login_token': login_token, 'login_failed': login_failed, 'shards': shards}
+
+
+def execute_host(host_config, action, prepared, processes=1):
+    """
+    Step 4 for one QEM host: stops/resumes the prepared tasks.
+
+    Returns:
+        list: result rows, including rows recorded during preparation.
+    """
+    results = [row for shard in prepared['shards'] for row in shard['results']]
+    if processes > 1 and len(prepared['shards']) > 1:
+        # Worker processes do not notify; their rows are reported here once the shards finish
+        from qemTasksHandler import sharding
+        results += sharding.execute_sharded(host_config, action, prepared['shards'])
+        for row in results:
+            notifier.task_result(row)
+        return results
+    for row in results:
+        notifier.task_result(row)
+
+    settings = host_config['settings']
+    parallel_threads = int(settings.get('parallel_threads', host_config.get('parallel_threads', 5)))
+    server_max_parallel = settings.get('server_max_parallel')
+    logger.info("[4/5] Executing tasks on host '%s' in parallel (max threads: %d, per-server limit: %s)",
+                prepared['qem_hostname'], parallel_threads, server_max_parallel or "fair share")
+    with tracing.span("execution", cat='phase', host=prepared['qem_hostname']):
+        for shard in prepared['shards']:
+            results += execute_tasks(action, shard['tasks'], prepared['qem_hostname'], shard['login_token'],
+                                     parallel_threads, server_max_parallel, shard['full_load_tasks'], settings)
+    return results
+
+
+def _for_each_host(fn, jobs):
+    """
+    Calls fn(*args) for every per-host argument tuple concurrently and returns
+    the results in order. A single host runs in the calling thread.
+    """
+    if len(jobs) == 1:
+        return [fn(*jobs[0])]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(jobs), thread_name_prefix="qem-host") as executor:
+        futures = [executor.submit(fn, *args) for args in jobs]
+        return [future.result() for future in futures]
+
+
+def run_tasks(action, mode=None, file_path=None, override_server=None, deadline_minutes=None, processes=None,
+              trace=None):
+    """
+    Executes QEM tasks based on provided action and mode.
+
+    All configured QEM hosts (see utils.get_qem_host_configs) are processed
+    concurrently, each with its own session and rate limit, and produce one
+    combined report.
+
+    Parameters:
+        action (str): 'resume', 'stop' or 'restart' (stop then resume, pipelined per task)
+        mode (str): 'S' (selected from YAML), 'A' (all), 'F' (file-based list, resume only)
+        file_path (str): CSV file path if mode='F'
+        override_server (str): Server name override for mode='F'
+        deadline_minutes (float): Optional run deadline; overrides settings.run_deadline_minutes
+        processes (int): Worker processes to shard replicate servers across; overrides settings.processes
+        trace (bool): Write a Chrome trace / Perfetto timeline of every task; overrides settings.trace_enabled
+    """
+    # --- Load Config & Logger ---
+    config = configParser.load_config()
+    run_id = datetime.datetime.now().strftime("%Y%m%dT%H%M%S") + "-" + uuid.uuid4().hex[:6]
+    started_at = datetime.datetime.now().isoformat(timespec='seconds')
+    logger.info("_________________________________________________________")
+    logger.info("=== Starting QEM Task Handler ===")
+    logger.info("Action: %s | Mode: %s", action, mode)
+
+    # --- Run deadline & graceful cancellation (Ctrl-C / SIGTERM) ---
+    runControl.reset()
+    runControl.set_deadline(deadline_minutes or config['settings'].get('run_deadline_minutes'))
+    runControl.install_signal_handlers()
+
+    # --- Email notifications (background digests; never block the run) ---
+    notifier.start(config)
+
+    # --- Execution timeline (Chrome trace / Perfetto JSON) ---
+    if trace is None:
+        trace = config['settings'].get('trace_enabled', False)
+    if trace:
+        tracing.start()
+
+    processes = int(processes or config['settings'].get('processes', 1))
+
+    # --- Validate Mode F requirements ---
+    yaml_selection_mode = config['settings'].get('mode', 'S').upper()
+    tasks_selection_mode = (mode or yaml_selection_mode).upper()
+
+    if tasks_selection_mode == 'F':
+        if action != 'resume':
+            logger.error("Mode 'F' is only supported with action='resume'.")
+            sys.exit(1)
+        if not file_path or not override_server:
+            logger.error("Both file_path and override_server must be provided in mode='F'.")
+            sys.exit(1)
+        processes = 1  # a single server - nothing to shard
+
+    # --- QEM hosts: one config view per host ---
+    host_configs = utils.get_qem_host_configs(config)
+    for host_config in host_configs:
+        httpClient.configure_host(host_config['qem_host'].get('qem_hostname'), host_config['settings'])
+
+    # --- Steps 1-3 on every host; nothing is changed until all hosts pass the pre-check ---
+    prepared_hosts = _for_each_host(prepare_host, [
+        (host_config, action, tasks_selection_mode, processes, file_path, override_server)
+        for host_config in host_configs
+    ])
+
+    failed_logins = [host['qem_hostname'] for host in prepared_hosts if host['login_failed']]
+    if failed_logins:
+        logger.error("Login failed for host(s) %s. Aborting.", failed_logins)
+        notifier.notify('run_aborted', f"{action}: login failed for host(s) {', '.join(failed_logins)}", flush=True)
+        sys.exit(1)
+    for host_config, prepared in zip(host_configs, prepared_hosts):
+        full_load_tasks = [task for shard in prepared['shards'] for task in shard['full_load_tasks']]
+        if not full_load_tasks:
+            continue
+        if not deferral.is_enabled(host_config['settings']):
+            logger.error("%d task(s) still in active full load. Aborting script.", len(full_load_tasks))
+            notifier.notify('run_aborted', f"{action}: {len(full_load_tasks)} task(s) still in active full load: " +
+                            ", ".join(f"{task.server_name}/{task.task_name}" for task in full_load_tasks), flush=True)
+            sys.exit(1)
+        # --- full_load_policy 'defer': everything else proceeds, these are re-checked in the background ---
+        logger.warning("%d task(s) on host '%s' still in active full load. Deferring them.",
+                       len(full_load_tasks), prepared['qem_hostname'])
+        for task in full_load_tasks:
+            notifier.notify('task_deferred', f"{task.server_name}/{task.task_name} on {prepared['qem_hostname']}: "
+                                             f"{action} deferred until its full load completes")
+
+    # --- Dependency cycles are rejected before anything is changed ---
+    for prepared in prepared_hosts:
+        cycle = scheduler.find_cycle([task for shard in prepared['shards']
+                                      for task in shard['tasks'] + shard['full_load_tasks']], action)
+        if cycle:
+            cycle_text = " -> ".join(f"{server}/{task}" for server, task in cycle)
+            logger.error("Dependency cycle on host '%s': %s. Aborting.", prepared['qem_hostname'], cycle_text)
+            notifier.notify('run_aborted', f"{action}: dependency cycle on host {prepared['qem_hostname']}: "
+                                           f"{cycle_text}", flush=True)
+            sys.exit(1)
+
+    # --- Order work by expected duration from run history ---
+    for prepared in prepared_hosts:
+        for shard in prepared['shards']:
+            apply_expected_durations(config, action, shard['tasks'] + shard['full_load_tasks'],
+                                     prepared['qem_hostname'])
+
+    # --- Task Execution ---
+    host_results = _for_each_host(execute_host, [
+        (host_config, action, prepared, processes) for host_config, prepared in zip(host_configs, prepared_hosts)
+    ])
+    results = []
+    for prepared, rows in zip(prepared_hosts, host_results):
+        if len(host_configs) > 1:
+            for row in rows:
+                row.qem_host = prepared['qem_hostname']
+        results += rows
 
     # --- Report Generation ---
     logger.info("[5/5] Generating CSV report.")
     output_dir = config['logging']['result_path']
-    utils.save_qem_task_report(output_dir, results, action)
+    report_path = utils.save_qem_task_report(output_dir, results, action)
     logger.info("CSV report generated. Path: %s", output_dir)
-    logger.info("=== QEM Task Handler Completed Successfully ===")
+    trace_document = tracing.stop()
+    if trace_document:
+        trace_path = utils.save_qem_trace(output_dir, trace_document, action)
+        logger.info("Execution trace (%d events) written to %s - open it in https://ui.perfetto.dev or chrome://tracing",
+                    len(trace_document['traceEvents']), trace_path)
+    if config['settings'].get('history_enabled', True):
+        # Rows of a single-host run carry no qem_host (the report omits the column); history needs it
+        history.record_run(config, run_id, action, tasks_selection_mode, started_at, results,
+                           qem_host=prepared_hosts[0]['qem_hostname'] if len(prepared_hosts) == 1 else None)
+
+    outcomes = {}
+    for row in results:
+        outcomes[row.result] = outcomes.get(row.result, 0) + 1
+    stopped_early = f" (stopped early: {runControl.cancel_reason()})" if runControl.is_cancelled() else ""
+    notifier.notify('run_completed', f"{action} run {run_id}, mode {tasks_selection_mode}{stopped_early}: "
+                                     f"{len(results)} task(s) - " +
+                    ", ".join(f"{result}={count}" for result, count in sorted(outcomes.items(), key=str)),
+                    attachments=[report_path] if (config.get('email') or {}).get('attach_report', True) else [],
+                    flush=True)
+    notifier.stop()
 
+    if runControl.is_cancelled():
+        logger.warning("=== QEM Task Handler Stopped Early: %s ===", runControl.cancel_reason())
+    else:
+        logger.info("=== QEM Task Handler Completed Successfully ===")
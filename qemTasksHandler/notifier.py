@@ -1,68 +1,359 @@
 # Title: Email
 # Author: Vinay Vitta | Qlik - QDI PS
 # Date: August 2025
-# Description: Email alerts
+# Description: Email alerts - run events are queued, coalesced into digests and sent in the background
 
-# Example to send an email
-# Update with the right SMTP server and port numbers
-#   SMTP_SERVER = "mailhub.draft.com"
-#   SMTP_PORT =  25
-#   SENDER_EMAIL = "noreply@taskHandlerScript"
-#   SENDER_PASSWORD = ""
+# SMTP settings come from the 'email' section of config.yaml:
+#   email:
+#     enabled: true
+#     server: "mailhub.draft.com"
+#     port: 25
+#     use_tls: false
+#     from_address: "noreply@taskHandlerScript"
+#     to_addresses: ["admin@example.com"]
+# Any SMTP server can stand in for testing, e.g. `python -m aiosmtpd -n -l localhost:1025`.
+# smtplib, ssl and email are imported when a digest is sent, so runs without email do not load them.
 
+import os
+import time
+import uuid
+import queue
+import atexit
+import base64
+import datetime
+import threading
+from qemTasksHandler import configParser
+from qemTasksHandler.myLogger import get_logger
 
-import smtplib
-from email import encoders
-from email.mime.base import MIMEBase
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
+config = configParser.load_config()
+logger = get_logger(config)
 
+DEFAULT_EVENTS = ('task_failed', 'task_deferred', 'run_completed', 'run_aborted')
+EVENT_TITLES = {
+    'run_aborted': "Run aborted",
+    'task_failed': "Tasks not in the target state",
+    'task_deferred': "Tasks deferred for full load",
+    'run_completed': "Run completed",
+}
 
-def send_email(sender_email, receiver_email, subject, body, attachment_path):
-    # Set up the MIME
-    message = MIMEMultipart()
-    message['From'] = sender_email
-    message['To'] = ", ".join(receiver_email)
-    message['Subject'] = subject
+# Results that are not reported as failures
+NON_FAILURE_RESULTS = ('ResumeSuccess', 'Already_in_Running_State', 'StopSuccess', 'Already_in_STOPPED_State',
+                       'Skipped', 'Cancelled')
 
-    # Attach body
-    message.attach(MIMEText(body, 'plain'))
+# 57 input bytes encode to one 76 character base64 line
+ATTACHMENT_CHUNK_BYTES = 57 * 1024
+SEND_BUFFER_BYTES = 64 * 1024
 
-    # Attach file
-    with open(attachment_path, "rb") as attachment:
-        part = MIMEBase("application", "octet-stream")
-        part.set_payload(attachment.read())
+_STOP = object()
 
-    encoders.encode_base64(part)
 
-    part.add_header(
-        "Content-Disposition",
-        f"attachment; filename= {attachment_path}",
-    )
+def _smtp_connection(email_config):
+    """
+    Opens an SMTP connection from the email config (STARTTLS/SSL and login when configured).
+    """
+    import ssl
+    import smtplib
+    host = email_config.get('server', 'localhost')
+    port = int(email_config.get('port', 25))
+    timeout = float(email_config.get('timeout', 30))
+    if email_config.get('use_ssl'):
+        smtp = smtplib.SMTP_SSL(host, port, timeout=timeout, context=ssl.create_default_context())
+    else:
+        smtp = smtplib.SMTP(host, port, timeout=timeout)
+        if email_config.get('use_tls'):
+            smtp.starttls(context=ssl.create_default_context())
+    if email_config.get('username'):
+        smtp.login(email_config['username'], email_config.get('password', ''))
+    return smtp
 
-    message.attach(part)
 
-    # Connect to SMTP server
-    server = smtplib.SMTP('mailhub.carcgl.com', 25)
-    server.starttls()
+def _close(smtp):
+    import smtplib
+    # QUIT may fail after an error on the connection; never hide the original error
+    try:
+        smtp.quit()
+    except (smtplib.SMTPException, OSError):
+        smtp.close()
 
-    # Login
-    # server.login(sender_email, sender_password)
 
-    # Send email
-    server.sendmail(sender_email, receiver_email, message.as_string())
+def _base64_lines(data):
+    encoded = base64.b64encode(data)
+    for start in range(0, len(encoded), 76):
+        yield encoded[start:start + 76]
 
-    # Quit SMTP server
-    server.quit()
+
+def _message_lines(sender_email, receiver_emails, subject, body, attachment_paths=()):
+    """
+    Yields a multipart message line by line (bytes, no line endings). Attachments
+    are read and base64-encoded in chunks, so no file is held in memory.
+    """
+    import mimetypes
+    from email.header import Header
+    from email.utils import formatdate, make_msgid
+    boundary = "=_qem_" + uuid.uuid4().hex
+    yield f"From: {sender_email}".encode()
+    yield f"To: {', '.join(receiver_emails)}".encode()
+    yield f"Subject: {subject if subject.isascii() else Header(subject, 'utf-8').encode()}".encode()
+    yield f"Date: {formatdate(localtime=True)}".encode()
+    yield f"Message-ID: {make_msgid()}".encode()
+    yield b"MIME-Version: 1.0"
+    yield f'Content-Type: multipart/mixed; boundary="{boundary}"'.encode()
+    yield b""
+    yield f"--{boundary}".encode()
+    yield b'Content-Type: text/plain; charset="utf-8"'
+    yield b"Content-Transfer-Encoding: base64"
+    yield b""
+    yield from _base64_lines(body.encode('utf-8'))
+
+    for path in attachment_paths:
+        content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        yield f"--{boundary}".encode()
+        yield f"Content-Type: {content_type}".encode()
+        yield b"Content-Transfer-Encoding: base64"
+        yield f'Content-Disposition: attachment; filename="{os.path.basename(path)}"'.encode()
+        yield b""
+        with open(path, "rb") as attachment:
+            while True:
+                chunk = attachment.read(ATTACHMENT_CHUNK_BYTES)
+                if not chunk:
+                    break
+                yield from _base64_lines(chunk)
+    yield f"--{boundary}--".encode()
+
+
+def _send_streamed(smtp, sender_email, receiver_emails, lines):
+    """
+    Sends one message on an open connection, writing the DATA section as it is
+    generated (dot-stuffed, CRLF line endings) instead of building it in memory.
+
+    Returns:
+        dict: refused recipients {address: (code, response)}
+    """
+    import smtplib
+    smtp.ehlo_or_helo_if_needed()
+    code, response = smtp.mail(sender_email)
+    if code != 250:
+        smtp.rset()
+        raise smtplib.SMTPSenderRefused(code, response, sender_email)
+    refused = {}
+    for receiver in receiver_emails:
+        code, response = smtp.rcpt(receiver)
+        if code not in (250, 251):
+            refused[receiver] = (code, response)
+    if len(refused) == len(receiver_emails):
+        smtp.rset()
+        raise smtplib.SMTPRecipientsRefused(refused)
+    code, response = smtp.docmd("DATA")
+    if code != 354:
+        smtp.rset()
+        raise smtplib.SMTPDataError(code, response)
+
+    buffer = bytearray()
+    for line in lines:
+        if line.startswith(b"."):
+            buffer += b"."
+        buffer += line + b"\r\n"
+        if len(buffer) >= SEND_BUFFER_BYTES:
+            smtp.send(bytes(buffer))
+            buffer.clear()
+    smtp.send(bytes(buffer) + b".\r\n")
+    code, response = smtp.getreply()
+    if code != 250:
+        raise smtplib.SMTPDataError(code, response)
+    return refused
+
+
+def send_email(sender_email, receiver_email, subject, body, attachment_path=None, email_config=None):
+    """
+    Sends one email (with an optional attachment) synchronously, using the SMTP
+    settings of the email section of config.yaml.
+    """
+    email_config = email_config or config.get('email') or {}
+    receiver_emails = [receiver_email] if isinstance(receiver_email, str) else list(receiver_email)
+    attachment_paths = [attachment_path] if attachment_path else []
+    smtp = _smtp_connection(email_config)
+    try:
+        _send_streamed(smtp, sender_email, receiver_emails,
+                       _message_lines(sender_email, receiver_emails, subject, body, attachment_paths))
+    finally:
+        _close(smtp)
+
+
+class Notifier:
+    """
+    Background email notifications for run events.
+
+    notify() only enqueues. A worker thread collects events for
+    email.digest_seconds after the first one (an event with flush=True, e.g.
+    run completion, closes the window at once), then sends the batch as a
+    digest over a single SMTP connection; digests longer than
+    email.max_events_per_message are split into several messages on that
+    connection. If the queue is full, events are dropped rather than blocking
+    the run.
+    """
+
+    def __init__(self, email_config):
+        self.email_config = email_config
+        self.sender = email_config.get('from_address', 'noreply@qemTaskHandler')
+        self.receivers = list(email_config.get('to_addresses') or [])
+        self.events = set(email_config.get('events') or DEFAULT_EVENTS)
+        self.digest_seconds = float(email_config.get('digest_seconds', 60))
+        self.max_events_per_message = int(email_config.get('max_events_per_message', 200))
+        self.subject_prefix = email_config.get('subject_prefix', '[QEM Task Handler]')
+        self.sent_messages = 0
+        self.dropped_events = 0
+        self._queue = queue.Queue(maxsize=int(email_config.get('max_queued_events', 1000)))
+        self._thread = threading.Thread(target=self._run, name="notifier", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        logger.info("Email notifications enabled for %s (events: %s, digest every %.0f seconds).",
+                    ", ".join(self.receivers), ", ".join(sorted(self.events)), self.digest_seconds)
+        return self
+
+    def notify(self, event, text, attachments=(), flush=False):
+        if event not in self.events:
+            return
+        try:
+            self._queue.put_nowait((event, datetime.datetime.now(), text, tuple(attachments), flush))
+        except queue.Full:
+            self.dropped_events += 1
+            if self.dropped_events == 1:
+                logger.warning("Notification queue full; dropping events until the mail server catches up.")
+
+    def close(self, timeout=30):
+        """
+        Sends what is still queued and stops the worker, waiting at most `timeout` seconds.
+        """
+        if not self._thread.is_alive():
+            return
+        deadline = time.monotonic() + timeout
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            logger.warning("Notification queue still full at shutdown; pending notifications are dropped.")
+            return
+        self._thread.join(max(0.0, deadline - time.monotonic()))
+        if self._thread.is_alive():
+            logger.warning("Notifications not sent within %.0f seconds of shutdown; giving up on them.", timeout)
+        elif self.dropped_events:
+            logger.warning("%d notification event(s) were dropped.", self.dropped_events)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch, stopping = [item], False
+            window_end = time.monotonic() + self.digest_seconds
+            while not batch[-1][4]:
+                try:
+                    item = self._queue.get(timeout=max(0.0, window_end - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._send_batch(batch)
+            if stopping:
+                return
+
+    def _digest(self, batch):
+        counts = {}
+        for event, *_ in batch:
+            counts[event] = counts.get(event, 0) + 1
+        headline = ", ".join(f"{count} {EVENT_TITLES.get(event, event).lower()}" if event.startswith('task_')
+                             else EVENT_TITLES.get(event, event) for event, count in counts.items())
+        lines = []
+        for event in sorted(counts, key=lambda e: list(EVENT_TITLES).index(e) if e in EVENT_TITLES else 99):
+            lines.append(f"{EVENT_TITLES.get(event, event)} ({counts[event]}):")
+            lines += [f"  {timestamp:%H:%M:%S}  {text}" for name, timestamp, text, _, _ in batch if name == event]
+            lines.append("")
+        attachments = [path for *_, paths, _ in batch for path in paths if os.path.exists(path)]
+        return f"{self.subject_prefix} {headline}", "\n".join(lines), attachments
+
+    def _send_batch(self, batch):
+        import smtplib
+        messages = []
+        for start in range(0, len(batch), self.max_events_per_message):
+            subject, body, attachments = self._digest(batch[start:start + self.max_events_per_message])
+            if len(batch) > self.max_events_per_message:
+                subject += f" ({start // self.max_events_per_message + 1}/" \
+                           f"{-(-len(batch) // self.max_events_per_message)})"
+            messages.append((subject, body, attachments))
+        try:
+            smtp = _smtp_connection(self.email_config)
+            try:
+                for subject, body, attachments in messages:
+                    refused = _send_streamed(smtp, self.sender, self.receivers,
+                                             _message_lines(self.sender, self.receivers, subject, body, attachments))
+                    if refused:
+                        logger.warning("Notification not delivered to: %s", ", ".join(refused))
+                    self.sent_messages += 1
+            finally:
+                _close(smtp)
+            logger.info("Sent %d notification message(s) for %d event(s).", len(messages), len(batch))
+        except (smtplib.SMTPException, OSError) as e:
+            logger.error("Unable to send notification for %d event(s): %s", len(batch), e)
+
+
+_notifier = None
+
+
+def start(config):
+    """
+    Starts background notifications when email.enabled is set; otherwise
+    notify() and the helpers below do nothing.
+    """
+    global _notifier
+    email_config = (config or {}).get('email') or {}
+    if _notifier is not None or not email_config.get('enabled'):
+        return _notifier
+    if not email_config.get('to_addresses'):
+        logger.warning("Email notifications enabled but email.to_addresses is empty. Not sending.")
+        return None
+    _notifier = Notifier(email_config).start()
+    atexit.register(stop)  # flush on sys.exit() from anywhere in the run
+    return _notifier
+
+
+def stop():
+    """
+    Flushes and stops background notifications (bounded by email.shutdown_timeout).
+    """
+    global _notifier
+    notifier, _notifier = _notifier, None
+    if notifier is not None:
+        notifier.close(float(notifier.email_config.get('shutdown_timeout', 30)))
+
+
+def reset():
+    """
+    Forgets a notifier inherited by a forked worker process; only the coordinator sends.
+    """
+    global _notifier
+    _notifier = None
+
+
+def notify(event, text, attachments=(), flush=False):
+    if _notifier is not None:
+        _notifier.notify(event, text, attachments, flush)
+
+
+def task_result(row):
+    """
+    Emits 'task_failed' for a report row whose task did not reach the target state.
+    """
+    if _notifier is None or row.result in NON_FAILURE_RESULTS:
+        return
+    host = f" on {row.qem_host}" if row.qem_host else ""
+    notify('task_failed', f"{row.server_name}/{row.task_name}{host}: {row.action} -> {row.result}")
 
 
 if __name__ == "__main__":
-    # Example usage
-    sender_email = "noreply@dev-qem-script"
-    # sender_password = 'your_password'
-    receiver_email = 'test@emailServer.com'
-    subject = 'Test Email with Attachment'
-    body = 'This is a test email sent from Python.'
-    attachment_path = r'D:\Attunity\RowCountValidation-master-3.1.0\RowCountValidation-master\data\output\RowCount_output_2024_04_26_14_16_54.xlsx'
-    send_email(sender_email, receiver_email, subject, body, attachment_path)
+    # Example usage: sends a test email with the SMTP settings from config.yaml
+    email_config = config.get('email') or {}
+    send_email(email_config.get('from_address', 'noreply@dev-qem-script'), email_config.get('to_addresses', []),
+               'Test Email from QEM Task Handler', 'This is a test email sent from Python.')
     print("test is good")
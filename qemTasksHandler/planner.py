@@ -0,0 +1,292 @@
+# Title: Dry-run planner
+# Author: Vinay Vitta | Qlik - QDI PS
+# Date: August 2025
+# Description: Discovery and pre-check only - prints the execution plan with an API call and duration estimate
+
+import heapq
+import itertools
+import concurrent.futures
+from qemTasksHandler import configParser, utils, runControl, scheduler, deferral, records, fleetStatus, main
+from qemTasksHandler.myLogger import get_logger
+from restAPI import login, httpClient
+
+config = configParser.load_config()
+logger = get_logger(config)
+
+# Result a task reports once it reached the target state (what dependents wait for)
+SUCCESS_RESULTS = {'resume': 'ResumeSuccess', 'stop': 'StopSuccess', 'restart': 'ResumeSuccess'}
+
+# Defaults used by resumeTask/stopTask when a setting is missing
+POLLING_DEFAULTS = {
+    'resume': {'interval': ('resume_retry_interval', 30), 'timeout': ('resume_timeout', 35),
+               'polls': ('resume_max_polling_retries', 70), 'api_retries': ('resume_max_api_retries', 3)},
+    'stop': {'interval': ('stop_check_interval', 30), 'timeout': ('stop_timeout', 35),
+             'polls': ('stop_max_polling_retries', 70), 'api_retries': ('stop_max_api_retries', 3)},
+}
+
+
+def polling_settings(settings, kind):
+    """
+    Returns the polling settings resumeTask ('resume') or stopTask ('stop') would use.
+    """
+    return {name: float(settings.get(key, default)) for name, (key, default) in POLLING_DEFAULTS[kind].items()}
+
+
+def estimate_step(settings, kind):
+    """
+    Estimates one stop or resume of a task that is not yet in the target state.
+
+    The typical case is one details call, the action POST and one poll after
+    a single check interval. The worst case polls until max_polling_retries or
+    the timeout, re-issuing the action up to max_api_retries times.
+
+    Returns:
+        tuple: (api_calls, max_api_calls, expected_seconds, max_seconds)
+    """
+    polling = polling_settings(settings, kind)
+    polls = int(polling['polls'])
+    max_seconds = min(polling['timeout'] * 60, polls * polling['interval'])
+    max_calls = 1 + polls + min(int(polling['api_retries']), polls)
+    return 4, max_calls, polling['interval'], max_seconds
+
+
+def classify(action, status):
+    """
+    Returns the plan for one task from its pre-check status row, mirroring
+    the checks resumeTask/stopTask make before acting.
+    """
+    if status.state and status.state.startswith('ERROR:'):
+        return status.state
+    if not status.full_load_completed:
+        return 'Blocked_FullLoad'
+    if action == 'resume' and (status.memory_mb or 0) >= 1:
+        return 'Skip_Already_in_Running_State'
+    if action == 'stop' and status.memory_mb == 0:
+        return 'Skip_Already_in_STOPPED_State'
+    return action.capitalize()
+
+
+def estimate_task(row, settings, history_seconds=None):
+    """
+    Fills the API call and duration estimate of one plan row. History (median
+    time-to-state of recent successful runs) replaces the typical duration.
+    """
+    if row.plan.startswith('Skip_'):
+        row.api_calls = row.max_api_calls = 1
+        row.expected_seconds = row.max_seconds = 0.0
+    elif row.action == 'restart':
+        # Stop (or only its details call if already stopped) followed by resume
+        stop = estimate_step(settings, 'stop') if row.state != 'STOPPED' else (1, 1, 0.0, 0.0)
+        resume = estimate_step(settings, 'resume')
+        row.api_calls, row.max_api_calls, row.expected_seconds, row.max_seconds = \
+            [stop_value + resume_value for stop_value, resume_value in zip(stop, resume)]
+    else:
+        row.api_calls, row.max_api_calls, row.expected_seconds, row.max_seconds = \
+            estimate_step(settings, row.action)
+    row.estimate_source = 'settings'
+    if history_seconds is not None and row.plan in ('Resume', 'Stop', 'Restart'):
+        row.expected_seconds = round(history_seconds, 3)
+        row.estimate_source = 'history'
+
+
+def simulate(tasks, action, workers, server_max_parallel, held, durations, results):
+    """
+    Replays a run of `tasks` through scheduler.TaskScheduler on a virtual clock,
+    with every task taking durations[key] seconds and ending with results[key].
+    Held tasks are assumed to stay in full load for the whole run.
+
+    Returns:
+        tuple: (start offsets {key: seconds} in start order, makespan seconds,
+                {key: result} for tasks the scheduler would not start)
+    """
+    task_scheduler = scheduler.TaskScheduler(tasks, action, workers, server_max_parallel, held=held)
+    starts, not_started = {}, {}
+    running, seq, clock = [], itertools.count(), 0.0
+    while True:
+        while len(running) < workers:
+            task = task_scheduler.next_task()
+            if task is None:
+                break
+            key = scheduler.task_key(task.server_name, task.task_name)
+            starts[key] = clock
+            heapq.heappush(running, (clock + durations[key], next(seq), task))
+        if not running:
+            break
+        clock, _, task = heapq.heappop(running)
+        key = scheduler.task_key(task.server_name, task.task_name)
+        row = records.ResultRecord(task.server_name, task.task_name, action, results[key])
+        for skipped in task_scheduler.complete(task, row, action):
+            not_started[scheduler.task_key(skipped.server_name, skipped.task_name)] = skipped.result
+    for task in held:
+        row = records.ResultRecord(task.server_name, task.task_name, action, 'Deferred_FullLoad')
+        for skipped in task_scheduler.abandon(task, row, action):
+            not_started[scheduler.task_key(skipped.server_name, skipped.task_name)] = skipped.result
+    return starts, clock, not_started
+
+
+def plan_host(host_config, action, tasks_selection_mode, processes=1, file_path=None, override_server=None):
+    """
+    Builds the plan for one QEM host: login, discovery (no backup), one details
+    call per task as in the pre-check, then a simulated run for the order,
+    start offsets and duration. Nothing is stopped or resumed.
+
+    Returns:
+        tuple: (list of records.PlanRecord, summary dict)
+    """
+    config = configParser.load_config()
+    qem_host = host_config['qem_host']
+    qem_hostname = qem_host.get('qem_hostname')
+    settings = host_config['settings']
+    summary = {'qem_host': qem_hostname, 'action': action, 'mode': tasks_selection_mode}
+
+    login_token = login.login_api(qem_hostname, qem_host.get('qem_user'), qem_host.get('qem_psw'))
+    if not login_token:
+        logger.error("Login failed for host '%s'.", qem_hostname)
+        summary['error'] = 'login failed'
+        return [], summary
+
+    tasks = main.select_tasks(host_config, action, tasks_selection_mode, qem_hostname, login_token,
+                              file_path=file_path, override_server=override_server, write_backup=False)
+    status_threads = int(settings.get('status_parallel_threads', 20))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=status_threads, thread_name_prefix="plan") as executor:
+        statuses = list(executor.map(lambda task: fleetStatus.task_status(qem_hostname, login_token, task), tasks))
+    main.apply_expected_durations(config, action, tasks, qem_hostname)
+
+    rows, runnable, held = [], [], []
+    durations, max_durations, results = {}, {}, {}
+    defer = deferral.is_enabled(settings)
+    for task, status in zip(tasks, statuses):
+        row = records.PlanRecord(task.server_name, task.task_name, action, classify(action, status),
+                                 state=status.state, priority=task.priority)
+        rows.append(row)
+        if row.plan.startswith('ERROR:'):
+            continue
+        if row.plan == 'Blocked_FullLoad':
+            if not defer:
+                continue
+            row.plan = 'Defer_FullLoad'
+            held.append(task)
+        else:
+            runnable.append(task)
+        estimate_task(row, settings, task.expected_seconds)
+        key = scheduler.task_key(task.server_name, task.task_name)
+        durations[key], max_durations[key] = row.expected_seconds, row.max_seconds
+        results[key] = row.plan[len('Skip_'):] if row.plan.startswith('Skip_') else SUCCESS_RESULTS[action]
+
+    workers = int(settings.get('parallel_threads', host_config.get('parallel_threads', 5)))
+    if action == 'restart' and settings.get('restart_max_down'):
+        workers = min(workers, int(settings['restart_max_down']))
+    servers = {task.server_name for task in tasks}
+    if processes > 1 and len(servers) > 1:
+        workers *= min(processes, len(servers))  # each shard has its own pool
+    server_max_parallel = settings.get('server_max_parallel')
+
+    blocked = [row for row in rows if row.plan == 'Blocked_FullLoad']
+    api_calls = 1 + len(servers) + len(tasks)  # login, task lists, pre-check details
+    summary.update({
+        'tasks': len(rows),
+        'to_change': sum(row.plan in ('Resume', 'Stop', 'Restart') for row in rows),
+        'already_in_target_state': sum(row.plan.startswith('Skip_') for row in rows),
+        'blocked_full_load': len(blocked),
+        'deferred_full_load': len(held),
+        'errors': sum(row.plan.startswith('ERROR:') for row in rows),
+        'would_abort': bool(blocked),
+        'workers': workers,
+        'history_tasks': sum(row.estimate_source == 'history' for row in rows),
+    })
+
+    cycle = scheduler.find_cycle(runnable + held, action)
+    if cycle:
+        summary['would_abort'] = True
+        summary['error'] = "dependency cycle: " + " -> ".join(f"{server}/{task}" for server, task in cycle)
+        logger.error("Dependency cycle on host '%s': %s", qem_hostname, summary['error'])
+        return rows, summary
+
+    starts, makespan, not_started = simulate(runnable + held, action, workers, server_max_parallel, held,
+                                             durations, results)
+    _, max_makespan, _ = simulate(runnable + held, action, workers, server_max_parallel, held,
+                                  max_durations, results)
+    by_key = {scheduler.task_key(row.server_name, row.task_name): row for row in rows}
+    for order, (key, offset) in enumerate(sorted(starts.items(), key=lambda item: item[1]), start=1):
+        by_key[key].order, by_key[key].start_offset_seconds = order, round(offset, 3)
+    for key, result in not_started.items():
+        by_key[key].plan = result
+
+    # Sizing: the same run on fewer or more threads
+    summary['duration_by_threads'] = {
+        threads: round(simulate(runnable + held, action, threads, server_max_parallel, held,
+                                durations, results)[1], 1)
+        for threads in sorted({max(1, workers // 2), workers, workers * 2, workers * 4})
+    }
+
+    planned = [row for row in rows if row.api_calls is not None and row.plan != 'Skipped_Dependency_Failed']
+    api_calls += sum(row.api_calls for row in planned)
+    max_api_calls = api_calls - sum(row.api_calls for row in planned) + sum(row.max_api_calls for row in planned)
+    # A per-host rate limit bounds how fast the calls can go out
+    rate_limit = float(settings.get('api_rate_limit') or 0)
+    if rate_limit > 0:
+        makespan = max(makespan, api_calls / rate_limit)
+        max_makespan = max(max_makespan, max_api_calls / rate_limit)
+    summary.update({'api_calls': api_calls, 'max_api_calls': max_api_calls,
+                    'expected_seconds': round(makespan, 1), 'max_seconds': round(max_makespan, 1)})
+    return rows, summary
+
+
+def run_dry_run(action, mode=None, file_path=None, override_server=None, processes=None, output_format='csv'):
+    """
+    Plans a resume/stop/restart run on every configured QEM host without
+    changing anything or writing backups, logs the plan and writes it to a
+    Dry_Run_Plan file.
+
+    Returns:
+        tuple: (path of the plan file, list of per-host summary dicts)
+    """
+    config = configParser.load_config()
+    tasks_selection_mode = (mode or config['settings'].get('mode', 'S')).upper()
+    processes = int(processes or config['settings'].get('processes', 1))
+    logger.info("_________________________________________________________")
+    logger.info("=== Starting QEM Task Handler dry run (%s, mode %s) ===", action, tasks_selection_mode)
+    runControl.reset()
+    runControl.install_signal_handlers()
+
+    host_configs = utils.get_qem_host_configs(config)
+    for host_config in host_configs:
+        httpClient.configure_host(host_config['qem_host'].get('qem_hostname'), host_config['settings'])
+    host_plans = main._for_each_host(plan_host, [
+        (host_config, action, tasks_selection_mode, processes, file_path, override_server)
+        for host_config in host_configs
+    ])
+
+    rows, summaries = [], []
+    for host_rows, summary in host_plans:
+        if len(host_configs) > 1:
+            for row in host_rows:
+                row.qem_host = summary['qem_host']
+        rows += host_rows
+        summaries.append(summary)
+        for row in sorted(host_rows, key=lambda r: (r.order is None, r.order or 0)):
+            logger.info("Plan: %-4s %s/%s -> %s (start +%ss, expected %ss, %s API calls)",
+                        row.order or "-", row.server_name, row.task_name, row.plan,
+                        row.start_offset_seconds, row.expected_seconds, row.api_calls)
+        if summary.get('error'):
+            logger.error("Host '%s': %s", summary['qem_host'], summary['error'])
+            continue
+        logger.info("Host '%s': %d task(s) - %d to %s, %d already in target state, %d blocked and %d deferred "
+                    "by full load, %d error(s).", summary['qem_host'], summary['tasks'], summary['to_change'],
+                    action, summary['already_in_target_state'], summary['blocked_full_load'],
+                    summary['deferred_full_load'], summary['errors'])
+        logger.info("Host '%s': ~%d API call(s) (max %d); ~%.1f minutes on %d thread(s) (max %.1f minutes); "
+                    "history for %d task(s).", summary['qem_host'], summary['api_calls'], summary['max_api_calls'],
+                    summary['expected_seconds'] / 60, summary['workers'], summary['max_seconds'] / 60,
+                    summary['history_tasks'])
+        logger.info("Host '%s': expected minutes by thread count: %s", summary['qem_host'],
+                    ", ".join(f"{threads}={seconds / 60:.1f}"
+                              for threads, seconds in summary['duration_by_threads'].items()))
+        if summary['would_abort']:
+            logger.warning("Host '%s': the run would abort - %d task(s) in active full load "
+                           "(full_load_policy 'abort').", summary['qem_host'], summary['blocked_full_load'])
+
+    path = utils.save_qem_dry_run_plan(config['logging']['result_path'], rows,
+                                       summaries if len(summaries) > 1 else summaries[0], action, output_format)
+    logger.info("=== QEM Task Handler dry run written: %s ===", path)
+    return path, summaries
@@ -0,0 +1,191 @@
+# Title: Reconciler daemon
+# Author: Vinay Vitta | Qlik - QDI PS
+# Date: August 2025
+# Description: Long-running daemon that keeps tasks in a desired state with a warm session
+
+import concurrent.futures
+from qemTasksHandler import configParser, utils, backup, runControl, records, taskListWatcher
+from qemTasksHandler.myLogger import get_logger
+from restAPI import login, resumeTask, stopTask, httpClient
+
+config = configParser.load_config()
+logger = get_logger(config)
+
+DESIRED_STATES = {'resume': 'RUNNING', 'stop': 'STOPPED'}
+
+
+class HostReconciler:
+    """
+    Keeps the login token, the task list snapshots and the managed tasks that
+    are out of their desired state for one QEM host.
+    """
+
+    def __init__(self, host_config, action, tasks_selection_mode):
+        self.host_config = host_config
+        self.action = action
+        self.tasks_selection_mode = tasks_selection_mode
+        self.qem_hostname = host_config['qem_host'].get('qem_hostname')
+        self.login_token = None
+        self.watcher = taskListWatcher.TaskListWatcher(self.qem_hostname)
+        self.task_states = {}  # (server, task) -> last seen state
+        self.out_of_state = {}  # server -> {task name: records.TaskRecord} managed tasks not in the desired state
+
+    def login(self):
+        qem_host = self.host_config['qem_host']
+        self.login_token = login.login_api(self.qem_hostname, qem_host.get('qem_user'), qem_host.get('qem_psw'))
+        if self.login_token:
+            logger.info("Reconciler logged in to QEM host '%s'.", self.qem_hostname)
+        else:
+            logger.error("Reconciler login failed for QEM host '%s'.", self.qem_hostname)
+        return self.login_token
+
+    def _apply_changes(self, server_name, changes):
+        """
+        Updates the known states and out-of-state tasks of one server from the
+        rows that changed since the previous cycle. Only state changes are logged.
+        """
+        matcher = None
+        if self.tasks_selection_mode == 'S':
+            selectors = utils.get_tasks_for_server(self.host_config, server_name)
+            matcher = utils.compile_task_selectors(tuple(selectors))
+            if changes.first:
+                # Reports YAML names QEM does not know, once
+                utils.validate_tasks_yaml(changes.task_list, selectors, log_summary=False, server_name=server_name)
+
+        desired_state = DESIRED_STATES[self.action]
+        out_of_state = self.out_of_state.setdefault(server_name, {})
+        for task_name in changes.removed:
+            out_of_state.pop(task_name, None)
+            self.task_states.pop((server_name, task_name), None)
+        for row in changes.changed:
+            task = records.tasks_from_api(server_name, {'taskList': [row]})[0]
+            if matcher and not matcher.matches(task.task_name, row.get('assigned_tags')):
+                out_of_state.pop(task.task_name, None)
+                continue
+            key = (server_name, task.task_name)
+            state = task.state or 'UNKNOWN'
+            previous = self.task_states.get(key)
+            if previous != state:
+                if previous is not None:
+                    logger.info("Task '%s' on server '%s' changed state: %s -> %s",
+                                task.task_name, server_name, previous, state)
+                self.task_states[key] = state
+            in_desired_state = state == 'RUNNING' if desired_state == 'RUNNING' else state != 'RUNNING'
+            if in_desired_state:
+                out_of_state.pop(task.task_name, None)
+            else:
+                out_of_state[task.task_name] = task
+
+    def find_drift(self):
+        """
+        Reads one task list per server and returns the managed tasks whose state
+        differs from the desired state. Only rows that changed since the previous
+        cycle are evaluated (see taskListWatcher); an unchanged list costs no parsing.
+
+        Returns:
+            list: [records.TaskRecord, ...]
+        """
+        if not self.login_token and not self.login():
+            return []
+
+        drifted = []
+        failed_servers = 0
+        replicate_servers = utils.get_replicate_servers(self.host_config)
+        for replicate_server in replicate_servers:
+            server_name = replicate_server.get('name')
+            changes = self.watcher.poll(server_name, self.login_token)
+            if changes is None:
+                failed_servers += 1
+                continue
+            if changes.modified:
+                self._apply_changes(server_name, changes)
+
+            server_drift = list(self.out_of_state.get(server_name, {}).values())
+            if server_drift and changes.task_list is not None:
+                # The list changed since the last backup: keep it before acting on this server
+                backup.write_task_list_to_csv(changes.task_list,
+                                              backup.get_backup_filename(self.host_config, server_name, self.qem_hostname))
+            drifted += server_drift
+
+        if replicate_servers and failed_servers == len(replicate_servers):
+            # Every call failed - most likely an expired session; log in again next cycle
+            logger.warning("No task list could be read from host '%s'. Re-authenticating.", self.qem_hostname)
+            self.login_token = None
+        return drifted
+
+
+def run_daemon(action, mode=None, interval_seconds=None):
+    """
+    Reconciles the configured tasks towards a desired state until cancelled.
+
+    action 'resume' keeps tasks RUNNING, 'stop' keeps them stopped. Every
+    interval one task list per server is read; resume_task/stop_task is issued
+    only for tasks that drifted and are not already being handled. Session,
+    connection pool, task list snapshots and task states stay warm between
+    cycles, so a quiet fleet costs one conditional request per server.
+
+    Parameters:
+        action (str): 'resume' or 'stop'
+        mode (str): 'S' (selected from YAML) or 'A' (all)
+        interval_seconds (float): Seconds between reconcile cycles; overrides settings.daemon_interval_seconds
+    """
+    from qemTasksHandler import main
+
+    config = configParser.load_config()
+    tasks_selection_mode = (mode or config['settings'].get('mode', 'S')).upper()
+    if tasks_selection_mode not in ('S', 'A'):
+        logger.error("Daemon mode supports only task selection modes 'S' and 'A'.")
+        return
+    interval_seconds = float(interval_seconds or config['settings'].get('daemon_interval_seconds', 30))
+    parallel_threads = int(config['settings'].get('parallel_threads', config.get('parallel_threads', 5)))
+
+    runControl.reset()
+    runControl.install_signal_handlers()
+    logger.info("=== Starting QEM reconciler daemon: desired state %s, mode %s, every %.0f seconds ===",
+                DESIRED_STATES[action], tasks_selection_mode, interval_seconds)
+
+    host_configs = utils.get_qem_host_configs(config)
+    reconcilers = []
+    for host_config in host_configs:
+        httpClient.configure_host(host_config['qem_host'].get('qem_hostname'), host_config['settings'])
+        reconcilers.append(HostReconciler(host_config, action, tasks_selection_mode))
+
+    in_flight = {}  # (qem_hostname, server, task) -> future
+    action_fn = resumeTask.resume_task if action == 'resume' else stopTask.stop_task
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=parallel_threads, thread_name_prefix="reconcile") as executor:
+        while not runControl.is_cancelled():
+            # Collect finished actions from earlier cycles
+            for key, future in list(in_flight.items()):
+                if future.done():
+                    del in_flight[key]
+                    try:
+                        logger.info("Reconcile %s of task '%s' on server '%s' (host '%s'): %s",
+                                    action, key[2], key[1], key[0], future.result())
+                    except Exception as e:
+                        logger.exception("Reconcile %s of task '%s' failed: %s", action, key[2], e)
+
+            for reconciler in reconcilers:
+                drifted = [task for task in reconciler.find_drift()
+                           if (reconciler.qem_hostname, task.server_name, task.task_name) not in in_flight]
+                if not drifted:
+                    continue
+                logger.info("%d task(s) drifted from %s on host '%s'.",
+                            len(drifted), DESIRED_STATES[action], reconciler.qem_hostname)
+                # Never touch a task that is in an active full load
+                drifted, skipped, full_load_tasks = main.precheck_tasks(action, drifted, reconciler.qem_hostname,
+                                                                        reconciler.login_token)
+                for row in skipped:
+                    logger.warning("Task '%s' on server '%s' not reconciled this cycle: %s",
+                                   row.task_name, row.server_name, row.result)
+                for task in full_load_tasks:
+                    logger.warning("Task '%s' on server '%s' is in active full load; not reconciled this cycle.",
+                                   task.task_name, task.server_name)
+                for task in drifted:
+                    key = (reconciler.qem_hostname, task.server_name, task.task_name)
+                    in_flight[key] = executor.submit(action_fn, reconciler.qem_hostname, task.server_name,
+                                                     task.task_name, reconciler.login_token)
+
+            runControl.wait(interval_seconds)
+
+    logger.info("=== QEM reconciler daemon stopped: %s ===", runControl.cancel_reason())
@@ -0,0 +1,112 @@
+# Title: Task records
+# Author: Vinay Vitta | Qlik - QDI PS
+# Date: August 2025
+# Description: Compact, slotted records for selected tasks, action results and status rows
+
+from dataclasses import dataclass, fields
+from typing import Optional
+
+
+@dataclass(slots=True)
+class TaskRecord:
+    """
+    A task selected for processing. Only the fields the pipeline uses are kept;
+    the full API payload goes to the backup and is then dropped.
+    """
+    server_name: str
+    task_name: str
+    state: Optional[str] = None
+    priority: int = 0
+    depends_on: tuple = ()          # ((server_name, task_name), ...) upstream tasks
+    expected_seconds: Optional[float] = None
+    confirm_full_load: bool = False  # pre-checked from the discovery cache: re-checked live before acting
+
+
+@dataclass(slots=True)
+class ResultRecord:
+    """
+    One row of the execution report.
+    """
+    server_name: str
+    task_name: str
+    action: str
+    result: Optional[str] = None
+    duration_seconds: Optional[float] = None
+    retries: Optional[int] = None
+    api_calls: Optional[int] = None
+    stop_result: Optional[str] = None
+    qem_host: Optional[str] = None
+
+
+@dataclass(slots=True)
+class StatusRecord:
+    """
+    One row of the fleet status snapshot.
+    """
+    server_name: Optional[str]
+    task_name: Optional[str]
+    state: Optional[str] = None
+    memory_mb: Optional[float] = None
+    full_load_completed: Optional[bool] = None
+    source_latency: Optional[str] = None
+    total_latency: Optional[str] = None
+    qem_host: Optional[str] = None
+
+    @classmethod
+    def from_details(cls, server_name, task_name, details):
+        cdc_latency = details.get('cdc_latency') or {}
+        return cls(server_name, task_name, details.get('state'), details.get('memory_mb'),
+                   details.get('full_load_completed'), cdc_latency.get('source_latency'),
+                   cdc_latency.get('total_latency'))
+
+
+@dataclass(slots=True)
+class PlanRecord:
+    """
+    One row of a dry-run plan: what would happen to a task and what it would cost.
+    """
+    server_name: Optional[str]
+    task_name: Optional[str]
+    action: str
+    plan: Optional[str] = None              # Resume/Stop/Restart, Skip_<result>, Blocked_FullLoad, ...
+    state: Optional[str] = None
+    priority: Optional[int] = None
+    order: Optional[int] = None             # start order in the simulated run
+    start_offset_seconds: Optional[float] = None
+    expected_seconds: Optional[float] = None
+    max_seconds: Optional[float] = None
+    api_calls: Optional[int] = None
+    max_api_calls: Optional[int] = None
+    estimate_source: Optional[str] = None   # 'history' or 'settings'
+    qem_host: Optional[str] = None
+
+
+def tasks_from_api(server_name, task_list_response):
+    """
+    Builds TaskRecords from a get_task_list() response.
+    """
+    if not task_list_response:
+        return []
+    return [TaskRecord(server_name, task.get('name', ''), (task.get('state') or '').upper() or None)
+            for task in task_list_response.get('taskList', [])]
+
+
+def report_fields(records):
+    """
+    Returns the record fields set on at least one record, in declaration order,
+    so optional columns (e.g. stop_result, qem_host) only appear when used.
+    """
+    if not records:
+        return []
+    return [field.name for field in fields(records[0])
+            if any(getattr(record, field.name) is not None for record in records)]
+
+
+def as_row(record, fieldnames=None):
+    """
+    Returns a record as a dict (all fields that are set, or exactly `fieldnames`).
+    """
+    if fieldnames is None:
+        return {field.name: getattr(record, field.name) for field in fields(record)
+                if getattr(record, field.name) is not None}
+    return {name: getattr(record, name) for name in fieldnames}
@@ -0,0 +1,255 @@
+# Title: Run control
+# Author: Vinay Vitta | Qlik - QDI PS
+# Date: August 2025
+# Description: Run-level deadline, graceful cancellation (SIGINT/SIGTERM) and the clock used by polling loops
+
+import heapq
+import signal
+import itertools
+import threading
+import time
+from qemTasksHandler import configParser
+from qemTasksHandler.myLogger import get_logger
+
+config = configParser.load_config()
+logger = get_logger(config)
+
+_cancel_event = threading.Event()
+_cancel_reason = None
+_run_deadline = None  # monotonic() value or None
+_clock = None         # VirtualClock during simulations, None for real time
+
+
+class VirtualClock:
+    """
+    Discrete-event clock for simulations. Time stands still while any
+    participating thread is runnable; once all of them are waiting, it jumps
+    to the earliest wake-up time. Participants are the thread that installs
+    the clock and every thread registered with enter() (see simulator.SimExecutor).
+    """
+
+    class _Waiter:
+        __slots__ = ('event', 'woken')
+
+        def __init__(self):
+            self.event = threading.Event()
+            self.woken = False
+
+    def __init__(self, start=0.0):
+        self._now = float(start)
+        self._lock = threading.Lock()
+        self._busy = 1  # the installing thread
+        self._timers = []
+        self._seq = itertools.count()
+        self._futures_waiter = None
+        self._watched = set()
+
+    def monotonic(self):
+        return self._now
+
+    def enter(self):
+        """
+        Registers one more runnable participant (call before its thread starts).
+        """
+        with self._lock:
+            self._busy += 1
+
+    def leave(self):
+        """
+        Removes a participant whose thread is about to finish.
+        """
+        with self._lock:
+            self._busy -= 1
+            self._advance_if_idle()
+
+    def sleep(self, seconds):
+        waiter = self._waiter(seconds)
+        self._block(waiter)
+
+    def wait_futures(self, futures, timeout=None, return_when=None):
+        """
+        concurrent.futures.wait() on virtual time: returns once any future is
+        done (FIRST_COMPLETED semantics) or `timeout` virtual seconds passed.
+        Only one thread (the scheduling loop) may wait on futures at a time.
+        """
+        futures = set(futures)
+        for future in futures - self._watched:
+            self._watched.add(future)
+            future.add_done_callback(self._future_done)
+        self._watched &= futures
+        done = {future for future in futures if future.done()}
+        if not done:
+            self._block(self._waiter(timeout, futures))
+            done = {future for future in futures if future.done()}
+        return done, futures - done
+
+    def _future_done(self, future):
+        with self._lock:
+            if self._futures_waiter is not None:
+                self._release(self._futures_waiter)
+
+    def _waiter(self, seconds, futures=None):
+        waiter = self._Waiter()
+        with self._lock:
+            if futures is not None:
+                if any(future.done() for future in futures):
+                    waiter.woken = True  # finished since the caller checked; do not give up the turn
+                    waiter.event.set()
+                    return waiter
+                self._futures_waiter = waiter
+            if seconds is not None:
+                heapq.heappush(self._timers, (self._now + max(0.0, seconds), next(self._seq), waiter))
+            self._busy -= 1
+        return waiter
+
+    def _block(self, waiter):
+        with self._lock:
+            self._advance_if_idle()
+        waiter.event.wait()
+
+    def _release(self, waiter):
+        if not waiter.woken:
+            waiter.woken = True
+            self._busy += 1
+            waiter.event.set()
+
+    def _advance_if_idle(self):
+        # Called with the lock held
+        while self._busy == 0 and self._timers:
+            wake_at, _, waiter = heapq.heappop(self._timers)
+            if waiter.woken:
+                continue  # woken early by a finished future
+            self._now = max(self._now, wake_at)
+            self._release(waiter)
+            while self._timers and self._timers[0][0] <= self._now:
+                self._release(heapq.heappop(self._timers)[2])
+
+
+def set_clock(clock):
+    """
+    Installs a VirtualClock for monotonic() and wait(); None restores real time.
+    """
+    global _clock
+    _clock = clock
+
+
+def monotonic():
+    """
+    time.monotonic(), or the virtual time while a simulation clock is installed.
+    """
+    return _clock.monotonic() if _clock is not None else time.monotonic()
+
+
+def reset():
+    """
+    Clears cancellation and deadline state before a new run.
+    """
+    global _cancel_reason, _run_deadline
+    _cancel_event.clear()
+    _cancel_reason = None
+    _run_deadline = None
+
+
+def set_deadline(minutes):
+    """
+    Sets the run deadline to `minutes` from now. None or 0 disables it.
+    """
+    global _run_deadline
+    if minutes:
+        _run_deadline = monotonic() + float(minutes) * 60
+        logger.info("Run deadline set: %.1f minutes from now.", float(minutes))
+    else:
+        _run_deadline = None
+
+
+def cancel(reason="Cancelled"):
+    """
+    Requests cancellation of the current run. Polling loops notice within a second.
+    """
+    global _cancel_reason
+    if not _cancel_event.is_set():
+        _cancel_reason = reason
+        logger.warning("Cancellation requested: %s", reason)
+    _cancel_event.set()
+
+
+def is_cancelled():
+    """
+    True once cancel() was called or the run deadline has passed.
+    """
+    if _cancel_event.is_set():
+        return True
+    if _run_deadline is not None and monotonic() >= _run_deadline:
+        cancel("Run deadline reached")
+        return True
+    return False
+
+
+def cancel_reason():
+    return _cancel_reason
+
+
+def remaining_seconds():
+    """
+    Seconds left until the run deadline, or None when no deadline is set.
+    """
+    if _run_deadline is None:
+        return None
+    return max(0.0, _run_deadline - monotonic())
+
+
+def clamp_deadline(deadline):
+    """
+    Returns the earlier of a task deadline and the run deadline.
+    """
+    if _run_deadline is None:
+        return deadline
+    if deadline is None:
+        return _run_deadline
+    return min(deadline, _run_deadline)
+
+
+def wait(seconds):
+    """
+    Cancellable replacement for time.sleep().
+
+    Returns:
+        bool: True if the run was cancelled (or its deadline passed) while waiting.
+    """
+    if _clock is not None:
+        if is_cancelled():
+            return True
+        _clock.sleep(seconds if _run_deadline is None else min(seconds, max(0.0, _run_deadline - monotonic())))
+        return is_cancelled()
+
+    end = time.monotonic() + max(0.0, seconds)
+    while True:
+        if is_cancelled():
+            return True
+        remaining = end - time.monotonic()
+        if remaining <= 0:
+            return False
+        if _run_deadline is not None:
+            remaining = min(remaining, max(0.0, _run_deadline - time.monotonic()))
+        # Wake at least once a second so the run deadline is noticed promptly
+        if _cancel_event.wait(min(remaining, 1.0)):
+            return True
+
+
+def _handle_signal(signum, frame):
+    if _cancel_event.is_set():
+        # Second Ctrl-C: give up on graceful shutdown
+        raise KeyboardInterrupt
+    cancel(f"Received signal {signal.Signals(signum).name}")
+
+
+def install_signal_handlers():
+    """
+    Routes SIGINT/SIGTERM to cancel(). Only possible from the main thread;
+    elsewhere this is a no-op.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return
+    signal.signal(signal.SIGINT, _handle_signal)
+    if hasattr(signal, "SIGTERM"):
+        signal.signal(signal.SIGTERM, _handle_signal)
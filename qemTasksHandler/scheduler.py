@@ -0,0 +1,242 @@
+# Title: Task scheduler
+# Author: Vinay Vitta | Qlik - QDI PS
+# Date: August 2025
+# Description: Dependency- and priority-aware task scheduler with per-server bulkheads
+
+import math
+import heapq
+import itertools
+import collections
+from qemTasksHandler import configParser, records, runControl
+from qemTasksHandler.myLogger import get_logger
+
+config = configParser.load_config()
+logger = get_logger(config)
+
+# Results meaning the task is in the target state, so its dependents may start
+TARGET_STATE_RESULTS = ('ResumeSuccess', 'Already_in_Running_State', 'StopSuccess', 'Already_in_STOPPED_State')
+
+
+def task_key(server_name, task_name):
+    return server_name, task_name.lower()
+
+
+def build_prerequisites(tasks, action):
+    """
+    Builds the prerequisite graph for the tasks of one run.
+
+    A task's `depends_on` lists its upstream tasks. Resuming starts upstream
+    tasks first, so a task waits for its depends_on; stopping goes downstream
+    first, so a task waits for every task that depends on it. Restart follows
+    the resume order: a dependent restarts once its upstream tasks are running
+    again. Dependencies on tasks that are not part of this run are ignored.
+
+    Returns:
+        dict: {task_key: set of prerequisite task_keys}
+    """
+    keys = {task_key(task.server_name, task.task_name) for task in tasks}
+    prerequisites = {key: set() for key in keys}
+    for task in tasks:
+        key = task_key(task.server_name, task.task_name)
+        for upstream in task.depends_on:
+            upstream = task_key(*upstream)
+            if upstream not in keys or upstream == key:
+                continue
+            if action == 'stop':
+                prerequisites[upstream].add(key)
+            else:
+                prerequisites[key].add(upstream)
+    return prerequisites
+
+
+def find_cycle(tasks, action='resume'):
+    """
+    Returns one dependency cycle as a list of task keys, or None if the graph is acyclic.
+    """
+    prerequisites = build_prerequisites(tasks, action)
+    visiting, done = set(), set()
+
+    for start in prerequisites:
+        if start in done:
+            continue
+        stack = [(start, iter(prerequisites[start]))]
+        path = [start]
+        visiting.add(start)
+        while stack:
+            node, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                path.pop()
+                visiting.discard(node)
+                done.add(node)
+            elif child in visiting:
+                return path[path.index(child):] + [child]
+            elif child not in done:
+                visiting.add(child)
+                path.append(child)
+                stack.append((child, iter(prerequisites[child])))
+    return None
+
+
+class TaskScheduler:
+    """
+    Hands out tasks as soon as their prerequisites reached the target state.
+
+    Ready tasks are ordered by priority (higher first), then by expected
+    duration from run history (longer first). Each server may hold at most its
+    fair share of the worker pool (parallel_threads divided by the servers that
+    have ready or running tasks), optionally capped by server_max_parallel, and servers
+    with equally urgent work are served round-robin.
+
+    Held tasks (e.g. deferred while in active full load) are not started
+    until release() is called; their dependents wait for them as usual.
+    """
+
+    def __init__(self, tasks, action, parallel_threads, server_max_parallel=None, held=()):
+        cycle = find_cycle(tasks, action)
+        if cycle:
+            raise ValueError("Dependency cycle: " + " -> ".join(f"{server}/{task}" for server, task in cycle))
+
+        self.parallel_threads = parallel_threads
+        self.server_max_parallel = server_max_parallel
+        self.tasks = {task_key(task.server_name, task.task_name): task for task in tasks}
+        self.waiting_on = build_prerequisites(tasks, action)
+        self.dependents = collections.defaultdict(set)
+        for key, prerequisites in self.waiting_on.items():
+            for prerequisite in prerequisites:
+                self.dependents[prerequisite].add(key)
+
+        self.ready = collections.OrderedDict()       # server -> heap of (sort key, seq, task key)
+        self.unfinished = collections.Counter()      # server -> tasks not yet completed
+        self.in_flight = collections.Counter()       # server -> tasks running
+        self.started = set()
+        self.ready_at = {}                            # task key -> runControl.monotonic() when it became ready
+        self.held = {task_key(task.server_name, task.task_name) for task in held} & set(self.tasks)
+        self.held_by_server = collections.Counter(server for server, _ in self.held)
+        self._seq = itertools.count()
+        for key, task in self.tasks.items():
+            self.unfinished[task.server_name] += 1
+            self.ready.setdefault(task.server_name, [])
+            if not self.waiting_on[key] and key not in self.held:
+                self._make_ready(key)
+
+    def _make_ready(self, key):
+        task = self.tasks[key]
+        sort_key = (-task.priority, -(task.expected_seconds or 0))
+        self.ready_at[key] = runControl.monotonic()
+        heapq.heappush(self.ready[task.server_name], (sort_key, next(self._seq), key))
+
+    def has_pending(self):
+        return any(self.unfinished.values())
+
+    def next_task(self):
+        """
+        Returns the next task to submit, or None if nothing is ready or every
+        server with ready work is at its bulkhead limit.
+        """
+        # Servers whose remaining work is held or waiting on prerequisites do not take a share of the pool
+        active_servers = [server for server, heap in self.ready.items() if heap or self.in_flight[server]]
+        if not active_servers:
+            return None
+        limit = math.ceil(self.parallel_threads / len(active_servers))
+        if self.server_max_parallel:
+            limit = min(limit, self.server_max_parallel)
+
+        eligible = [server for server, heap in self.ready.items() if heap and self.in_flight[server] < limit]
+        if not eligible:
+            return None
+        # min() keeps the first of equally urgent servers, i.e. round-robin order
+        server = min(eligible, key=lambda s: self.ready[s][0][0])
+        self.ready.move_to_end(server)
+        _, _, key = heapq.heappop(self.ready[server])
+        self.started.add(key)
+        self.in_flight[server] += 1
+        return self.tasks[key]
+
+    def release(self, task):
+        """
+        Lets a held task start once its prerequisites reached the target state.
+        """
+        key = task_key(task.server_name, task.task_name)
+        if key not in self.held:
+            return
+        self.held.discard(key)
+        self.held_by_server[task.server_name] -= 1
+        if key in self.waiting_on and not self.waiting_on[key]:
+            self._make_ready(key)
+
+    def complete(self, task, row, action):
+        """
+        Records a finished task. Dependents become ready once all their
+        prerequisites reached the target state; if this task did not, its
+        dependents (transitively) are not started.
+
+        Returns:
+            list: report rows for dependents that will not be started.
+        """
+        self.in_flight[task.server_name] -= 1
+        return self._finish(task, row, action)
+
+    def abandon(self, task, row, action):
+        """
+        Finishes a held task that will not be started (its report row is `row`).
+
+        Returns:
+            list: report rows for dependents that will not be started.
+        """
+        key = task_key(task.server_name, task.task_name)
+        if key not in self.waiting_on:
+            return []  # already skipped because a prerequisite failed
+        if key in self.held:
+            self.held.discard(key)
+            self.held_by_server[task.server_name] -= 1
+        del self.waiting_on[key]
+        return self._finish(task, row, action)
+
+    def _finish(self, task, row, action):
+        key = task_key(task.server_name, task.task_name)
+        self.unfinished[task.server_name] -= 1
+
+        if row.result in TARGET_STATE_RESULTS:
+            for dependent in self.dependents.pop(key, ()):
+                if dependent not in self.waiting_on:
+                    continue
+                self.waiting_on[dependent].discard(key)
+                if not self.waiting_on[dependent] and dependent not in self.held:
+                    self._make_ready(dependent)
+            return []
+
+        skipped_rows = []
+        blocked = list(self.dependents.pop(key, ()))
+        while blocked:
+            dependent = blocked.pop()
+            if dependent not in self.waiting_on:
+                continue
+            del self.waiting_on[dependent]
+            skipped = self.tasks[dependent]
+            self.unfinished[skipped.server_name] -= 1
+            if dependent in self.held:
+                self.held.discard(dependent)
+                self.held_by_server[skipped.server_name] -= 1
+            logger.warning("Task '%s' on server '%s' not started: prerequisite '%s' did not reach the target state.",
+                           skipped.task_name, skipped.server_name, task.task_name)
+            skipped_rows.append(records.ResultRecord(skipped.server_name, skipped.task_name, action,
+                                                     "Skipped_Dependency_Failed"))
+            blocked.extend(self.dependents.pop(dependent, ()))
+        return skipped_rows
+
+    def drain(self, action, result="Skipped"):
+        """
+        Removes every task not yet started and returns report rows for them.
+        """
+        not_started = [key for key in self.waiting_on if key not in self.started]
+        for key in not_started:
+            del self.waiting_on[key]
+            self.unfinished[self.tasks[key].server_name] -= 1
+        for heap in self.ready.values():
+            heap.clear()
+        self.held.clear()
+        self.held_by_server.clear()
+        return [records.ResultRecord(self.tasks[key].server_name, self.tasks[key].task_name, action, result)
+                for key in not_started]
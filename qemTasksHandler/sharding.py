@@ -0,0 +1,210 @@
+# Title: Sharded execution
+# Author: Vinay Vitta | Qlik - QDI PS
+# Date: August 2025
+# Description: Multi-process execution - shards replicate servers across worker processes
+
+import threading
+import concurrent.futures
+from qemTasksHandler import configParser, runControl, notifier, tracing
+from qemTasksHandler.myLogger import get_logger
+
+config = configParser.load_config()
+logger = get_logger(config)
+
+
+def _server_groups(replicate_servers):
+    """
+    Groups servers linked by cross-server depends_on entries, so dependent
+    tasks are always scheduled by the same process.
+    """
+    parent = {server.get('name'): server.get('name') for server in replicate_servers}
+
+    def find(name):
+        while parent[name] != name:
+            parent[name] = parent[parent[name]]
+            name = parent[name]
+        return name
+
+    for server in replicate_servers:
+        for task in server.get('tasks') or []:
+            for upstream in (task.get('depends_on') or []) if isinstance(task, dict) else []:
+                if isinstance(upstream, dict) and upstream.get('server') in parent:
+                    parent[find(upstream['server'])] = find(server.get('name'))
+
+    groups = {}
+    for server in replicate_servers:
+        groups.setdefault(find(server.get('name')), []).append(server)
+    return list(groups.values())
+
+
+def plan_shards(replicate_servers, processes):
+    """
+    Splits replicate servers into at most `processes` shards of similar size.
+    Servers are placed largest-first (by configured task count) on the
+    currently lightest shard; servers linked by dependencies stay together.
+
+    Returns:
+        list: list of lists of server names; empty shards are dropped.
+    """
+    shards = [[] for _ in range(max(1, processes))]
+    weights = [0] * len(shards)
+    groups = [(sum(max(1, len(server.get('tasks') or [])) for server in group), group)
+              for group in _server_groups(replicate_servers)]
+    for weight, group in sorted(groups, key=lambda g: g[0], reverse=True):
+        lightest = weights.index(min(weights))
+        shards[lightest] += [server.get('name') for server in group]
+        weights[lightest] += weight
+    return [shard for shard in shards if shard]
+
+
+def _init_shard_process(cancel_event, deadline_seconds, trace_origin=None):
+    """
+    Runs once in every worker process: applies the remaining run deadline,
+    routes Ctrl-C/SIGTERM to cancellation and follows the coordinator's cancel event.
+    With a trace_origin the process records trace events on the coordinator's time base.
+    """
+    runControl.reset()
+    notifier.reset()
+    if deadline_seconds is not None:
+        runControl.set_deadline(deadline_seconds / 60)
+    if trace_origin is not None:
+        tracing.start(trace_origin, process_name="qem-shard")
+    runControl.install_signal_handlers()
+
+    def follow_coordinator():
+        cancel_event.wait()
+        runControl.cancel("Cancelled by coordinator")
+
+    threading.Thread(target=follow_coordinator, name="shard-cancel-watcher", daemon=True).start()
+
+
+def _configure_host(host_config):
+    # Host settings and rate limiters live per process; each shard enforces the host's limit on its own calls
+    from restAPI import httpClient
+    httpClient.configure_host(host_config['qem_host'].get('qem_hostname'), host_config['settings'])
+
+
+def _shard_login(host_config, login_token):
+    if login_token:
+        return login_token
+    from restAPI import login
+    qem_host = host_config['qem_host']
+    return login.login_api(qem_host.get('qem_hostname'), qem_host.get('qem_user'), qem_host.get('qem_psw'))
+
+
+def prepare_shard(host_config, action, tasks_selection_mode, login_token, server_names):
+    """
+    Worker-process step 1: backup, task selection and full load pre-check for one shard.
+    """
+    from qemTasksHandler import main
+    _configure_host(host_config)
+    qem_hostname = host_config['qem_host'].get('qem_hostname')
+    login_token = _shard_login(host_config, login_token)
+    if not login_token:
+        logger.error("Login failed for shard %s.", server_names)
+        return {'tasks': [], 'results': [], 'full_load_tasks': [], 'login_token': None, 'login_failed': True,
+                'trace_events': tracing.drain()}
+    with tracing.span("discovery", cat='phase', host=qem_hostname, servers=len(server_names)):
+        tasks_to_run = main.select_tasks(host_config, action, tasks_selection_mode, qem_hostname, login_token,
+                                         server_names=server_names)
+    with tracing.span("full load pre-check", cat='phase', host=qem_hostname, tasks=len(tasks_to_run)):
+        reachable_tasks, results, full_load_tasks = main.precheck_tasks(action, tasks_to_run, qem_hostname,
+                                                                        login_token, host_config)
+    logger.info("Shard %s prepared: %d task(s) queued.", server_names, len(reachable_tasks))
+    return {'tasks': reachable_tasks, 'results': results, 'full_load_tasks': full_load_tasks,
+            'login_token': login_token, 'login_failed': False, 'trace_events': tracing.drain()}
+
+
+def execute_shard(host_config, action, login_token, tasks_to_run, deferred_tasks=None):
+    """
+    Worker-process step 2: runs the shard's tasks on the process's own executor and session.
+
+    Returns:
+        tuple: (result rows, trace events recorded by this process)
+    """
+    from qemTasksHandler import main
+    _configure_host(host_config)
+    settings = host_config['settings']
+    parallel_threads = int(settings.get('parallel_threads', host_config.get('parallel_threads', 5)))
+    with tracing.span("execution", cat='phase', host=host_config['qem_host'].get('qem_hostname')):
+        results = main.execute_tasks(action, tasks_to_run, host_config['qem_host'].get('qem_hostname'), login_token,
+                                     parallel_threads, settings.get('server_max_parallel'), deferred_tasks, settings)
+    return results, tracing.drain()
+
+
+def _gather(futures, cancel_event):
+    """
+    Waits for all futures, forwarding coordinator cancellation to the workers.
+    """
+    pending = set(futures)
+    while pending:
+        if runControl.is_cancelled():
+            cancel_event.set()
+        _, pending = concurrent.futures.wait(pending, timeout=1)
+    return [future.result() for future in futures]
+
+
+def _run_on_pool(processes, jobs):
+    """
+    Runs (fn, args) jobs on a fresh process pool and returns their results in order.
+    """
+    import multiprocessing  # only sharded runs need it
+    # Not fork: the pool is started while other host, notifier and deferral threads may hold locks
+    # (sessions, breakers, rate limiters) that a forked child would inherit in their locked state
+    mp_context = multiprocessing.get_context("spawn")
+    cancel_event = mp_context.Event()
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=processes, mp_context=mp_context,
+            initializer=_init_shard_process, initargs=(cancel_event, runControl.remaining_seconds(), tracing.origin())) as pool:
+        return _gather([pool.submit(fn, *args) for fn, args in jobs], cancel_event)
+
+
+def prepare_sharded(host_config, action, tasks_selection_mode, login_token, processes):
+    """
+    Coordinator step 1: shards the host's replicate servers across worker
+    processes, each running discovery and the full load pre-check.
+
+    Nothing is executed yet, so the caller can still abort the whole run if
+    any shard finds a task in active full load.
+
+    settings.shard_login: 'shared' (default) reuses the coordinator's session
+    token; 'per_shard' logs in separately from every process.
+
+    Returns:
+        list: one prepared shard dict per process
+              ({'tasks', 'results', 'full_load_tasks', 'login_token', 'login_failed'}).
+    """
+    settings = host_config['settings']
+    shared_token = login_token if settings.get('shard_login', 'shared') == 'shared' else None
+
+    shards = plan_shards(host_config.get('replicate_servers', []), processes)
+    logger.info("[3/5] Sharding %d server(s) of host '%s' across %d process(es): %s",
+                sum(len(shard) for shard in shards), host_config['qem_host'].get('qem_hostname'),
+                len(shards), shards)
+
+    prepared = _run_on_pool(len(shards), [
+        (prepare_shard, (host_config, action, tasks_selection_mode, shared_token, shard)) for shard in shards
+    ])
+    for shard, shard_result in zip(shards, prepared):
+        tracing.add_events(shard_result.pop('trace_events', None))
+        if shard_result['login_failed']:
+            logger.error("Login failed for shard %s. The host's run is aborted.", shard)
+    return prepared
+
+
+def execute_sharded(host_config, action, prepared):
+    """
+    Coordinator step 2: every process executes its prepared tasks with its own
+    connection pool and thread pool (parallel_threads per process).
+
+    Returns:
+        list: merged result rows for utils.save_qem_task_report.
+    """
+    jobs = [(execute_shard, (host_config, action, shard['login_token'], shard['tasks'], shard['full_load_tasks']))
+            for shard in prepared if shard['tasks'] or shard['full_load_tasks']]
+    results = []
+    if jobs:
+        for shard_results, trace_events in _run_on_pool(len(jobs), jobs):
+            results += shard_results
+            tracing.add_events(trace_events)
+    return results
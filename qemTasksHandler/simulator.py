@@ -0,0 +1,335 @@
+# Title: Scheduler simulator
+# Author: Vinay Vitta | Qlik - QDI PS
+# Date: August 2025
+# Description: Runs the real discovery, pre-check, scheduling and polling code against a fake QEM on a virtual clock
+
+import json
+import math
+import time
+import random
+import argparse
+import threading
+import statistics
+import collections
+import concurrent.futures
+import urllib.parse
+import requests
+import yaml
+from qemTasksHandler import configParser, runControl, main, tracing, utils
+from qemTasksHandler.myLogger import get_logger
+from restAPI import login, httpClient
+
+config = configParser.load_config()
+logger = get_logger(config)
+
+SIMULATED_HOST = "qem.simulated"
+
+# Durations are log-normal: `median` seconds, `sigma` the spread of log(duration)
+DEFAULT_PROFILE = {
+    'api_latency': {'median': 0.15, 'sigma': 0.4},  # seconds per QEM API call
+    'api_capacity': None,                           # concurrent calls QEM serves at full speed (None = unlimited)
+    'resume': {'median': 45, 'sigma': 0.6},         # seconds from the RESUME request until RUNNING
+    'stop': {'median': 20, 'sigma': 0.5},           # seconds from the STOP request until STOPPED
+    'ignored_action_rate': 0.02,                    # share of actions accepted but never applied
+    'server_error_rate': 0.0,                       # share of calls answered with HTTP 503
+    'running_fraction': None,                       # initial RUNNING share (default: 0 for resume, else 1)
+}
+
+
+def _lognormal(rng, distribution):
+    return rng.lognormvariate(math.log(distribution['median']), distribution['sigma'])
+
+
+def _response(status_code, payload=None, headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = json.dumps(payload).encode() if payload is not None else b""
+    response.headers.update(headers or {})
+    return response
+
+
+class FakeQem:
+    """
+    In-memory QEM backend for httpClient.set_transport(). Every call takes a
+    sampled latency on the virtual clock (longer once more than api_capacity
+    calls are in flight); stop/resume requests complete after a sampled
+    transition time and are occasionally ignored.
+    """
+
+    def __init__(self, clock, servers, tasks_per_server, profile, seed=1, running_fraction=0.0):
+        self.clock = clock
+        self.profile = profile
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.servers = [f"sim_server_{number:03d}" for number in range(servers)]
+        self.tasks = {}
+        for server in self.servers:
+            for number in range(tasks_per_server):
+                running = self.rng.random() < running_fraction
+                self.tasks[(server, f"sim_task_{number:04d}")] = {'state': 'RUNNING' if running else 'STOPPED',
+                                                                  'pending': None}
+        self.calls = collections.Counter()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def transport(self, method, url, timeout=None, **kwargs):
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path.split('/api/v1/', 1)[-1].strip('/').split('/')
+        query = urllib.parse.parse_qs(parts.query)
+        kind = 'login' if path == ['login'] else 'task_list' if len(path) == 3 else \
+            'action' if method == 'POST' else 'task_details'
+        with self.lock:
+            self.calls[kind] += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            latency = _lognormal(self.rng, self.profile['api_latency'])
+            if self.profile['api_capacity']:
+                # Beyond its capacity QEM slows down in proportion to the calls in flight
+                latency *= max(1.0, self.in_flight / self.profile['api_capacity'])
+            failed = self.rng.random() < self.profile['server_error_rate']
+        try:
+            self.clock.sleep(latency)
+            if failed:
+                return _response(503, {'error_code': 'SERVICE_UNAVAILABLE'})
+            with self.lock:
+                return self._handle(kind, method, path, query)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def _details(self, key):
+        task = self.tasks[key]
+        pending = task['pending']
+        if pending and self.clock.monotonic() >= pending[1]:
+            task['state'], task['pending'] = pending[0], None
+        running = task['state'] == 'RUNNING'
+        return {'name': key[1], 'state': task['state'], 'memory_mb': 256 if running else 0,
+                'full_load_completed': True, 'cdc_latency': {'source_latency': '00:00:01',
+                                                             'total_latency': '00:00:02'}}
+
+    def _handle(self, kind, method, path, query):
+        if kind == 'login':
+            return _response(200, {}, {'EnterpriseManager.APISessionID': 'simulated-session'})
+        server = path[1]
+        if kind == 'task_list':
+            return _response(200, {'taskList': [{'name': task, 'state': self._details((srv, task))['state']}
+                                                for srv, task in self.tasks if srv == server]})
+        key = (server, path[3])
+        if key not in self.tasks:
+            return _response(404, {'error_code': 'AEM_TASK_NOT_FOUND'})
+        details = self._details(key)
+        if kind == 'task_details':
+            return _response(200, details)
+
+        target = 'RUNNING' if query.get('action') == ['run'] else 'STOPPED'
+        task = self.tasks[key]
+        if details['state'] != target and task['pending'] is None \
+                and self.rng.random() >= self.profile['ignored_action_rate']:
+            distribution = self.profile['resume' if target == 'RUNNING' else 'stop']
+            task['pending'] = (target, self.clock.monotonic() + _lognormal(self.rng, distribution))
+        return _response(200, {})
+
+
+class SimExecutor:
+    """
+    Executor for main.execute_tasks on a VirtualClock: up to max_workers
+    threads (all if None), registered with the clock so virtual time only
+    advances while every worker is waiting. Further submissions queue until a
+    worker is free, as in a thread pool. Tracks peak task concurrency.
+    """
+
+    def __init__(self, clock, max_workers=None):
+        self.clock = clock
+        self.max_workers = max_workers
+        self.lock = threading.Lock()
+        self.queue = collections.deque()
+        self.workers = 0
+        self.running = 0
+        self.peak_running = 0
+        self.threads = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        for thread in self.threads:
+            thread.join()
+        return False
+
+    def with_max_workers(self, max_workers):
+        """
+        executor_factory for main.execute_tasks: the pool size it asks for bounds the workers.
+        """
+        self.max_workers = max_workers
+        return self
+
+    def submit(self, fn, *args):
+        future = concurrent.futures.Future()
+        with self.lock:
+            if self.max_workers and self.workers >= self.max_workers:
+                self.queue.append((future, fn, args))
+                return future
+            self.workers += 1
+        self.clock.enter()
+        thread = threading.Thread(target=self._work, args=(future, fn, args), daemon=True)
+        self.threads.append(thread)
+        thread.start()
+        return future
+
+    def _work(self, future, fn, args):
+        while True:
+            future.set_running_or_notify_cancel()
+            with self.lock:
+                self.running += 1
+                self.peak_running = max(self.peak_running, self.running)
+            try:
+                result = fn(*args)
+            except BaseException as e:
+                with self.lock:
+                    self.running -= 1
+                future.set_exception(e)
+            else:
+                with self.lock:
+                    self.running -= 1
+                future.set_result(result)  # wakes the scheduling loop before this worker leaves the clock
+            with self.lock:
+                if not self.queue:
+                    self.workers -= 1
+                    break
+                future, fn, args = self.queue.popleft()
+        self.clock.leave()
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1)))))] if ordered else None
+
+
+def run_simulation(action='resume', servers=50, tasks_per_server=200, parallel_threads=None,
+                   server_max_parallel=None, profile=None, seed=1, log_level='WARNING', settings=None, trace=False):
+    """
+    Simulates one run (login, discovery, full load pre-check and execution)
+    with the real main/scheduler/resumeTask/stopTask/httpClient code on a
+    virtual clock. Polling intervals, timeouts, retries, the rate limit and
+    adaptive concurrency come from config.yaml, overridden by `settings`.
+    With `trace` the run's timeline (in simulated time) is written as a
+    Chrome trace next to the reports.
+
+    Returns:
+        dict: simulated phase durations and makespan, wall-clock time, peak
+              task and API concurrency, API call totals and task outcomes.
+    """
+    config = configParser.load_config()
+    settings = {**config['settings'], **(settings or {}), 'discovery_cache': False}
+    profile = {**DEFAULT_PROFILE, **(profile or {})}
+    running_fraction = profile['running_fraction']
+    if running_fraction is None:
+        running_fraction = 0.0 if action == 'resume' else 1.0
+    parallel_threads = int(parallel_threads or settings.get('parallel_threads', 5))
+    server_max_parallel = server_max_parallel or settings.get('server_max_parallel')
+
+    clock = runControl.VirtualClock()
+    backend = FakeQem(clock, servers, tasks_per_server, profile, seed, running_fraction)
+    sim_config = {**config, 'settings': settings, 'qem_host': {'qem_hostname': SIMULATED_HOST},
+                  'replicate_servers': [{'name': server} for server in backend.servers]}
+    previous_level = logger.level
+    logger.setLevel(log_level)
+    runControl.reset()
+    runControl.set_clock(clock)
+    httpClient.set_transport(backend.transport)
+    httpClient.configure_host(SIMULATED_HOST, settings)
+    if trace:
+        tracing.start(process_name="qem-simulator")
+    wall_started = time.perf_counter()
+    try:
+        login_token = login.login_api(SIMULATED_HOST, "simulator", "simulator")
+        with tracing.span("discovery", cat='phase', host=SIMULATED_HOST):
+            tasks = main.select_tasks(sim_config, action, 'A', SIMULATED_HOST, login_token, write_backup=False)
+        discovered_at = clock.monotonic()
+        with tracing.span("full load pre-check", cat='phase', host=SIMULATED_HOST, tasks=len(tasks)):
+            tasks, results, _ = main.precheck_tasks(action, tasks, SIMULATED_HOST, login_token)
+        prechecked_at = clock.monotonic()
+        executor = SimExecutor(clock)
+        with tracing.span("execution", cat='phase', host=SIMULATED_HOST):
+            results += main.execute_tasks(action, tasks, SIMULATED_HOST, login_token, parallel_threads,
+                                          server_max_parallel, settings=settings,
+                                          executor_factory=executor.with_max_workers,
+                                          wait_fn=clock.wait_futures)
+    finally:
+        trace_document = tracing.stop()
+        runControl.set_clock(None)
+        httpClient.set_transport(None)
+        httpClient.set_rate_limit(SIMULATED_HOST, None)
+        logger.setLevel(previous_level)
+    wall_seconds = time.perf_counter() - wall_started
+
+    durations = [row.duration_seconds for row in results if row.duration_seconds is not None]
+    return {
+        'action': action,
+        'servers': servers,
+        'tasks': servers * tasks_per_server,
+        'parallel_threads': parallel_threads,
+        'server_max_parallel': server_max_parallel,
+        'seed': seed,
+        'simulated_makespan_seconds': round(clock.monotonic(), 1),
+        'simulated_discovery_seconds': round(discovered_at, 1),
+        'simulated_precheck_seconds': round(prechecked_at - discovered_at, 1),
+        'simulated_execution_seconds': round(clock.monotonic() - prechecked_at, 1),
+        'wall_seconds': round(wall_seconds, 2),
+        'peak_task_concurrency': executor.peak_running,
+        'peak_api_concurrency': backend.peak_in_flight,
+        'api_calls': sum(backend.calls.values()),
+        'api_calls_by_kind': dict(backend.calls),
+        'retries': sum(row.retries or 0 for row in results),
+        'task_seconds_p50': round(statistics.median(durations), 1) if durations else None,
+        'task_seconds_p95': _percentile(durations, 0.95),
+        'task_seconds_max': max(durations) if durations else None,
+        'results': dict(collections.Counter(str(row.result) for row in results)),
+        'trace_file': utils.save_qem_trace(config['logging']['result_path'], trace_document,
+                                           f"simulate_{action}") if trace_document else None,
+    }
+
+
+def simulate_command(argv=None):
+    """
+    CLI: python run.py simulate [--action resume|stop|restart] [--servers N] [--tasks-per-server N]
+                                [--threads N] [--server-max-parallel N] [--adaptive] [--two-phase] [--profile FILE]
+                                [--seed N] [--trace] [--json]
+    """
+    parser = argparse.ArgumentParser(prog="run.py simulate",
+                                     description="Simulate a run against a fake QEM on a virtual clock")
+    parser.add_argument("--action", choices=["resume", "stop", "restart"], default="resume",
+                        help="Action to simulate (default: resume)")
+    parser.add_argument("--servers", type=int, default=50, help="Replicate servers (default: 50)")
+    parser.add_argument("--tasks-per-server", type=int, default=200, help="Tasks per server (default: 200)")
+    parser.add_argument("--threads", type=int, help="parallel_threads (default: settings.parallel_threads)")
+    parser.add_argument("--server-max-parallel", type=int, help="Per-server worker limit (default: settings)")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="Enable adaptive concurrency (bounds and thresholds from settings)")
+    parser.add_argument("--two-phase", action="store_true",
+                        help="Send all actions first, then confirm states in bulk (execution_mode 'two_phase')")
+    parser.add_argument("--profile", type=str,
+                        help="YAML/JSON file overriding the latency and transition distributions")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed (default: 1)")
+    parser.add_argument("--trace", action="store_true",
+                        help="Write the simulated timeline as a Chrome trace (open in Perfetto)")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args(argv)
+
+    profile = None
+    if args.profile:
+        with open(args.profile, encoding='utf-8') as profile_file:
+            profile = yaml.safe_load(profile_file) or {}
+    settings = {}
+    if args.adaptive:
+        settings['adaptive_concurrency'] = True
+    if args.two_phase:
+        settings['execution_mode'] = 'two_phase'
+    report = run_simulation(args.action, args.servers, args.tasks_per_server, args.threads,
+                            args.server_max_parallel, profile, args.seed, settings=settings, trace=args.trace)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    width = max(len(key) for key in report)
+    for key, value in report.items():
+        print(f"{key.ljust(width)}  {value}")
@@ -0,0 +1,115 @@
+# Title: Task list watcher
+# Author: Vinay Vitta | Qlik - QDI PS
+# Date: August 2025
+# Description: Incremental change detection for repeatedly polled task lists
+
+import json
+import hashlib
+from dataclasses import dataclass, field
+from typing import Optional
+from qemTasksHandler import configParser
+from qemTasksHandler.myLogger import get_logger
+from restAPI import getTaskList
+
+config = configParser.load_config()
+logger = get_logger(config)
+
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+@dataclass(slots=True)
+class TaskListChanges:
+    """
+    What changed in one server's task list since the previous poll.
+    """
+    server_name: str
+    changed: list = field(default_factory=list)   # API task rows that are new or differ from the last poll
+    removed: list = field(default_factory=list)   # names of tasks no longer listed
+    unchanged: int = 0                            # rows identical to the last poll
+    first: bool = False                           # first poll of this server: every row is in changed
+    task_list: Optional[dict] = None              # full parsed response; None when nothing changed (not parsed)
+
+    @property
+    def modified(self):
+        return bool(self.changed or self.removed)
+
+
+@dataclass(slots=True)
+class _Snapshot:
+    etag: Optional[str]
+    last_modified: Optional[str]
+    body_digest: bytes
+    row_digests: dict                             # task name -> digest of the row's content
+
+
+class TaskListWatcher:
+    """
+    Polls the task lists of one QEM host and reports only what changed.
+
+    Per server it keeps the ETag / Last-Modified validators, a digest of the
+    last body and one content digest per task row (no payloads). A 304 reply
+    or an identical body costs no parsing at all; otherwise only rows whose
+    digest changed are handed to the caller, so downstream work follows the
+    number of changes rather than the fleet size.
+    """
+
+    def __init__(self, qem_hostname):
+        self.qem_hostname = qem_hostname
+        self._snapshots = {}
+
+    def forget(self, server_name=None):
+        """
+        Drops the snapshot of one server (or all), so the next poll reports every row.
+        """
+        if server_name is None:
+            self._snapshots.clear()
+        else:
+            self._snapshots.pop(server_name, None)
+
+    def poll(self, server_name, login_token):
+        """
+        Reads the task list of one server.
+
+        Returns:
+            TaskListChanges, or None if the list could not be read.
+        """
+        snapshot = self._snapshots.get(server_name)
+        response = getTaskList.get_task_list_response(self.qem_hostname, server_name, login_token,
+                                                      snapshot.etag if snapshot else None,
+                                                      snapshot.last_modified if snapshot else None)
+        if response is None:
+            return None
+        if response.status_code == 304 and snapshot:
+            return TaskListChanges(server_name, unchanged=len(snapshot.row_digests))
+
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        body_digest = _digest(response.content)
+        if snapshot and body_digest == snapshot.body_digest:
+            snapshot.etag, snapshot.last_modified = etag, last_modified
+            return TaskListChanges(server_name, unchanged=len(snapshot.row_digests))
+
+        try:
+            task_list = response.json()
+        except ValueError as e:
+            logger.error("Invalid task list response for server '%s': %s", server_name, e)
+            return None
+
+        previous = snapshot.row_digests if snapshot else {}
+        row_digests = {}
+        changes = TaskListChanges(server_name, first=snapshot is None, task_list=task_list)
+        for row in task_list.get('taskList', []):
+            name = row.get('name', '')
+            row_digest = _digest(json.dumps(row, sort_keys=True, default=str).encode())
+            row_digests[name] = row_digest
+            if previous.get(name) == row_digest:
+                changes.unchanged += 1
+            else:
+                changes.changed.append(row)
+        changes.removed = [name for name in previous if name not in row_digests]
+        self._snapshots[server_name] = _Snapshot(etag, last_modified, body_digest, row_digests)
+        logger.debug("Task list of server '%s': %d changed, %d removed, %d unchanged.",
+                     server_name, len(changes.changed), len(changes.removed), changes.unchanged)
+        return changes
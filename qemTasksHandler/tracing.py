@@ -0,0 +1,178 @@
+# Title: Execution trace
+# Author: Vinay Vitta | Qlik - QDI PS
+# Date: August 2025
+# Description: Timestamped spans of every task's lifecycle, exported in Chrome trace / Perfetto JSON format
+
+import os
+import threading
+from qemTasksHandler import configParser, runControl
+from qemTasksHandler.myLogger import get_logger
+
+config = configParser.load_config()
+logger = get_logger(config)
+
+_recorder = None
+
+
+class TraceRecorder:
+    """
+    Collects trace events of one process. Timestamps are runControl.monotonic()
+    microseconds since `origin` (shared by all shard processes of a run), so
+    simulated runs are traced in virtual time. Threads become tracks named after
+    the thread (e.g. the worker of a task), the process id separates shards.
+    """
+
+    def __init__(self, origin=None, process_name="qem-task-handler"):
+        self.origin = runControl.monotonic() if origin is None else origin
+        self.pid = os.getpid()
+        self.events = [{'name': 'process_name', 'ph': 'M', 'pid': self.pid, 'tid': 0,
+                        'args': {'name': f"{process_name} ({self.pid})"}}]
+        self._threads = {}
+        self._lock = threading.Lock()
+
+    def timestamp(self, at=None):
+        return round(((runControl.monotonic() if at is None else at) - self.origin) * 1e6, 1)
+
+    def _tid(self):
+        ident = threading.get_ident()
+        tid = self._threads.get(ident)
+        if tid is None:
+            with self._lock:
+                tid = self._threads.setdefault(ident, len(self._threads) + 1)
+                self.events.append({'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid,
+                                    'args': {'name': threading.current_thread().name}})
+        return tid
+
+    def complete(self, name, cat, start, end, args):
+        self.events.append({'name': name, 'cat': cat, 'ph': 'X', 'ts': self.timestamp(start),
+                            'dur': round((end - start) * 1e6, 1), 'pid': self.pid, 'tid': self._tid(),
+                            'args': args})
+
+    def instant(self, name, cat, args):
+        self.events.append({'name': name, 'cat': cat, 'ph': 'i', 's': 't', 'ts': self.timestamp(),
+                            'pid': self.pid, 'tid': self._tid(), 'args': args})
+
+    def async_span(self, name, cat, span_id, start, end, args):
+        # Async spans get their own track per name, independent of threads
+        common = {'name': name, 'cat': cat, 'id': span_id, 'pid': self.pid, 'tid': 0}
+        self.events.append({**common, 'ph': 'b', 'ts': self.timestamp(start), 'args': args})
+        self.events.append({**common, 'ph': 'e', 'ts': self.timestamp(end)})
+
+
+class _Span:
+    """
+    Context manager recording one complete event. Arguments known only at
+    the end (e.g. the result) can be added to `args` inside the block.
+    """
+    __slots__ = ('recorder', 'name', 'cat', 'args', 'start')
+
+    def __init__(self, recorder, name, cat, args):
+        self.recorder = recorder
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.start = runControl.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args['error'] = repr(exc)
+        self.recorder.complete(self.name, self.cat, self.start, runControl.monotonic(), self.args)
+        return False
+
+
+class _NoSpan:
+    """
+    Returned while tracing is off: no timestamps, no events.
+    """
+    __slots__ = ('args',)
+
+    def __init__(self):
+        self.args = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+def start(origin=None, process_name="qem-task-handler"):
+    """
+    Starts recording in this process. Shard processes pass the coordinator's origin.
+
+    Returns:
+        float: the origin, for shard processes.
+    """
+    global _recorder
+    _recorder = TraceRecorder(origin, process_name)
+    return _recorder.origin
+
+
+def is_enabled():
+    return _recorder is not None
+
+
+def origin():
+    return _recorder.origin if _recorder else None
+
+
+def span(name, cat='task', **args):
+    """
+    with tracing.span("poll", server=...) as s: ... s.args['state'] = ...
+    """
+    if _recorder is None:
+        return _NoSpan()
+    return _Span(_recorder, name, cat, args)
+
+
+def instant(name, cat='task', **args):
+    if _recorder is not None:
+        _recorder.instant(name, cat, args)
+
+
+def complete(name, start, end, cat='task', **args):
+    """
+    Records a span whose start and end (runControl.monotonic() values) are already known.
+    """
+    if _recorder is not None:
+        _recorder.complete(name, cat, start, end, args)
+
+
+def queued(task, ready_at, started_at):
+    """
+    Records the time a task was ready (prerequisites done) before a worker started it.
+    """
+    if _recorder is not None and ready_at is not None:
+        _recorder.async_span("queued", 'queue', f"{task.server_name}/{task.task_name}", ready_at, started_at,
+                             {'server': task.server_name, 'task': task.task_name})
+
+
+def drain():
+    """
+    Returns and clears the events recorded so far (shard processes hand them to the coordinator).
+    """
+    if _recorder is None:
+        return []
+    events, _recorder.events = _recorder.events, []
+    _recorder._threads.clear()
+    return events
+
+
+def add_events(events):
+    if _recorder is not None and events:
+        _recorder.events += events
+
+
+def stop():
+    """
+    Stops recording and returns the trace document ({'traceEvents': [...]}), or None if tracing was off.
+    """
+    global _recorder
+    if _recorder is None:
+        return None
+    trace = {'traceEvents': _recorder.events, 'displayTimeUnit': 'ms'}
+    _recorder = None
+    return trace
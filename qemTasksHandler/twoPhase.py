@@ -0,0 +1,341 @@
+# Title: Two-phase execution
+# Author: Vinay Vitta | Qlik - QDI PS
+# Date: August 2025
+# Description: Fire every stop/resume request first, then confirm task states in bulk from one task list per server
+
+import concurrent.futures
+from dataclasses import dataclass
+from typing import Optional
+from qemTasksHandler import configParser, runControl, scheduler, deferral, records, notifier, tracing
+from qemTasksHandler.myLogger import get_logger
+from restAPI import getTaskList, getTaskDetails, resumeTask, stopTask, httpClient
+
+config = configParser.load_config()
+logger = get_logger(config)
+
+# Task list states of a task that is still changing; not re-fired while in them
+TRANSITION_STATES = ('STARTING', 'STOPPING', 'RECOVERING')
+
+# (step, outcome) -> result reported by resume_task / stop_task
+STEP_RESULTS = {
+    ('resume', 'done'): "ResumeSuccess",
+    ('resume', 'already'): "Already_in_Running_State",
+    ('stop', 'done'): "StopSuccess",
+    ('stop', 'already'): "Already_in_STOPPED_State",
+}
+
+
+def is_enabled(settings):
+    return settings.get('execution_mode', 'pipelined') == 'two_phase'
+
+
+def reached(step, state):
+    """
+    True if a task list state is the step's target state (resume: RUNNING,
+    stop: not running and not in transition).
+    """
+    if step == 'resume':
+        return state == 'RUNNING'
+    return state is not None and state != 'RUNNING' and state not in TRANSITION_STATES
+
+
+def step_limits(settings, step):
+    """
+    Returns (check_interval, timeout_seconds, max_polling_retries, max_api_retries)
+    from the same settings resume_task / stop_task use.
+    """
+    prefix = 'resume' if step == 'resume' else 'stop'
+    interval_key = 'resume_retry_interval' if step == 'resume' else 'stop_check_interval'
+    try:
+        return (int(settings.get(interval_key, 30)), int(settings.get(f'{prefix}_timeout', 35)) * 60,
+                int(settings.get(f'{prefix}_max_polling_retries', 70)), int(settings.get(f'{prefix}_max_api_retries', 3)))
+    except (TypeError, ValueError) as e:
+        logger.warning("Invalid %s config values. Using defaults. Error: %s", prefix, e)
+        return 30, 35 * 60, 70, 3
+
+
+@dataclass(slots=True)
+class InFlight:
+    """
+    One task between its first action request and its confirmed state.
+    """
+    task: records.TaskRecord
+    step: str                          # 'stop' or 'resume' (restart runs both)
+    started: float
+    state: Optional[str] = None        # last task list state, None = not read yet
+    deadline: Optional[float] = None   # of the current step
+    attempts: int = 0                  # action requests of the current step
+    polls: int = 0                     # confirmation rounds of the current step
+    posts: int = 0                     # action requests of all steps
+    api_calls: int = 0                 # calls made for this task alone (bulk list reads are shared)
+    stop_result: Optional[str] = None
+    result: Optional[str] = None
+    finished: bool = False
+
+    def finish(self, result):
+        self.result = result
+        self.finished = True
+
+
+def read_states(qem_hostname, login_token, server_names, executor, wait_fn):
+    """
+    Reads one task list per server concurrently.
+
+    Returns:
+        dict: server -> {task name: state}; servers whose list could not be read are missing.
+    """
+    futures = {executor.submit(getTaskList.get_task_list, qem_hostname, server, login_token): server
+               for server in server_names}
+    _wait_all(futures, wait_fn)
+    states = {}
+    for future, server in futures.items():
+        task_list_response = future.result()
+        if task_list_response:
+            states[server] = {row.get('name'): (row.get('state') or '').upper() or None
+                              for row in task_list_response.get('taskList', [])}
+    return states
+
+
+def _wait_all(futures, wait_fn):
+    pending = set(futures)
+    while pending:
+        _, pending = wait_fn(pending, timeout=1, return_when=concurrent.futures.ALL_COMPLETED)
+
+
+def _send(entry, qem_hostname, login_token):
+    """
+    Sends the current step's action request for one task.
+    """
+    send = resumeTask.send_resume_request if entry.step == 'resume' else stopTask.send_stop_request
+    entry.attempts += 1
+    entry.posts += 1
+    task = entry.task
+    try:
+        response = send(qem_hostname, task.server_name, task.task_name, login_token, entry.deadline)
+        if response.status_code == 200:
+            logger.info("%s request %d sent for task '%s' on server '%s'.", entry.step.capitalize(),
+                        entry.attempts, task.task_name, task.server_name)
+        else:
+            logger.warning("%s request %d for task '%s' failed with status %s: %s", entry.step.capitalize(),
+                           entry.attempts, task.task_name, response.status_code, response.content)
+    except httpClient.DeadlineExceeded:
+        raise
+    except Exception as e:
+        # The request may still have been applied; the next confirmation round reads the state first
+        logger.warning("%s request %d for task '%s' got no response: %s", entry.step.capitalize(),
+                       entry.attempts, entry.task.task_name, e)
+
+
+def fire(entry, qem_hostname, login_token, settings):
+    """
+    Fire phase for one task (runs on the fire pool): checks the known state,
+    reads the task's details only when its state is unknown or its full load
+    must be confirmed, and sends the action request unless the task is already
+    in the step's target state.
+    """
+    task = entry.task
+    httpClient.reset_call_stats()
+    try:
+        if entry.deadline is None:
+            _, timeout_seconds, _, _ = step_limits(settings, entry.step)
+            entry.deadline = runControl.clamp_deadline(runControl.monotonic() + timeout_seconds)
+        if entry.state is None or task.confirm_full_load:
+            task_details = getTaskDetails.get_task_details(qem_hostname, task.server_name, task.task_name,
+                                                           login_token, deadline=entry.deadline)
+            if not isinstance(task_details, dict) or "memory_mb" not in task_details:
+                logger.error("Unable to retrieve details for task '%s'. Not sending %s.", task.task_name, entry.step)
+                entry.finish(None)
+                return entry
+            if task.confirm_full_load and not task_details.get("full_load_completed"):
+                logger.error("Task '%s' is in active full load (cached pre-check is out of date). Not acting on it.",
+                             task.task_name)
+                entry.finish("Blocked_FullLoad")
+                return entry
+            task.confirm_full_load = False
+            running = task_details["memory_mb"] >= 1
+            entry.state = (task_details.get("state") or ('RUNNING' if running else 'STOPPED')).upper()
+        if entry.attempts == 0 and reached(entry.step, entry.state):
+            logger.info("Task '%s' is already in the %s target state (%s).", task.task_name, entry.step, entry.state)
+            entry.finish(STEP_RESULTS[(entry.step, 'already')])
+            return entry
+        _send(entry, qem_hostname, login_token)
+    except httpClient.DeadlineExceeded:
+        logger.warning("%s of task '%s' not sent: deadline passed.", entry.step.capitalize(), task.task_name)
+    except Exception as e:
+        logger.exception("Error executing task '%s' on server '%s': %s", task.task_name, task.server_name, e)
+        entry.finish(f"ERROR: {e}")
+    finally:
+        entry.api_calls += httpClient.get_call_stats()['api_calls']
+    return entry
+
+
+def confirm(entry, state, settings):
+    """
+    Applies one confirmation round's state to a fired task.
+
+    Returns:
+        bool: True if the task's action should be sent again.
+    """
+    _, _, max_polling_retries, max_api_retries = step_limits(settings, entry.step)
+    task = entry.task
+    entry.polls += 1
+    entry.state = state
+    if reached(entry.step, state):
+        logger.info("Task '%s' on server '%s' reached %s (%s).", task.task_name, task.server_name,
+                    'RUNNING' if entry.step == 'resume' else 'STOPPED', state)
+        tracing.instant("state confirmed", server=task.server_name, task=task.task_name, state=state)
+        entry.finish(STEP_RESULTS[(entry.step, 'done')])
+        return False
+    if runControl.monotonic() >= entry.deadline or entry.polls >= max_polling_retries:
+        logger.error("%s failed for task '%s': timeout or max polling retries (%d) reached (state %s).",
+                     entry.step.capitalize(), task.task_name, max_polling_retries, state)
+        entry.finish(None)
+        return False
+    if state is None:
+        logger.warning("State of task '%s' on server '%s' not in its task list this round.",
+                       task.task_name, task.server_name)
+        return False
+    # Tasks already changing state are left alone; the others get the action again within the retry limit
+    return state not in TRANSITION_STATES and entry.attempts < max_api_retries
+
+
+def execute_tasks(action, tasks_to_run, qem_hostname, login_token, parallel_threads, server_max_parallel=None,
+                  deferred_tasks=None, settings=None, executor_factory=concurrent.futures.ThreadPoolExecutor,
+                  wait_fn=concurrent.futures.wait):
+    """
+    settings.execution_mode 'two_phase' replacement of main.execute_tasks.
+
+    Instead of one worker owning a task until its state is confirmed, every
+    ready task gets its stop/resume request right away (parallel_threads
+    concurrent requests, subject to api_rate_limit). Task states are then
+    confirmed in rounds, every stop_check_interval / resume_retry_interval
+    seconds, from one task list per server. Only tasks that have not started
+    to transition are sent the action again, within *_max_api_retries;
+    *_timeout and *_max_polling_retries apply per task as before.
+
+    Dependencies, priorities, server_max_parallel, deferred full load tasks,
+    restart (stop, then resume once stopped) and restart_max_down work as in
+    the pipelined mode. settings.two_phase_max_in_flight caps the tasks fired
+    and not yet confirmed (0 = no cap).
+
+    Returns:
+        list: one result row per task, as main.execute_tasks.
+    """
+    settings = settings or config['settings']
+    deferred_tasks = deferred_tasks or []
+    results = []
+    max_in_flight = int(settings.get('two_phase_max_in_flight') or 0) or len(tasks_to_run) + len(deferred_tasks)
+    if action == 'restart' and settings.get('restart_max_down'):
+        max_in_flight = min(max_in_flight, int(settings['restart_max_down']))
+        logger.info("Restart: at most %d task(s) down at once.", max_in_flight)
+    first_step = 'resume' if action == 'resume' else 'stop'
+    steps = ('stop', 'resume') if action == 'restart' else (first_step,)
+    interval = min(step_limits(settings, step)[0] for step in steps)
+
+    task_scheduler = scheduler.TaskScheduler(tasks_to_run + deferred_tasks, action, max(1, max_in_flight),
+                                             server_max_parallel, held=deferred_tasks)
+    deferred = None
+    if deferred_tasks:
+        deferred = deferral.DeferredQueue(deferred_tasks, qem_hostname, login_token, settings).start()
+    logger.info("Two-phase %s of %d task(s) on host '%s': firing with %d thread(s), confirming every %d seconds.",
+                action, len(tasks_to_run) + len(deferred_tasks), qem_hostname, parallel_threads, interval)
+
+    in_flight = {}  # task key -> InFlight, fired and not yet confirmed
+    to_fire = []
+
+    def report(entry):
+        task = entry.task
+        result = entry.result
+        if action == 'restart' and entry.step == 'stop':
+            entry.stop_result = result
+        elif action == 'restart' and result == "Cancelled":
+            logger.warning("Restart of task '%s' on server '%s' cancelled after its stop. Task left stopped.",
+                           task.task_name, task.server_name)
+        tracing.instant("result", server=task.server_name, task=task.task_name, result=result)
+        row = records.ResultRecord(task.server_name, task.task_name, action, result,
+                                   duration_seconds=round(runControl.monotonic() - entry.started, 3),
+                                   retries=max(0, entry.posts - (2 if action == 'restart' else 1)),
+                                   api_calls=entry.api_calls, stop_result=entry.stop_result)
+        logger.info("Task completed: %s | Result: %s", task.task_name, result)
+        in_flight.pop(scheduler.task_key(task.server_name, task.task_name), None)
+        for finished in [row] + task_scheduler.complete(task, row, action):
+            results.append(finished)
+            notifier.task_result(finished)
+
+    def settle(entry):
+        # A finished stop step of a restart continues with its resume step
+        if action == 'restart' and entry.step == 'stop' and entry.result in ('StopSuccess', 'Already_in_STOPPED_State'):
+            entry.stop_result = entry.result
+            entry.step, entry.result, entry.finished = 'resume', None, False
+            entry.deadline, entry.attempts, entry.polls = None, 0, 0
+            to_fire.append(entry)
+            return
+        report(entry)
+
+    with executor_factory(max_workers=max(1, parallel_threads)) as executor:
+        while not runControl.is_cancelled():
+            # --- Phase 1: fire every ready task (new, re-sent and restart resumes) ---
+            while True:
+                task = task_scheduler.next_task()
+                if task is None:
+                    break
+                entry = InFlight(task, first_step, runControl.monotonic())
+                in_flight[scheduler.task_key(task.server_name, task.task_name)] = entry
+                to_fire.append(entry)
+            while to_fire:
+                batch = list(to_fire)
+                to_fire.clear()
+                unknown = {entry.task.server_name for entry in batch if entry.state is None}
+                with tracing.span("fire", cat='phase', host=qem_hostname, tasks=len(batch)):
+                    states = read_states(qem_hostname, login_token, unknown, executor, wait_fn) if unknown else {}
+                    for entry in batch:
+                        if entry.state is None:
+                            entry.state = states.get(entry.task.server_name, {}).get(entry.task.task_name)
+                    futures = [executor.submit(fire, entry, qem_hostname, login_token, settings) for entry in batch]
+                    _wait_all(futures, wait_fn)
+                for entry in batch:
+                    if entry.finished:
+                        settle(entry)
+
+            if not in_flight and not (deferred and deferred.pending):
+                break
+
+            # --- Phase 2: confirm states in bulk ---
+            if in_flight and runControl.wait(interval):
+                break
+            for task, outcome in (deferred.get(timeout=0 if in_flight else interval) if deferred else []):
+                if outcome == 'ready':
+                    task_scheduler.release(task)
+                    continue
+                logger.warning("Task '%s' on server '%s' still in active full load at its deferral deadline. "
+                               "Not processed.", task.task_name, task.server_name)
+                expired = records.ResultRecord(task.server_name, task.task_name, action, "Deferred_FullLoad")
+                for row in [expired] + task_scheduler.abandon(task, expired, action):
+                    results.append(row)
+                    notifier.task_result(row)
+            if not in_flight:
+                continue
+            with tracing.span("confirm", cat='phase', host=qem_hostname, tasks=len(in_flight)):
+                servers = {entry.task.server_name for entry in in_flight.values()}
+                states = read_states(qem_hostname, login_token, servers, executor, wait_fn)
+                for entry in list(in_flight.values()):
+                    if entry.deadline is None:
+                        continue  # a restart's resume step not sent yet
+                    state = states.get(entry.task.server_name, {}).get(entry.task.task_name)
+                    if confirm(entry, state, settings):
+                        to_fire.append(entry)
+                    elif entry.finished:
+                        settle(entry)
+            logger.info("Two-phase %s on host '%s': %d task(s) confirmed, %d waiting, %d to send.",
+                        action, qem_hostname, len(results), len(in_flight), len(to_fire))
+
+    # Fired tasks whose state was not confirmed before cancellation or the run deadline
+    for entry in list(in_flight.values()):
+        entry.finish("Cancelled")
+        report(entry)
+    if task_scheduler.has_pending():
+        skipped = task_scheduler.drain(action)
+        logger.warning("Run cancelled (%s). %d task(s) were not started and are marked as skipped.",
+                       runControl.cancel_reason(), len(skipped))
+        results += skipped
+    return results
@@ -4,8 +4,8 @@
 # Created: Aug 2025
 
 from qemTasksHandler.myLogger import get_logger
-import datetime, os, yaml, csv
-from qemTasksHandler import configParser
+import datetime, os, yaml, csv, json, dataclasses, re, fnmatch, functools
+from qemTasksHandler import configParser, records
 from restAPI import getTaskDetails
 
 config = configParser.load_config()
@@ -13,6 +13,34 @@ logger = get_logger(config)
 logger.info("Initiating utils ...")
 
 
+def get_qem_host_configs(config):
+    """
+    Returns one config view per QEM host.
+
+    `qem_hosts` (a list) takes precedence over the single `qem_host` section.
+    Each entry carries its own credentials and `replicate_servers`, and may
+    override any key of `settings` (e.g. api_rate_limit, parallel_threads).
+    All other sections (logging, backup, email) are shared.
+    """
+    qem_hosts = config.get('qem_hosts')
+    if not qem_hosts:
+        return [config]
+
+    host_configs = []
+    for qem_host in qem_hosts:
+        host_config = dict(config)
+        host_config['qem_host'] = {
+            'qem_hostname': qem_host.get('qem_hostname'),
+            'qem_user': qem_host.get('qem_user'),
+            'qem_psw': qem_host.get('qem_psw'),
+        }
+        host_config['replicate_servers'] = qem_host.get('replicate_servers', [])
+        host_config['settings'] = {**config.get('settings', {}), **(qem_host.get('settings') or {})}
+        host_configs.append(host_config)
+    logger.info("Found %d QEM hosts.", len(host_configs))
+    return host_configs
+
+
 def get_replicate_servers(config):
     """
     Returns the list of replicate servers from the config.
@@ -34,16 +62,18 @@ def get_replicate_servers(config):
 
 def get_tasks_for_server(config, replicate_server_name):
     """
-    Returns the list of tasks for a specific replicate server.
+    Returns the list of task selectors for a specific replicate server.
+    Tasks may be given as plain names, patterns (see TaskMatcher) or as
+    {name, priority, depends_on} entries.
     """
     try:
         for server in config.get('replicate_servers', []):
             if server.get('name') == replicate_server_name:
-                tasks = server.get('tasks', [])
+                tasks = [task.get('name') if isinstance(task, dict) else task for task in server.get('tasks') or []]
                 if not tasks:
                     logger.warning("No tasks found for server '%s'.", replicate_server_name)
                 else:
-                    logger.info("Found %d tasks for server '%s'.", len(tasks), replicate_server_name)
+                    logger.info("Found %d task selector(s) for server '%s'.", len(tasks), replicate_server_name)
                 return tasks
         logger.warning("Replicate server '%s' not found in config.", replicate_server_name)
         return []
@@ -55,42 +85,186 @@ def get_tasks_for_server(config, replicate_server_name):
         return []
 
 
-def validate_tasks_yaml(api_task_response, yaml_task_names):
+def get_task_options(config):
+    """
+    Returns the optional scheduling options of tasks configured as
+    {name, priority, depends_on} entries.
+
+    depends_on lists upstream tasks: a name refers to a task on the same
+    server, {server: ..., task: ...} to a task on another server.
+
+    Returns:
+        dict: {(server_name, task_name_lower): {'priority': int, 'depends_on': [(server_name, task_name), ...]}}
+    """
+    options = {}
+    for server in config.get('replicate_servers', []) or []:
+        server_name = server.get('name')
+        for task in server.get('tasks') or []:
+            if not isinstance(task, dict) or not task.get('name'):
+                continue
+            depends_on = []
+            for upstream in task.get('depends_on') or []:
+                if isinstance(upstream, dict):
+                    depends_on.append((upstream.get('server', server_name), upstream.get('task')))
+                else:
+                    depends_on.append((server_name, upstream))
+            options[(server_name, task['name'].lower())] = {'priority': int(task.get('priority') or 0),
+                                                            'depends_on': depends_on}
+    return options
+
+
+def apply_task_options(config, tasks):
+    """
+    Annotates selected tasks with their configured 'priority' and 'depends_on'.
+    """
+    options = get_task_options(config)
+    if not options:
+        return
+    annotated = 0
+    for task in tasks:
+        task_options = options.get((task.server_name, task.task_name.lower()))
+        if task_options:
+            task.priority = task_options['priority']
+            task.depends_on = tuple(task_options['depends_on'])
+            annotated += 1
+    if annotated:
+        logger.info("Priority/dependency options applied to %d task(s).", annotated)
+
+
+class TaskMatcher:
+    """
+    The task selectors of one server compiled into a matcher index.
+
+    Selectors (case-insensitive):
+        MyTask          exact name
+        Sales_*         glob (*, ? and [...])
+        re:^CDC_.*_v2$  regular expression (searched anywhere in the name)
+        tag:finance     task carries this QEM tag
+        !selector       exclusion - any of the above; wins over inclusions
+
+    Exact names and tags are set lookups and all globs/regexes are merged into
+    one compiled regex, so matching a task costs the same however many
+    selectors there are. A regex that cannot share that merged regex (global
+    flags, duplicate group names) is compiled on its own.
+    """
+
+    def __init__(self, selectors):
+        self.counts = {'exact': 0, 'pattern': 0, 'tag': 0, 'exclusion': 0}
+        include = {'exact': set(), 'patterns': [], 'tags': set()}
+        exclude = {'exact': set(), 'patterns': [], 'tags': set()}
+        for selector in selectors:
+            selector = str(selector).strip()
+            target = include
+            if selector.startswith('!'):
+                target, selector = exclude, selector[1:].strip()
+                self.counts['exclusion'] += 1
+            if not selector:
+                continue
+            if selector.lower().startswith('tag:'):
+                target['tags'].add(selector[4:].strip().lower())
+                kind = 'tag'
+            elif selector.lower().startswith('re:'):
+                try:
+                    re.compile(selector[3:])
+                except re.error as e:
+                    logger.error("Invalid regex selector '%s' ignored: %s", selector, e)
+                    continue
+                target['patterns'].append((selector, f"(?:{selector[3:]})", selector[3:]))
+                kind = 'pattern'
+            elif any(char in selector for char in '*?['):
+                glob = "^" + fnmatch.translate(selector)
+                target['patterns'].append((selector, glob, glob))
+                kind = 'pattern'
+            else:
+                target['exact'].add(selector.lower())
+                kind = 'exact'
+            if target is include:
+                self.counts[kind] += 1
+
+        self.exact, self.tags = include['exact'], include['tags']
+        self.patterns = self._compile_patterns(include['patterns'])
+        self.exclude_exact, self.exclude_tags = exclude['exact'], exclude['tags']
+        self.exclude_patterns = self._compile_patterns(exclude['patterns'])
+
+    @staticmethod
+    def _compile_patterns(patterns):
+        """
+        Returns the compiled regexes for (selector, merged form, own form) tuples:
+        one merged regex, plus one per selector that cannot be merged (a global
+        flag such as (?i), or a group name another selector uses too).
+        """
+        if not patterns:
+            return []
+        try:
+            return [re.compile("|".join(merged for _, merged, _ in patterns), re.IGNORECASE)]
+        except re.error:
+            pass
+        merged, separate = [], []
+        for selector, merged_form, own_form in patterns:
+            try:
+                re.compile("|".join(merged + [merged_form]), re.IGNORECASE)
+                merged.append(merged_form)
+            except re.error as e:
+                logger.warning("Selector '%s' cannot be merged with the other selectors (%s); matched separately.",
+                               selector, e)
+                separate.append(re.compile(own_form, re.IGNORECASE))
+        return ([re.compile("|".join(merged), re.IGNORECASE)] if merged else []) + separate
+
+    @staticmethod
+    def _tag_names(tags):
+        return {(tag.get('name', '') if isinstance(tag, dict) else str(tag)).lower() for tag in tags or []}
+
+    def matches(self, name, tags=None):
+        lower_name = name.lower()
+        tag_names = self._tag_names(tags) if (self.tags or self.exclude_tags) else set()
+        if lower_name in self.exclude_exact or tag_names & self.exclude_tags or \
+                any(pattern.search(name) for pattern in self.exclude_patterns):
+            return False
+        return lower_name in self.exact or bool(tag_names & self.tags) or \
+            any(pattern.search(name) for pattern in self.patterns)
+
+
+@functools.lru_cache(maxsize=256)
+def compile_task_selectors(selectors):
+    """
+    Returns the TaskMatcher for a tuple of selectors; compiled once and reused
+    (e.g. on every reconcile cycle).
+    """
+    return TaskMatcher(selectors)
+
+
+def validate_tasks_yaml(api_task_response, yaml_task_names, log_summary=True, server_name=None):
     """
-    Validate tasks from QEM API against tasks from YAML config.
+    Validate tasks from QEM API against task selectors from YAML config.
 
     Args:
         api_task_response (dict): Response from get_task_list(), expected to contain 'taskList'.
-        yaml_task_names (list): List of task names from YAML config.
+        yaml_task_names (list): Task selectors from YAML config (names, globs, re:, tag:, !exclusions).
+        log_summary (bool): Log one summary line for the server.
+        server_name (str): Server name used in the log lines.
 
     Returns:
-        list: List of matching task names (case-insensitive).
+        list: List of matching API task names, in API order.
     """
     try:
         if not api_task_response or 'taskList' not in api_task_response:
             logger.warning("API response is empty or invalid.")
             return []
 
-        # Extract API task names
-        api_task_names = [task.get('name', '') for task in api_task_response['taskList']]
-
-        # Convert all names to lowercase for case-insensitive comparison
-        api_lower = {name.lower(): name for name in api_task_names}
-        yaml_lower = {name.lower(): name for name in yaml_task_names}
-
-        # Find matching tasks
-        matching_tasks = [api_lower[name] for name in yaml_lower if name in api_lower]
-
-        # Log tasks in YAML not found in API
-        for name in yaml_task_names:
-            if name.lower() not in api_lower:
-                logger.warning("Task '%s' from YAML not found in API response.", name)
-
-        # Log tasks in API not present in YAML
-        for name in api_task_names:
-            if name.lower() not in yaml_lower:
-                logger.info("Task '%s' from API not present in YAML config.", name)
+        matcher = compile_task_selectors(tuple(yaml_task_names))
+        api_task_list = api_task_response['taskList']
+        matching_tasks = [task.get('name', '') for task in api_task_list
+                          if matcher.matches(task.get('name', ''), task.get('assigned_tags'))]
 
+        # Exact names from YAML that QEM does not know - one line for all of them
+        missing = matcher.exact - {task.get('name', '').lower() for task in api_task_list}
+        if missing:
+            logger.warning("%d task name(s) from YAML not found on server '%s': %s",
+                           len(missing), server_name, ", ".join(sorted(missing)))
+        if log_summary:
+            logger.info("Server '%s': selected %d of %d task(s) from %d exact name(s), %d pattern(s), %d tag(s), "
+                        "%d exclusion(s).", server_name, len(matching_tasks), len(api_task_list), matcher.counts['exact'],
+                        matcher.counts['pattern'], matcher.counts['tag'], matcher.counts['exclusion'])
         return matching_tasks
 
     except Exception as e:
@@ -103,8 +277,8 @@ def save_qem_task_report(output_dir, data, action):
     Save QEM task report to CSV with descriptive name.
 
     :param output_dir: Directory to save the report
-    :param data: List of dictionaries or list of lists to write
-    :param action: 'resume' or 'stop'
+    :param data: List of records (records.ResultRecord), dictionaries or lists to write
+    :param action: 'resume', 'stop' or 'restart'
     :param server_name: Optional server name to include in filename
     :return: Full path to the saved CSV file
     """
@@ -121,9 +295,16 @@ def save_qem_task_report(output_dir, data, action):
         raise ValueError("Data for report is empty")
 
     with open(filepath, mode='w', newline='', encoding='utf-8') as csvfile:
-        if isinstance(data[0], dict):
-            # Write list of dicts
-            writer = csv.DictWriter(csvfile, fieldnames=data[0].keys())
+        if dataclasses.is_dataclass(data[0]):
+            # Write records - only the columns that are set on at least one record
+            fieldnames = records.report_fields(data)
+            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(records.as_row(record, fieldnames) for record in data)
+        elif isinstance(data[0], dict):
+            # Write list of dicts - columns are the union of all row keys (skipped rows carry fewer)
+            fieldnames = list(dict.fromkeys(key for row in data for key in row))
+            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
             writer.writeheader()
             writer.writerows(data)
         else:
@@ -134,3 +315,76 @@ def save_qem_task_report(output_dir, data, action):
     return filepath
 
 
+def save_qem_dry_run_plan(output_dir, data, summary, action, output_format='csv'):
+    """
+    Save a dry-run plan as CSV (task rows) or JSON (summary and task rows).
+
+    :param output_dir: Directory to save the plan
+    :param data: List of plan records (records.PlanRecord)
+    :param summary: Dict with the run-level estimate
+    :param action: 'resume', 'stop' or 'restart'
+    :param output_format: 'csv' or 'json'
+    :return: Full path to the saved file
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    timestamp = datetime.datetime.now().strftime("%Y_%m_%dT%H_%M_%S")
+    filepath = os.path.join(output_dir, f"Dry_Run_Plan_{action.capitalize()}_{timestamp}.{output_format}")
+    fieldnames = records.report_fields(data) or ['server_name', 'task_name', 'plan']
+    rows = [records.as_row(record, fieldnames) for record in data]
+
+    if output_format == 'json':
+        with open(filepath, mode='w', encoding='utf-8') as jsonfile:
+            json.dump({'generated_at': datetime.datetime.now().isoformat(timespec='seconds'), 'summary': summary,
+                       'tasks': rows}, jsonfile, indent=2, default=str)
+    else:
+        with open(filepath, mode='w', newline='', encoding='utf-8') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(rows)
+
+    return filepath
+
+
+def save_qem_status_snapshot(output_dir, data, output_format='csv'):
+    """
+    Save a fleet status snapshot as CSV or JSON.
+
+    :param output_dir: Directory to save the snapshot
+    :param data: List of status records (records.StatusRecord)
+    :param output_format: 'csv' or 'json'
+    :return: Full path to the saved file
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    timestamp = datetime.datetime.now().strftime("%Y_%m_%dT%H_%M_%S")
+    filepath = os.path.join(output_dir, f"Fleet_Status_{timestamp}.{output_format}")
+    fieldnames = records.report_fields(data) or ['server_name', 'task_name', 'state']
+    rows = [records.as_row(record, fieldnames) for record in data]
+
+    if output_format == 'json':
+        with open(filepath, mode='w', encoding='utf-8') as jsonfile:
+            json.dump({'generated_at': datetime.datetime.now().isoformat(timespec='seconds'), 'tasks': rows},
+                      jsonfile, indent=2, default=str)
+    else:
+        with open(filepath, mode='w', newline='', encoding='utf-8') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(rows)
+
+    return filepath
+
+
+def save_qem_trace(output_dir, trace, action):
+    """
+    Save an execution trace (Chrome trace / Perfetto JSON, see tracing).
+
+    :param output_dir: Directory to save the trace
+    :param trace: Trace document from tracing.stop()
+    :param action: 'resume', 'stop' or 'restart'
+    :return: Full path to the saved file (open it in https://ui.perfetto.dev or chrome://tracing)
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    timestamp = datetime.datetime.now().strftime("%Y_%m_%dT%H_%M_%S")
+    filepath = os.path.join(output_dir, f"Trace_{action.capitalize()}_{timestamp}.json")
+    with open(filepath, mode='w', encoding='utf-8') as jsonfile:
+        json.dump(trace, jsonfile, separators=(',', ':'), default=str)
+    return filepath
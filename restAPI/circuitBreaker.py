@@ -0,0 +1,109 @@
+# Title: QEM API Calls
+# Description: Per-server circuit breaker for QEM REST API calls
+# Author: Vinay Vitta | Qlik PS
+# Created: Aug 2025
+
+import threading
+import requests
+from qemTasksHandler import configParser, runControl
+from qemTasksHandler.myLogger import get_logger
+
+config = configParser.load_config()
+logger = get_logger(config)
+
+CLOSED = "CLOSED"
+OPEN = "OPEN"
+HALF_OPEN = "HALF_OPEN"
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """
+    Raised instead of calling QEM when the breaker for a server is open.
+    Subclasses ConnectionError so existing RequestException handlers treat it
+    like any other unreachable server.
+    """
+
+
+class CircuitBreaker:
+    """
+    Tracks consecutive failures for one replicate server.
+
+    CLOSED    - calls go through, failures are counted.
+    OPEN      - calls fail fast until reset_timeout seconds have passed.
+    HALF_OPEN - a single probe call is let through; success closes the
+                breaker, failure opens it again.
+    """
+
+    def __init__(self, server, failure_threshold=5, reset_timeout=60):
+        self.server = server
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if runControl.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                logger.info("Circuit for server '%s' is HALF_OPEN; probing recovery.", self.server)
+                self.state = HALF_OPEN
+                self._probe_in_flight = False
+            # HALF_OPEN: let exactly one probe through
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info("Circuit for server '%s' is CLOSED again.", self.server)
+            self.state = CLOSED
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    logger.error("Circuit for server '%s' is OPEN after %d consecutive failures.",
+                                 self.server, self.failures)
+                self.state = OPEN
+                self.opened_at = runControl.monotonic()
+
+    @property
+    def is_open(self):
+        with self._lock:
+            return self.state == OPEN and runControl.monotonic() - self.opened_at < self.reset_timeout
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(server, qem_host=None, settings=None):
+    """
+    Returns the shared breaker for a replicate server (per QEM host), creating
+    it on first use with the thresholds from `settings` (default: config settings).
+    """
+    key = ((qem_host or "").lower(), server)
+    with _breakers_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            settings = settings or config.get('settings', {})
+            breaker = CircuitBreaker(
+                server,
+                failure_threshold=int(settings.get('circuit_breaker_failure_threshold', 5)),
+                reset_timeout=int(settings.get('circuit_breaker_reset_timeout', 60)),
+            )
+            _breakers[key] = breaker
+        return breaker
+
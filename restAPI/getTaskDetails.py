@@ -10,7 +10,7 @@ import warnings
 import requests
 from qemTasksHandler import configParser
 from qemTasksHandler.myLogger import get_logger
-from restAPI import login
+from restAPI import httpClient, login
 
 config = configParser.load_config()
 logger = get_logger(config)
@@ -20,16 +20,19 @@ logger = get_logger(config)
 warnings.filterwarnings("ignore", category=requests.packages.urllib3.exceptions.InsecureRequestWarning)
 
 
-def get_task_details(qem_url, server, task, login_token):
+def get_task_details(qem_url, server, task, login_token, deadline=None):
     logger.info("Initiating QEM REST API getTaskDetails...")
     logger.info("Getting task details/status for task %s on server %s ...", task, server)
     get_task_details_url = 'https://' + qem_url + "/attunityenterprisemanager/api/v1/" + "servers/" + server + "/tasks/" + task
-    get_task_details_response = requests.get(url=get_task_details_url, headers={'EnterpriseManager.APISessionID': login_token}, verify=False)
+    get_task_details_response = httpClient.request('GET', get_task_details_url, server=server, deadline=deadline, headers={'EnterpriseManager.APISessionID': login_token}, verify=False)
     if get_task_details_response.status_code == 200:
         # logger.info(f"Server: {server} Task: '{task}' State: '{json.loads(get_task_details_response.content)["state"]}' Task-Memory-usage: '{json.loads(get_task_details_response.content)["memory_mb"]}'") # Status:  memory usage for task %s is %s", task, json.loads(get_task_details_response.content)["cdc_latency"].get("total_latency"))
         return json.loads(get_task_details_response.content)  # ["cdc_latency"].get("total_latency")
     else:
-        logger.info("response %s", json.loads(get_task_details_response.content)['error_code'])
+        try:
+            logger.info("response %s", json.loads(get_task_details_response.content)['error_code'])
+        except (ValueError, KeyError, TypeError):
+            logger.warning("Unable to parse error code from response.")
         logger.error("Get task details API failed for the task %s and response code/content is %s", task, get_task_details_response.content)
         return "Task details API failed or No task"
 
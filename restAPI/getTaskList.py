@@ -8,7 +8,7 @@ import warnings
 import requests
 from qemTasksHandler import configParser
 from qemTasksHandler.myLogger import get_logger
-from restAPI import login
+from restAPI import httpClient, login
 
 # Load config and initialize logger
 config = configParser.load_config()
@@ -19,6 +19,36 @@ logger = get_logger(config)
 warnings.filterwarnings("ignore", category=requests.packages.urllib3.exceptions.InsecureRequestWarning)
 
 
+def _task_list_url(qem_url, server):
+    return f"https://{qem_url}/attunityenterprisemanager/api/v1/servers/{server}/tasks/"
+
+
+def get_task_list_response(qem_url, server, login_token, etag=None, last_modified=None):
+    """
+    Conditional task list request for change detection (see taskListWatcher).
+    Sends If-None-Match / If-Modified-Since when the previous response carried
+    an ETag / Last-Modified header, so QEM may answer 304 without a body.
+    Returns the requests.Response for HTTP 200 or 304, None otherwise.
+    """
+    headers = {'EnterpriseManager.APISessionID': login_token}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    try:
+        response = httpClient.request('GET', _task_list_url(qem_url, server), server=server, headers=headers,
+                                      verify=False)
+        if response.status_code in (200, 304):
+            return response
+        logger.error("Get task list API failed for server '%s'. Status: %s, Response: %s",
+                     server, response.status_code, response.text)
+        return None
+
+    except requests.exceptions.RequestException as e:
+        logger.error("Request to QEM API failed for server '%s': %s", server, e)
+        return None
+
+
 def get_task_list(qem_url, server, login_token):
     """
     Fetches the list of tasks for a given QEM server.
@@ -27,13 +57,13 @@ def get_task_list(qem_url, server, login_token):
     logger.info("Initiating QEM REST API getTaskList...")
     try:
         logger.info("Getting task list with status for server '%s' ...", server)
-        get_task_list_url = f"https://{qem_url}/attunityenterprisemanager/api/v1/servers/{server}/tasks/"
+        get_task_list_url = _task_list_url(qem_url, server)
 
-        response = requests.get(
-            url=get_task_list_url,
+        response = httpClient.request(
+            'GET', get_task_list_url,
+            server=server,
             headers={'EnterpriseManager.APISessionID': login_token},
-            verify=False,
-            timeout=30  # optional: set a timeout
+            verify=False
         )
 
         if response.status_code == 200:
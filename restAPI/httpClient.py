@@ -0,0 +1,307 @@
+# Title: QEM API Calls
+# Description: Shared HTTP session with timeouts, retries and deadline-aware budgets
+# Author: Vinay Vitta | Qlik PS
+# Created: Aug 2025
+
+import random
+import threading
+import urllib.parse
+import warnings
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from qemTasksHandler import configParser, runControl, tracing
+from qemTasksHandler.myLogger import get_logger
+from restAPI import circuitBreaker
+
+config = configParser.load_config()
+logger = get_logger(config)
+
+
+# Suppress only the single InsecureRequestWarning from urllib3 needed when verify=False in requests
+warnings.filterwarnings("ignore", category=requests.packages.urllib3.exceptions.InsecureRequestWarning)
+
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    """
+    Raised when the caller's deadline leaves no time for another attempt.
+    """
+
+
+def get_retry_policy(config):
+    """
+    Reads the HTTP retry policy from the settings section, falling back to defaults.
+    """
+    settings = config.get('settings', {}) if config else {}
+    try:
+        return {
+            'connect_timeout': float(settings.get('http_connect_timeout', 5)),   # seconds
+            'read_timeout': float(settings.get('http_read_timeout', 30)),        # seconds
+            'max_retries': int(settings.get('http_max_retries', 3)),             # retries after the first attempt
+            'backoff_base': float(settings.get('http_backoff_base', 1)),         # seconds, doubled per retry
+            'backoff_max': float(settings.get('http_backoff_max', 30)),          # seconds
+        }
+    except (TypeError, ValueError) as e:
+        logger.warning("Invalid HTTP retry settings. Using defaults. Error: %s", e)
+        return {'connect_timeout': 5.0, 'read_timeout': 30.0, 'max_retries': 3,
+                'backoff_base': 1.0, 'backoff_max': 30.0}
+
+
+retry_policy = get_retry_policy(config)
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(qem_host=None):
+    """
+    Returns the requests.Session for a QEM host, sized so every worker thread
+    can keep its own pooled connection. Each host gets a separate session,
+    sized from the host's settings (configure_host).
+    """
+    key = (qem_host or "").lower()
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            settings = _host_settings.get(key) or config.get('settings', {})
+            pool_size = int(settings.get('parallel_threads', 5))
+            if settings.get('adaptive_concurrency'):
+                pool_size = max(pool_size, int(settings.get('adaptive_max_threads') or 4 * pool_size))
+            pool_size += 2
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[key] = session
+        return session
+
+
+class RateLimiter:
+    """
+    Token bucket allowing `rate` requests per second with bursts of up to `burst`.
+
+    A caller that finds the bucket empty reserves the next token (the balance
+    goes negative) and sleeps exactly until it is due, so waiting callers are
+    served in order and none of them wakes up only to find the token taken.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(1.0, self.rate))
+        self._tokens = self.burst
+        self._updated = runControl.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, deadline=None):
+        """
+        Blocks until a request may be sent.
+
+        Returns:
+            bool: False if the deadline would pass first or the run was cancelled.
+        """
+        with self._lock:
+            now = runControl.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait_seconds = max(0.0, -self._tokens / self.rate)
+            if deadline is not None and wait_seconds and now + wait_seconds >= deadline:
+                self._tokens += 1  # give the reservation back
+                return False
+        if wait_seconds and runControl.wait(wait_seconds):
+            return False
+        return True
+
+
+_rate_limiters = {}
+_host_settings = {}
+_latency_observers = {}
+_call_stats = threading.local()
+_transport = None
+
+
+def set_transport(transport):
+    """
+    Sends every request to `transport(method, url, timeout=..., **kwargs)`
+    instead of a QEM host (a fake QEM backend for simulations). None restores
+    the real sessions. Retries, deadlines, rate limits and circuit breakers
+    still apply.
+    """
+    global _transport
+    _transport = transport
+
+
+def reset_call_stats():
+    """
+    Starts counting the calls made by the current thread (one task at a time per worker).
+    """
+    _call_stats.api_calls = 0
+    _call_stats.action_requests = 0
+    _call_stats.unauthorized = 0
+
+
+def get_call_stats():
+    """
+    Returns the calls counted for the current thread since reset_call_stats().
+    """
+    return {'api_calls': getattr(_call_stats, 'api_calls', 0),
+            'action_requests': getattr(_call_stats, 'action_requests', 0),
+            'unauthorized': getattr(_call_stats, 'unauthorized', 0)}
+
+
+def configure_host(qem_host, settings):
+    """
+    Applies a QEM host's resolved settings (its qem_hosts[].settings over
+    'settings'): the rate limit, the session pool size and the circuit
+    breaker thresholds of its servers. Call before the first request to the host.
+    """
+    _host_settings[(qem_host or "").lower()] = settings
+    set_rate_limit(qem_host, settings.get('api_rate_limit'))
+
+
+def set_rate_limit(qem_host, requests_per_second):
+    """
+    Limits the request rate to one QEM host. None or 0 removes the limit.
+    """
+    key = (qem_host or "").lower()
+    if requests_per_second:
+        _rate_limiters[key] = RateLimiter(requests_per_second)
+        logger.info("Rate limit for QEM host '%s': %s requests/second.", qem_host, requests_per_second)
+    else:
+        _rate_limiters.pop(key, None)
+
+
+def set_latency_observer(qem_host, observer):
+    """
+    Reports every call sent to a QEM host to `observer.record(latency_seconds,
+    failed)` (see adaptiveConcurrency). None removes the observer.
+    """
+    key = (qem_host or "").lower()
+    if observer:
+        _latency_observers[key] = observer
+    else:
+        _latency_observers.pop(key, None)
+
+
+def _request_not_sent(error):
+    """
+    True when the connection to QEM was never established, so the request
+    cannot have been applied and is safe to send again.
+    """
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def _backoff_delay(attempt):
+    delay = min(retry_policy['backoff_max'], retry_policy['backoff_base'] * (2 ** attempt))
+    return delay * random.uniform(0.5, 1.0)  # jitter so retrying workers do not stampede QEM
+
+
+def request(method, url, server=None, deadline=None, **kwargs):
+    """
+    Sends an HTTP request to QEM using the shared session and retry policy.
+
+    - Every attempt has a connect and read timeout, shortened so it never runs
+      past the deadline (a runControl.monotonic() value) when one is given.
+    - Idempotent requests are retried with exponential backoff on connection
+      errors, timeouts and 5xx responses.
+    - Action POSTs are only retried when the connection could not be opened,
+      i.e. the request never reached QEM. Any other failure is returned to the
+      caller, which must confirm the task state before issuing the action again.
+    - Calls for a replicate server go through that server's circuit breaker.
+    - Each QEM host has its own session, settings and optional rate limit
+      (configure_host) and optional latency observer (set_latency_observer).
+    - The run deadline (runControl) caps the deadline, and cancellation stops retrying.
+
+    Returns:
+        requests.Response: the last response received (may be a 5xx once retries are exhausted).
+
+    Raises:
+        requests.exceptions.RequestException: when no response could be obtained,
+        including DeadlineExceeded and circuitBreaker.CircuitOpenError.
+    """
+    method = method.upper()
+    idempotent = method in IDEMPOTENT_METHODS
+    qem_host = urllib.parse.urlsplit(url).netloc.lower()
+    breaker = circuitBreaker.get_breaker(server, qem_host, _host_settings.get(qem_host)) if server else None
+    rate_limiter = _rate_limiters.get(qem_host)
+    observer = _latency_observers.get(qem_host)
+    deadline = runControl.clamp_deadline(deadline)
+    attempt = 0
+
+    while True:
+        connect_timeout = retry_policy['connect_timeout']
+        read_timeout = retry_policy['read_timeout']
+        if deadline is not None:
+            remaining = deadline - runControl.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceeded(f"Deadline exceeded before {method} {url}")
+            connect_timeout = min(connect_timeout, remaining)
+            read_timeout = min(read_timeout, remaining)
+
+        if rate_limiter:
+            limited_at = runControl.monotonic()
+            acquired = rate_limiter.acquire(deadline)
+            if tracing.is_enabled() and runControl.monotonic() - limited_at > 0.001:
+                # Only waits that actually throttled the call, not every token taken
+                tracing.complete("rate limit", limited_at, runControl.monotonic(), cat='sleep', host=qem_host)
+            if not acquired:
+                raise DeadlineExceeded(f"Deadline or cancellation while rate limited before {method} {url}")
+
+        if breaker and not breaker.allow_request():
+            raise circuitBreaker.CircuitOpenError(f"Circuit open for server '{server}'; request not sent.")
+
+        _call_stats.api_calls = getattr(_call_stats, 'api_calls', 0) + 1
+        if method == 'POST':
+            _call_stats.action_requests = getattr(_call_stats, 'action_requests', 0) + 1
+
+        response = None
+        error = None
+        sent_at = runControl.monotonic()
+        try:
+            send = _transport or get_session(qem_host).request
+            response = send(method, url, timeout=(connect_timeout, read_timeout), **kwargs)
+        except requests.exceptions.RequestException as e:
+            error = e
+        if tracing.is_enabled():
+            tracing.complete(f"HTTP {method}", sent_at, runControl.monotonic(), cat='http',
+                             path=urllib.parse.urlsplit(url).path, attempt=attempt + 1,
+                             status=response.status_code if error is None else repr(error))
+        if observer:
+            observer.record(runControl.monotonic() - sent_at,
+                            error is not None or response.status_code >= 500 or response.status_code == 429)
+
+        if error is None and response.status_code < 500:
+            if response.status_code == 401:  # expired or invalid QEM session
+                _call_stats.unauthorized = getattr(_call_stats, 'unauthorized', 0) + 1
+            if breaker:
+                breaker.record_success()
+            return response
+        if breaker:
+            breaker.record_failure()
+
+        if error is not None:
+            retryable = idempotent or _request_not_sent(error)
+        else:
+            retryable = idempotent
+        delay = _backoff_delay(attempt)
+        out_of_time = deadline is not None and runControl.monotonic() + delay >= deadline
+        if not retryable or attempt >= retry_policy['max_retries'] or out_of_time:
+            if error is not None:
+                raise error
+            return response
+
+        attempt += 1
+        logger.warning("%s %s failed (%s). Retry %d/%d in %.1f seconds.",
+                       method, url, error or f"HTTP {response.status_code}",
+                       attempt, retry_policy['max_retries'], delay)
+        with tracing.span("retry backoff", cat='sleep', attempt=attempt):
+            cancelled = runControl.wait(delay)
+        if cancelled:
+            if error is not None:
+                raise error
+            return response
@@ -8,6 +8,7 @@ import warnings
 import requests
 from qemTasksHandler.myLogger import get_logger
 from qemTasksHandler import  configParser
+from restAPI import httpClient
 
 
 config = configParser.load_config()
@@ -44,7 +45,7 @@ def login_api(url: str, username: str, credentials: str) -> str | None:
 
     logger.info("Logging in to QEM server at %s with user %s", login_url, username)
     try:
-        response = requests.get(login_url, headers=headers, verify=False)
+        response = httpClient.request('GET', login_url, headers=headers, verify=False)
         response.raise_for_status()
 
         session_id = response.headers.get('EnterpriseManager.APISessionID')
@@ -3,12 +3,11 @@
 # Author: Vinay Vitta | Qlik PS
 # Created: Aug 2025
 
-import time
 import warnings
 import requests
-from qemTasksHandler import configParser
+from qemTasksHandler import configParser, runControl, tracing
 from qemTasksHandler.myLogger import get_logger
-from restAPI import getTaskDetails, login
+from restAPI import circuitBreaker, getTaskDetails, httpClient, login
 
 config = configParser.load_config()
 logger = get_logger(config)
@@ -18,7 +17,18 @@ logger = get_logger(config)
 warnings.filterwarnings("ignore", category=requests.packages.urllib3.exceptions.InsecureRequestWarning)
 
 
-def resume_task(qem_url, server, task, login_token):
+def send_resume_request(qem_url, server, task, login_token, deadline=None):
+    """
+    Sends one RESUME_PROCESSING run request for a task without checking its state first
+    (see resume_task and twoPhase). Returns the requests.Response; raises
+    requests exceptions like httpClient.request.
+    """
+    url = 'https://' + f"{qem_url.rstrip('/')}/attunityenterprisemanager/api/v1/servers/{server}/tasks/{task}?action=run&option=RESUME_PROCESSING"
+    return httpClient.request('POST', url, server=server, deadline=deadline,
+                              headers={"EnterpriseManager.APISessionID": login_token}, verify=False)
+
+
+def resume_task(qem_url, server, task, login_token, confirm_full_load=False):
     """
     Attempts to resume a task on the QEM server if it is not already running.
     Repeatedly sends resume requests while polling the task status until it
@@ -29,19 +39,27 @@ def resume_task(qem_url, server, task, login_token):
         server (str): Server hosting the task.
         task (str): Task name to resume.
         login_token (str): Authentication token.
+        confirm_full_load (bool): Refuse to act while the task is in active full load
+            (its pre-check came from the discovery cache).
 
     Returns:
         str: "ResumeSuccess" if task is running or successfully resumed,
+             "Blocked_FullLoad" if confirm_full_load found an active full load,
              None otherwise.
     """
     logger.info("Initiating QEM REST API RESUME task...")
     logger.info(f"Checking task '{task}' status on server '{server}' before resume...")
 
-    task_details = getTaskDetails.get_task_details(qem_url, server, task, login_token)
+    with tracing.span("pre-check", server=server, task=task):
+        task_details = getTaskDetails.get_task_details(qem_url, server, task, login_token)
     if not task_details or "memory_mb" not in task_details:
         logger.error(f"Unable to retrieve details for task '{task}'. Aborting resume.")
         return None
 
+    if confirm_full_load and not task_details.get("full_load_completed"):
+        logger.error(f"Task '{task}' is in active full load (cached pre-check is out of date). Not resuming it.")
+        return "Blocked_FullLoad"
+
     task_mem = task_details["memory_mb"]
     if task_mem >= 1:
         logger.info(f"Task '{task}' is already running. Skipping resume.")
@@ -49,7 +67,6 @@ def resume_task(qem_url, server, task, login_token):
 
     logger.info(f"Task '{task}' is not running (Memory: {task_mem} MB). Proceeding to resume.")
 
-    resume_url = 'https://' + f"{qem_url.rstrip('/')}/attunityenterprisemanager/api/v1/servers/{server}/tasks/{task}?action=run&option=RESUME_PROCESSING"
 
     # Load config values
     try:
@@ -66,16 +83,33 @@ def resume_task(qem_url, server, task, login_token):
         max_resume_api_retries = 3
 
     timeout_seconds = timeout_minutes * 60
-    elapsed_time = 0
+    # Every HTTP call below shares this budget, so no retry or hung connection can outlive resume_timeout
+    deadline = runControl.clamp_deadline(runControl.monotonic() + timeout_seconds)
     polling_retry_counter = 0
     api_resume_attempts = 0
 
-    while elapsed_time < timeout_seconds and polling_retry_counter < max_polling_retries:
-        task_details = getTaskDetails.get_task_details(qem_url, server, task, login_token)
+    while runControl.monotonic() < deadline and polling_retry_counter < max_polling_retries:
+        if runControl.is_cancelled():
+            logger.warning(f"Resume of task '{task}' cancelled: {runControl.cancel_reason()}")
+            return "Cancelled"
+
+        # Always confirm the current state before (re-)issuing the resume action
+        with tracing.span("poll", server=server, task=task, poll=polling_retry_counter + 1) as poll_span:
+            try:
+                task_details = getTaskDetails.get_task_details(qem_url, server, task, login_token, deadline=deadline)
+            except circuitBreaker.CircuitOpenError:
+                raise
+            except requests.exceptions.RequestException as e:
+                logger.warning(f"Task details request failed for '{task}' while waiting for resume: {e}")
+                task_details = None
+            if isinstance(task_details, dict):
+                poll_span.args['state'] = task_details.get("state")
+
         if task_details and "memory_mb" in task_details:
             mem_usage = task_details["memory_mb"]
             if mem_usage >= 1:
                 logger.info(f"Task '{task}' resumed successfully (Memory: {mem_usage} MB)")
+                tracing.instant("state confirmed", server=server, task=task, state=task_details.get("state"))
                 return "ResumeSuccess"
 
             logger.info(f"Task '{task}' still not running (Memory: {mem_usage} MB)")
@@ -83,15 +117,19 @@ def resume_task(qem_url, server, task, login_token):
             # Send resume API request if we still have retries left
             if api_resume_attempts < max_resume_api_retries:
                 logger.info(f"Sending resume request attempt {api_resume_attempts + 1}/{max_resume_api_retries} for task '{task}'")
-                response = requests.post(
-                    url=resume_url,
-                    headers={"EnterpriseManager.APISessionID": login_token},
-                    verify=False
-                )
-                if response.status_code == 200:
-                    logger.info(f"Resume request succeeded on attempt {api_resume_attempts + 1} for task '{task}'")
-                else:
-                    logger.warning(f"Resume request failed on attempt {api_resume_attempts + 1} with status {response.status_code}: {response.content}")
+                with tracing.span(f"POST resume #{api_resume_attempts + 1}", server=server, task=task) as post_span:
+                    try:
+                        response = send_resume_request(qem_url, server, task, login_token, deadline)
+                        post_span.args['status'] = response.status_code
+                        if response.status_code == 200:
+                            logger.info(f"Resume request succeeded on attempt {api_resume_attempts + 1} for task '{task}'")
+                        else:
+                            logger.warning(f"Resume request failed on attempt {api_resume_attempts + 1} with status {response.status_code}: {response.content}")
+                    except circuitBreaker.CircuitOpenError:
+                        raise
+                    except requests.exceptions.RequestException as e:
+                        # The request may still have been applied; the next poll confirms the state first
+                        logger.warning(f"Resume request attempt {api_resume_attempts + 1} for task '{task}' got no response: {e}")
                 api_resume_attempts += 1
             else:
                 logger.debug(f"Max resume API retries ({max_resume_api_retries}) reached, not sending further resume requests.")
@@ -99,9 +137,15 @@ def resume_task(qem_url, server, task, login_token):
             logger.warning(f"Unable to fetch task details for '{task}' while waiting for resume.")
 
         polling_retry_counter += 1
+        remaining = deadline - runControl.monotonic()
+        if remaining <= 0:
+            break
         logger.info(f"Polling retry {polling_retry_counter}/{max_polling_retries} — waiting {check_interval} seconds before next check")
-        time.sleep(check_interval)
-        elapsed_time += check_interval
+        with tracing.span("sleep", cat='sleep', server=server, task=task):
+            cancelled = runControl.wait(min(check_interval, remaining))
+        if cancelled:
+            logger.warning(f"Resume of task '{task}' cancelled while waiting: {runControl.cancel_reason()}")
+            return "Cancelled"
 
     logger.error(f"Resume failed for task '{task}': timeout ({timeout_minutes} min) or max retries ({max_polling_retries}) reached.")
     return None
@@ -4,12 +4,11 @@
 # Created: Aug 2025
 
 
-import time
 import warnings
 import requests
-from qemTasksHandler import configParser
+from qemTasksHandler import configParser, runControl, tracing
 from qemTasksHandler.myLogger import get_logger
-from restAPI import getTaskDetails, login
+from restAPI import circuitBreaker, getTaskDetails, httpClient, login
 
 config = configParser.load_config()
 logger = get_logger(config)
@@ -19,7 +18,18 @@ logger = get_logger(config)
 warnings.filterwarnings("ignore", category=requests.packages.urllib3.exceptions.InsecureRequestWarning)
 
 
-def stop_task(qem_url, server, task, login_token):
+def send_stop_request(qem_url, server, task, login_token, deadline=None):
+    """
+    Sends one stop request for a task without checking its state first
+    (see stop_task and twoPhase). Returns the requests.Response; raises
+    requests exceptions like httpClient.request.
+    """
+    url = 'https://' + f"{qem_url.rstrip('/')}/attunityenterprisemanager/api/v1/servers/{server}/tasks/{task}?action=stop"
+    return httpClient.request('POST', url, server=server, deadline=deadline,
+                              headers={'EnterpriseManager.APISessionID': login_token}, verify=False)
+
+
+def stop_task(qem_url, server, task, login_token, confirm_full_load=False):
     """
     Attempts to stop a task on the QEM server if it is currently running.
     Repeatedly sends the stop API request (up to max_stop_api_retries) while polling
@@ -30,18 +40,26 @@ def stop_task(qem_url, server, task, login_token):
         server (str): Server hosting the task.
         task (str): Task name.
         login_token (str): Authentication token.
+        confirm_full_load (bool): Refuse to act while the task is in active full load
+            (its pre-check came from the discovery cache).
 
     Returns:
-        str: "StopSuccess" if stopped successfully, None otherwise.
+        str: "StopSuccess" if stopped successfully, "Blocked_FullLoad" if
+             confirm_full_load found an active full load, None otherwise.
     """
     logger.info("Initiating QEM REST API STOP task...")
     logger.info(f"Checking status of task '{task}' on server '{server}' before initiating STOP")
 
-    task_details = getTaskDetails.get_task_details(qem_url, server, task, login_token)
+    with tracing.span("pre-check", server=server, task=task):
+        task_details = getTaskDetails.get_task_details(qem_url, server, task, login_token)
     if not task_details or "memory_mb" not in task_details:
         logger.error(f"Failed to retrieve task details for '{task}'. Exiting.")
         return None
 
+    if confirm_full_load and not task_details.get("full_load_completed"):
+        logger.error(f"Task '{task}' is in active full load (cached pre-check is out of date). Not stopping it.")
+        return "Blocked_FullLoad"
+
     task_mem_usage = task_details["memory_mb"]
     if task_mem_usage == 0:
         logger.info(f"Task '{task}' is already stopped. No action needed.")
@@ -64,20 +82,36 @@ def stop_task(qem_url, server, task, login_token):
         max_stop_api_retries = 3
 
     timeout_seconds = timeout_minutes * 60
-    stop_task_url = 'https://' + f"{qem_url.rstrip('/')}/attunityenterprisemanager/api/v1/servers/{server}/tasks/{task}?action=stop"
 
-    elapsed_time = 0
+    # Every HTTP call below shares this budget, so no retry or hung connection can outlive stop_timeout
+    deadline = runControl.clamp_deadline(runControl.monotonic() + timeout_seconds)
     polling_retry_counter = 0
     api_stop_attempts = 0
 
-    while elapsed_time < timeout_seconds and polling_retry_counter < max_polling_retries:
-        task_details = getTaskDetails.get_task_details(qem_url, server, task, login_token)
+    while runControl.monotonic() < deadline and polling_retry_counter < max_polling_retries:
+        if runControl.is_cancelled():
+            logger.warning(f"Stop of task '{task}' cancelled: {runControl.cancel_reason()}")
+            return "Cancelled"
+
+        # Always confirm the current state before (re-)issuing the stop action
+        with tracing.span("poll", server=server, task=task, poll=polling_retry_counter + 1) as poll_span:
+            try:
+                task_details = getTaskDetails.get_task_details(qem_url, server, task, login_token, deadline=deadline)
+            except circuitBreaker.CircuitOpenError:
+                raise
+            except requests.exceptions.RequestException as e:
+                logger.warning(f"Task details request failed for '{task}' while waiting for stop: {e}")
+                task_details = None
+            if isinstance(task_details, dict):
+                poll_span.args['state'] = task_details.get("state")
+
         if task_details and "memory_mb" in task_details:
             task_mem_usage = task_details["memory_mb"]
             task_state = task_details.get("state", "UNKNOWN")
 
             if task_mem_usage == 0 and task_state != "RUNNING":
                 logger.info(f"Task '{task}' has stopped successfully.")
+                tracing.instant("state confirmed", server=server, task=task, state=task_state)
                 return "StopSuccess"
 
             logger.info(f"Task '{task}' still running. Memory: {task_mem_usage} MB, State: {task_state}")
@@ -85,15 +119,19 @@ def stop_task(qem_url, server, task, login_token):
             # If we still have stop API retries left, send stop request again
             if api_stop_attempts < max_stop_api_retries:
                 logger.info(f"Sending stop request attempt {api_stop_attempts + 1}/{max_stop_api_retries} for task '{task}'")
-                response = requests.post(
-                    url=stop_task_url,
-                    headers={'EnterpriseManager.APISessionID': login_token},
-                    verify=False
-                )
-                if response.status_code == 200:
-                    logger.info(f"Stop request succeeded on attempt {api_stop_attempts + 1} for task '{task}'")
-                else:
-                    logger.warning(f"Stop request failed on attempt {api_stop_attempts + 1} with status {response.status_code}: {response.content}")
+                with tracing.span(f"POST stop #{api_stop_attempts + 1}", server=server, task=task) as post_span:
+                    try:
+                        response = send_stop_request(qem_url, server, task, login_token, deadline)
+                        post_span.args['status'] = response.status_code
+                        if response.status_code == 200:
+                            logger.info(f"Stop request succeeded on attempt {api_stop_attempts + 1} for task '{task}'")
+                        else:
+                            logger.warning(f"Stop request failed on attempt {api_stop_attempts + 1} with status {response.status_code}: {response.content}")
+                    except circuitBreaker.CircuitOpenError:
+                        raise
+                    except requests.exceptions.RequestException as e:
+                        # The request may still have been applied; the next poll confirms the state first
+                        logger.warning(f"Stop request attempt {api_stop_attempts + 1} for task '{task}' got no response: {e}")
                 api_stop_attempts += 1
             else:
                 logger.debug(f"Max stop API retries ({max_stop_api_retries}) reached, not sending further stop requests.")
@@ -101,9 +139,15 @@ def stop_task(qem_url, server, task, login_token):
             logger.warning(f"Could not retrieve task details while waiting for '{task}' to stop.")
 
         polling_retry_counter += 1
+        remaining = deadline - runControl.monotonic()
+        if remaining <= 0:
+            break
         logger.info(f"Polling retry {polling_retry_counter}/{max_polling_retries} — waiting {check_interval} seconds before next check")
-        time.sleep(check_interval)
-        elapsed_time += check_interval
+        with tracing.span("sleep", cat='sleep', server=server, task=task):
+            cancelled = runControl.wait(min(check_interval, remaining))
+        if cancelled:
+            logger.warning(f"Stop of task '{task}' cancelled while waiting: {runControl.cancel_reason()}")
+            return "Cancelled"
 
     logger.error(f"Task '{task}' did not stop after {timeout_minutes} minutes or {max_polling_retries} polling retries.")
     return None
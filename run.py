@@ -10,13 +10,38 @@ Examples:
     python run.py --action resume
     python run.py --action stop --mode S
     python run.py --action resume --mode F --file tasks.csv --server MyServer
+    python run.py --action restart --mode S
+    python run.py --action status --mode A --format json
+    python run.py --action stop --mode A --dry-run
+    python run.py --action stop --deadline 20
+    python run.py --action stop --mode A --processes 4
+    python run.py --action restart --mode S --trace
+    python run.py --action resume --mode S --daemon --interval 15
+    python run.py --serve --port 8787
+    python run.py history --action resume --by server
+    python run.py simulate --action resume --servers 50 --tasks-per-server 200 --threads 100
 """
 
+import sys
 import argparse
-from qemTasksHandler import main, configParser
+from qemTasksHandler import configParser
+
+# Everything else (requests, the REST API modules, SMTP, SQLite, the HTTP server) is imported by the
+# branch that needs it, so --help and argument errors return without loading it (see benchmark_startup.py)
 
 
 def main_launcher():
+    # --- Sub-command: run history ---
+    if len(sys.argv) > 1 and sys.argv[1] == "history":
+        from qemTasksHandler import history
+        history.history_command(sys.argv[2:])
+        return
+    # --- Sub-command: virtual-clock simulation against a fake QEM ---
+    if len(sys.argv) > 1 and sys.argv[1] == "simulate":
+        from qemTasksHandler import simulator
+        simulator.simulate_command(sys.argv[2:])
+        return
+
     # Load configuration from YAML to get defaults
     config = configParser.load_config()
     yaml_mode = config['settings'].get('mode', 'A').upper()
@@ -24,8 +49,8 @@ def main_launcher():
     # --- CLI Arguments ---
     parser = argparse.ArgumentParser(description="Run or Stop QEM tasks")
     parser.add_argument(
-        "--action", type=str, choices=["resume", "stop"], required=True,
-        help="Action to perform: resume or stop"
+        "--action", type=str, choices=["resume", "stop", "restart", "status"],
+        help="Action to perform: resume, stop, restart or status (read-only snapshot) (required unless --serve)"
     )
     parser.add_argument(
         "--mode", type=str, choices=["S", "A", "F"], default=yaml_mode,
@@ -39,8 +64,64 @@ def main_launcher():
         "--server", type=str,
         help="Replicate server name (required if mode=F)"
     )
+    parser.add_argument(
+        "--format", type=str, choices=["csv", "json"], default="csv",
+        help="File format for --action status and --dry-run (default: csv)"
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true",
+        help="Discovery and pre-check only: write the execution plan with an API call and duration estimate"
+    )
+    parser.add_argument(
+        "--deadline", type=float,
+        help="Optional run deadline in minutes; unfinished tasks are cancelled and reported when it passes"
+    )
+    parser.add_argument(
+        "--processes", type=int,
+        help="Shard replicate servers across N worker processes (overrides settings.processes)"
+    )
+    parser.add_argument(
+        "--trace", action="store_true", default=None,
+        help="Write a per-task execution timeline (Chrome trace JSON, open in Perfetto) next to the report"
+    )
+    parser.add_argument(
+        "--daemon", action="store_true",
+        help="Keep running and reconcile tasks towards the action's state (resume=RUNNING, stop=STOPPED)"
+    )
+    parser.add_argument(
+        "--interval", type=float,
+        help="Seconds between reconcile cycles in --daemon mode (overrides settings.daemon_interval_seconds)"
+    )
+    parser.add_argument(
+        "--serve", action="store_true",
+        help="Start the local HTTP control API instead of running once"
+    )
+    parser.add_argument(
+        "--port", type=int,
+        help="Port for --serve (overrides settings.control_api_port)"
+    )
     args = parser.parse_args()
 
+    if args.serve:
+        from qemTasksHandler import controlServer
+        controlServer.serve(port=args.port)
+        return
+    if not args.action:
+        parser.error("--action is required (unless --serve is used).")
+
+    if args.daemon and args.action in ("restart", "status"):
+        parser.error("--daemon supports only --action resume or stop.")
+    if args.action == "status" and args.mode.upper() == "F":
+        parser.error("--action status supports only --mode S or A.")
+    if args.dry_run and (args.daemon or args.action == "status"):
+        parser.error("--dry-run supports only a single resume, stop or restart run.")
+    if args.daemon and args.mode.upper() == "F":
+        parser.error("--daemon supports only --mode S or A.")
+    if args.interval and not args.daemon:
+        parser.error("--interval can only be used with --daemon.")
+    if args.trace and (args.daemon or args.dry_run or args.action == "status"):
+        parser.error("--trace supports only a single resume, stop or restart run.")
+
     # --- Mode F Validation ---
     if args.mode.upper() == "F":
         if args.action.lower() != "resume":
@@ -65,14 +146,57 @@ def main_launcher():
         print(f" Task File: {args.file}")
     if args.server:
         print(f" Target Server Override: {args.server}")
+    if args.deadline:
+        print(f" Run Deadline: {args.deadline} minutes")
+    if args.processes:
+        print(f" Processes: {args.processes}")
+    if args.dry_run:
+        print(f" Dry Run: nothing is stopped or resumed")
+    if args.trace:
+        print(f" Trace: execution timeline written next to the report")
+    if args.daemon:
+        print(f" Daemon: reconciling every {args.interval or 'configured'} seconds (Ctrl-C to stop)")
     print("=" * 60)
 
+    if main_action == "status":
+        from qemTasksHandler import fleetStatus
+        snapshot_path = fleetStatus.run_status(mode=tasks_selection_mode, output_format=args.format)
+        print(f" Status snapshot: {snapshot_path}")
+        return
+
+    if args.dry_run:
+        from qemTasksHandler import planner
+        plan_path, summaries = planner.run_dry_run(action=main_action, mode=tasks_selection_mode,
+                                                   file_path=args.file, override_server=args.server,
+                                                   processes=args.processes, output_format=args.format)
+        for summary in summaries:
+            if summary.get('error'):
+                print(f" {summary['qem_host']}: {summary['error']}")
+                continue
+            print(f" {summary['qem_host']}: {summary['to_change']} to {main_action}, "
+                  f"{summary['already_in_target_state']} already done, {summary['blocked_full_load']} blocked, "
+                  f"{summary['deferred_full_load']} deferred, {summary['errors']} error(s)")
+            print(f"   ~{summary['api_calls']} API calls (max {summary['max_api_calls']}), "
+                  f"~{summary['expected_seconds'] / 60:.1f} min on {summary['workers']} threads "
+                  f"(max {summary['max_seconds'] / 60:.1f} min)" + ("  RUN WOULD ABORT" if summary['would_abort'] else ""))
+        print(f" Plan: {plan_path}")
+        return
+
+    if args.daemon:
+        from qemTasksHandler import reconciler
+        reconciler.run_daemon(action=main_action, mode=tasks_selection_mode, interval_seconds=args.interval)
+        return
+
     # --- Call Main Logic ---
+    from qemTasksHandler import main
     main.run_tasks(
         action=main_action,
         mode=tasks_selection_mode,
         file_path=args.file,
-        override_server=args.server
+        override_server=args.server,
+        deadline_minutes=args.deadline,
+        processes=args.processes,
+        trace=args.trace
     )
 
 